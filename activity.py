@@ -0,0 +1,246 @@
+"""
+A per-user index of activity by day, for features over windows of time.
+
+An :class:`ActivityIndex` is fed a user's calls and smss once and keeps, for
+each day with a valid datetime, the number of calls, their duration, the
+number of smss and the contacts interacted with. `ActivityIndex.daily` turns
+it into a :class:`DailyActivity`: the active days as sorted arrays with
+prefix sums of each count, so the totals of any window of days, e.g. the last
+30 days, are a pair of bisections rather than a scan of the logs. Adding a
+windowed feature to `activity_features` costs O(days), not O(records).
+
+Windows end on the user's last active day, since the logs are historical and
+there is no "now" to count back from.
+"""
+from bisect import bisect_left
+from collections import defaultdict
+from datetime import date
+from utils import ave_or_none
+
+
+# The lengths, in days, of the windows of the `_last_<n>_days` features.
+ACTIVITY_WINDOWS = (7, 30, 90)
+# The number of days compared by `activity_trend`.
+TREND_WINDOW = 30
+ACTIVITY_COLUMNS = tuple(
+    ["interactions_last_{}_days".format(n) for n in ACTIVITY_WINDOWS] +
+    ["contacts_last_{}_days".format(n) for n in ACTIVITY_WINDOWS] +
+    [
+        "ave_monthly_calls",
+        "ave_monthly_sms",
+        "ave_monthly_duration(s)",
+        "max_days_between_activity",
+        "activity_trend",
+    ]
+)
+# The columns of `ACTIVITY_COLUMNS` that count interactions, contacts or days,
+# the others are averages and ratios.
+ACTIVITY_COUNT_COLUMNS = (
+    ACTIVITY_COLUMNS[:2 * len(ACTIVITY_WINDOWS)] +
+    ("max_days_between_activity",)
+)
+
+
+def prefix_sums(counts):
+    """
+    Returns :class:`list` of the sums of the first 0, 1, ..., n counts.
+    """
+    sums = [0]
+    total = 0
+    for count in counts:
+        total += count
+        sums.append(total)
+    return sums
+
+
+def months_spanned(first_day, last_day):
+    """
+    Returns the number of calendar months from the month of `first_day` to
+    the month of `last_day`, both day ordinals, inclusive.
+    """
+    first = date.fromordinal(first_day)
+    last = date.fromordinal(last_day)
+    return (last.year - first.year) * 12 + last.month - first.month + 1
+
+
+class DailyActivity(object):
+    """
+    The activity of a user on each of their active days, in sorted arrays.
+
+    Parameters:
+        days (:class:`list`): The sorted ordinals of the active days.
+        calls (:class:`list`): The number of calls on each day.
+        durations (:class:`list`): The seconds of calls on each day.
+        smss (:class:`list`): The number of smss on each day.
+        contacts (:class:`list`): The number of distinct contacts
+            interacted with on each day.
+        contact_last_days (:class:`list`): The sorted ordinals of the last
+            day each contact was interacted with.
+    """
+    def __init__(
+        self, days, calls, durations, smss, contacts, contact_last_days
+    ):
+        self.days = days
+        self.contact_last_days = contact_last_days
+        self.sums = {
+            "calls": prefix_sums(calls),
+            "durations": prefix_sums(durations),
+            "smss": prefix_sums(smss),
+            "contacts": prefix_sums(contacts),
+        }
+
+    def total(self, column, start=None, end=None):
+        """
+        Returns the total of `column`, e.g. "calls", over the days from
+        `start` up to, but not including, `end`, or over every day.
+        """
+        sums = self.sums[column]
+        first = 0 if start is None else bisect_left(self.days, start)
+        last = len(self.days) if end is None else bisect_left(self.days, end)
+        return sums[last] - sums[first]
+
+    def interactions(self, start=None, end=None):
+        return self.total("calls", start, end) + self.total("smss", start, end)
+
+    def contacts_since(self, start):
+        """
+        Returns the number of distinct contacts interacted with from `start`
+        on.
+        """
+        return len(self.contact_last_days) - bisect_left(
+            self.contact_last_days, start
+        )
+
+    def max_gap(self):
+        """
+        Returns the most days between two consecutive active days, or None
+        if there are fewer than two.
+        """
+        days = self.days
+        if len(days) < 2:
+            return None
+        return max(later - earlier for earlier, later in zip(days, days[1:]))
+
+
+def activity_features(daily):
+    """
+    Returns :class:`dict` of the windowed features of a
+    :class:`DailyActivity`, keyed by `ACTIVITY_COLUMNS`. Every value is None
+    if the user has no activity with a valid datetime.
+    """
+    if not daily.days:
+        return dict.fromkeys(ACTIVITY_COLUMNS)
+    # Windows end on, and include, the last active day.
+    end = daily.days[-1] + 1
+    features = {}
+    for n in ACTIVITY_WINDOWS:
+        features["interactions_last_{}_days".format(n)] = (
+            daily.interactions(end - n, end)
+        )
+        features["contacts_last_{}_days".format(n)] = (
+            daily.contacts_since(end - n)
+        )
+    num_months = months_spanned(daily.days[0], daily.days[-1])
+    features["ave_monthly_calls"] = ave_or_none(
+        daily.total("calls"), num_months
+    )
+    features["ave_monthly_sms"] = ave_or_none(daily.total("smss"), num_months)
+    features["ave_monthly_duration(s)"] = ave_or_none(
+        daily.total("durations"), num_months
+    )
+    features["max_days_between_activity"] = daily.max_gap()
+    # The interactions of the last `TREND_WINDOW` days relative to the
+    # window before them.
+    features["activity_trend"] = ave_or_none(
+        daily.interactions(end - TREND_WINDOW, end),
+        daily.interactions(end - 2 * TREND_WINDOW, end - TREND_WINDOW)
+    )
+    return features
+
+
+class ActivityIndex(object):
+    """
+    Collects the activity of a user by day, one chunk of records at a time.
+    Records without a valid datetime are skipped.
+
+    Attributes:
+        day_counts (:class:`dict`): Maps each active :class:`date` to its
+            [calls, duration, smss].
+        day_contacts (:class:`dict`): Maps each active :class:`date` to the
+            :class:`set` of contacts interacted with that day.
+    """
+    def __init__(self):
+        self.day_counts = {}
+        self.day_contacts = defaultdict(set)
+
+    def _counts(self, day):
+        counts = self.day_counts.get(day)
+        if counts is None:
+            counts = self.day_counts[day] = [0, 0, 0]
+        return counts
+
+    def add_calls(self, days, contacts, durations):
+        """
+        Parameters:
+            days (:class:`list`): The :class:`date` of each call or None.
+            contacts (:class:`list`): The contact of each call, falsy if it
+                has no address.
+            durations (:class:`list`): The seconds of each call.
+        """
+        day_contacts = self.day_contacts
+        for day, contact, duration in zip(days, contacts, durations):
+            if day is None:
+                continue
+            counts = self._counts(day)
+            counts[0] += 1
+            counts[1] += duration
+            if contact:
+                day_contacts[day].add(contact)
+
+    def add_smss(self, days, contacts):
+        day_contacts = self.day_contacts
+        for day, contact in zip(days, contacts):
+            if day is None:
+                continue
+            self._counts(day)[2] += 1
+            if contact:
+                day_contacts[day].add(contact)
+
+    def merge(self, other, contact_ids=None):
+        """
+        Adds the activity of `other`. If given, `contact_ids` maps the
+        contacts of `other` to the contacts of this index.
+        """
+        for day, other_counts in other.day_counts.items():
+            counts = self._counts(day)
+            for i, count in enumerate(other_counts):
+                counts[i] += count
+        for day, contacts in other.day_contacts.items():
+            if contact_ids is not None:
+                contacts = [contact_ids[contact] for contact in contacts]
+            self.day_contacts[day].update(contacts)
+
+    def daily(self, contact_ids=None):
+        """
+        Returns the :class:`DailyActivity` of the index. If given,
+        `contact_ids` maps each contact to the contact it is counted as.
+        """
+        days = sorted(self.day_counts)
+        contact_last_days = {}
+        contacts_per_day = []
+        for day in days:
+            contacts = self.day_contacts.get(day, ())
+            if contact_ids is not None:
+                contacts = set(contact_ids[contact] for contact in contacts)
+            contacts_per_day.append(len(contacts))
+            ordinal = day.toordinal()
+            for contact in contacts:
+                contact_last_days[contact] = ordinal
+        return DailyActivity(
+            [day.toordinal() for day in days],
+            [self.day_counts[day][0] for day in days],
+            [self.day_counts[day][1] for day in days],
+            [self.day_counts[day][2] for day in days],
+            contacts_per_day,
+            sorted(contact_last_days.values())
+        )
@@ -0,0 +1,721 @@
+"""
+A corpus-wide batch engine, which builds the features of a batch of users at
+once with group-by reductions over tables of all of their records.
+
+Building features one user at a time, even with the vectorized extractors of
+`columnar.COLUMNAR_EXTRACTORS`, calls every extractor, and every NumPy
+function in it, once per user, which is mostly Python overhead when most
+users only have a few hundred records. :class:`BatchTables` concatenates the
+:class:`columnar.DeviceColumns` of a batch of users into one table per kind
+of record:
+ - calls: user, valid day, duration, whether it is outgoing and address,
+ - smss: user, device, valid day, address, body length, words and bad words,
+ - devices: user, number of contacts, hits of each phrase list and text
+    counts,
+keyed by the index of the user in the batch. Each user's addresses are
+offset into one address space, so an address id is unique in the batch. Every
+extractor of `BATCH_EXTRACTORS` is then a handful of sort based group-by
+reductions over the whole batch, `np.bincount` by user and `distinct_pairs`
+of (user, key), which cost the same few NumPy calls for 10 users or 10,000.
+
+Batches of `--batch-users` users keep memory bounded by the batch rather
+than the corpus. The values are the same as those of the extractors of
+`features.py`, which `benchmarks/differential.py` checks.
+
+NumPy is only needed when this module is used. To install it:
+```
+pip install numpy
+```
+"""
+from activity import ACTIVITY_WINDOWS, TREND_WINDOW
+from columnar import INVALID_TIME, SECONDS_PER_DAY
+from features import (
+    ALL_FEATURES, CONCENTRATION_CONTACTS, TOP_CONTACTS, format_phrase_hits,
+    get_sms_phrase_matcher
+)
+from phone import INTERNATIONAL, phone_number_flags
+from text_stats import TEXT_COUNTS, text_features
+numpy_installed = False
+try:
+    import numpy as np
+    numpy_installed = True
+except ImportError:
+    pass
+
+
+################################################################################
+#                              GROUP-BY
+################################################################################
+def group_count(users, num_users):
+    """
+    Returns the int64 array of the number of rows of each user.
+    """
+    return np.bincount(users, minlength=num_users).astype(np.int64)
+
+
+def group_sum(users, values, num_users):
+    """
+    Returns the int64 array of the sum of the integer `values` of each user's
+    rows, exact up to 2 ** 53.
+    """
+    if not len(users):
+        return np.zeros(num_users, dtype=np.int64)
+    return np.bincount(
+        users, weights=values, minlength=num_users
+    ).astype(np.int64)
+
+
+def pair_keys(majors, minors):
+    """
+    Returns the (keys, span, low) of int64 keys that sort like the (major,
+    minor) pairs of the non-negative `majors` and the `minors`, where
+    key = major * span + minor - low, or None if they do not fit in an int64.
+    Sorting one key is several times faster than `np.lexsort` of two.
+    """
+    low = int(minors.min())
+    span = int(minors.max()) - low + 1
+    if (int(majors.max()) + 1) * span >= 2 ** 63:
+        return None
+    return majors * span + (minors - low), span, low
+
+
+def pair_order(majors, minors):
+    """
+    Returns the indices that sort rows by their major, then their minor, int64
+    values.
+    """
+    if len(majors):
+        keys = pair_keys(majors, minors)
+        if keys is not None:
+            return np.argsort(keys[0])
+    return np.lexsort((minors, majors))
+
+
+def distinct_pairs(users, keys):
+    """
+    Returns the (users, keys) int64 arrays of the distinct (user, key) pairs,
+    sorted by user, then key.
+    """
+    if not len(users):
+        return users, keys
+    pairs = pair_keys(users, keys)
+    if pairs is not None:
+        pairs, span, low = pairs
+        pairs = np.unique(pairs)
+        return pairs // span, pairs % span + low
+    order = np.lexsort((keys, users))
+    users = users[order]
+    keys = keys[order]
+    first = np.ones(len(users), dtype=bool)
+    first[1:] = (users[1:] != users[:-1]) | (keys[1:] != keys[:-1])
+    return users[first], keys[first]
+
+
+def column(values, present=None):
+    """
+    Returns the (values, present) of an output column, where `present` is a
+    boolean array that is False for the users whose value is None, or None
+    if every user has a value.
+    """
+    return values, present
+
+
+def ave_column(totals, counts):
+    """
+    Returns the column of `utils.ave_or_none` of each user's total and count.
+    """
+    present = counts != 0
+    return column(
+        totals / np.where(present, counts, 1).astype(np.float64), present
+    )
+
+
+def column_values(values_present):
+    """
+    Returns :class:`list` of the value of a column for each user, as a Python
+    int, float or None.
+    """
+    values, present = values_present
+    values = values.tolist()
+    if present is None:
+        return values
+    return [
+        value if is_present else None
+        for value, is_present in zip(values, present.tolist())
+    ]
+
+
+################################################################################
+#                              TABLES
+################################################################################
+def concat_columns(arrays, dtype):
+    if not arrays:
+        return np.zeros(0, dtype=dtype)
+    return np.concatenate(arrays).astype(dtype, copy=False)
+
+
+def time_columns(times):
+    """
+    Returns the (valid, days) of an int64 array of times: whether each time
+    is a valid datetime, and its day since the epoch if it is.
+    """
+    return times != INVALID_TIME, times // SECONDS_PER_DAY
+
+
+class BatchTables(object):
+    """
+    The tables of the calls, smss and devices of a batch of users.
+
+    Parameters:
+        users (:class:`list`): The (devices, address_table) of each user: the
+            :class:`columnar.DeviceColumns` of each of their devices and
+            their :class:`columnar.AddressTable`.
+        normalize (:class:`bool`): Whether addresses with the same canonical
+            phone number count as the same contact.
+
+    Every `<table>_user` column holds the index of the user in `users` of
+    each row, every `<table>_valid` column whether its time is a valid
+    datetime, every `<table>_days` column its day if it is and every
+    `<table>_addresses` column the address id of each row in the batch, or
+    -1 if it has no address.
+    """
+    def __init__(self, users, normalize=False):
+        self.num_users = len(users)
+        self.normalize = normalize
+        self.address_tables = [address_table for _, address_table in users]
+        self.address_offsets = np.zeros(self.num_users + 1, dtype=np.int64)
+        np.cumsum(
+            [len(address_table.addresses) for address_table in
+             self.address_tables],
+            out=self.address_offsets[1:]
+        )
+        self.num_addresses = int(self.address_offsets[-1])
+
+        columns = dict((name, []) for name in (
+            "call_times", "call_durations", "call_outgoing", "call_addresses",
+            "sms_times", "sms_addresses", "sms_body_lengths", "sms_num_words",
+            "sms_num_bad_words",
+        ))
+        device_user = []
+        num_contacts = []
+        phrase_names = get_sms_phrase_matcher().names
+        phrase_hits = []
+        text_counts = []
+        for user, (devices, _) in enumerate(users):
+            for device in devices:
+                device_user.append(user)
+                num_contacts.append(device.num_contacts)
+                phrase_hits.append([
+                    device.sms_phrase_hits.get(name, 0)
+                    for name in phrase_names
+                ])
+                text_counts.append([
+                    device.sms_text_counts.get(name, 0)
+                    for name in TEXT_COUNTS
+                ])
+                for name, values in columns.items():
+                    values.append(getattr(device, name))
+
+        self.device_user = np.array(device_user, dtype=np.int64)
+        self.device_num_contacts = np.array(num_contacts, dtype=np.int64)
+        # The user, device and address offset of each row are repeated from
+        # the devices' in one go rather than filled in device by device.
+        device_offsets = self.address_offsets[self.device_user]
+        for prefix in ("call", "sms"):
+            lengths = [len(times) for times in columns[prefix + "_times"]]
+            addresses = concat_columns(
+                columns[prefix + "_addresses"], np.int64
+            )
+            setattr(self, prefix + "_user", np.repeat(
+                self.device_user, lengths
+            ))
+            setattr(self, prefix + "_addresses", np.where(
+                addresses >= 0,
+                addresses + np.repeat(device_offsets, lengths),
+                -1
+            ))
+            if prefix == "sms":
+                self.sms_device = np.repeat(
+                    np.arange(len(device_user), dtype=np.int64), lengths
+                )
+        self.call_valid, self.call_days = time_columns(
+            concat_columns(columns["call_times"], np.int64)
+        )
+        self.call_durations = concat_columns(
+            columns["call_durations"], np.int64
+        )
+        self.call_outgoing = concat_columns(columns["call_outgoing"], bool)
+        self.sms_valid, self.sms_days = time_columns(
+            concat_columns(columns["sms_times"], np.int64)
+        )
+        self.sms_body_lengths = concat_columns(
+            columns["sms_body_lengths"], np.int64
+        )
+        self.sms_num_words = concat_columns(
+            columns["sms_num_words"], np.int64
+        )
+        self.sms_num_bad_words = concat_columns(
+            columns["sms_num_bad_words"], np.int64
+        )
+        self.phrase_names = phrase_names
+        self.device_phrase_hits = np.array(
+            phrase_hits, dtype=np.int64
+        ).reshape(len(phrase_hits), len(phrase_names))
+        self.device_text_counts = np.array(
+            text_counts, dtype=np.int64
+        ).reshape(len(text_counts), len(TEXT_COUNTS))
+        self._address_strings = None
+        self._address_string_ids = None
+        self._address_users = None
+        self._contact_ids = None
+
+    def __len__(self):
+        return self.num_users
+
+    def address_users(self):
+        """
+        Returns the int64 array of the user of each address id.
+        """
+        if self._address_users is None:
+            self._address_users = np.repeat(
+                np.arange(self.num_users, dtype=np.int64),
+                np.diff(self.address_offsets)
+            )
+        return self._address_users
+
+    def address_flags(self, addresses, flag):
+        """
+        Returns the boolean array of whether `flag(address)` is true for each
+        address id of `addresses`, calling it once per distinct address
+        string, since many users share numbers. -1 is False.
+        """
+        if self._address_strings is None:
+            # The id of each address' string, shared by every user with it.
+            ids = {}
+            self._address_string_ids = np.array([
+                ids.setdefault(address, len(ids))
+                for address_table in self.address_tables
+                for address in address_table.addresses
+            ], dtype=np.int64)
+            self._address_strings = sorted(ids, key=ids.get)
+        has_address = addresses >= 0
+        string_ids, index = np.unique(
+            self._address_string_ids[addresses[has_address]],
+            return_inverse=True
+        )
+        flags = np.zeros(len(addresses), dtype=bool)
+        flags[has_address] = np.array([
+            bool(flag(self._address_strings[i])) for i in string_ids.tolist()
+        ], dtype=bool)[index]
+        return flags
+
+    def contacts(self, addresses):
+        """
+        Returns the int64 array of the contact each address id counts as: the
+        address itself or, if `normalize` is True, the first address of its
+        user with the same canonical phone number. -1 stays -1.
+        """
+        if not self.normalize or not self.num_addresses:
+            return addresses
+        if self._contact_ids is None:
+            self._contact_ids = np.concatenate([
+                address_table.number_ids() + offset
+                for address_table, offset in zip(
+                    self.address_tables, self.address_offsets
+                )
+            ])
+        return np.where(
+            addresses >= 0, self._contact_ids[np.maximum(addresses, 0)], -1
+        )
+
+    def interactions(self, sms_first=False):
+        """
+        Returns the (users, days, valid, addresses, is_call) of the smss and
+        calls of every user, calls first unless `sms_first` is True.
+        """
+        tables = [
+            (
+                self.call_user, self.call_days, self.call_valid,
+                self.call_addresses, np.ones(len(self.call_user), dtype=bool)
+            ),
+            (
+                self.sms_user, self.sms_days, self.sms_valid,
+                self.sms_addresses, np.zeros(len(self.sms_user), dtype=bool)
+            ),
+        ]
+        if sms_first:
+            tables.reverse()
+        return tuple(
+            np.concatenate([table[i] for table in tables]) for i in range(5)
+        )
+
+
+################################################################################
+#                        BATCH FEATURE EXTRACTORS
+################################################################################
+def build_num_contacts_batch(tables):
+    return column(group_sum(
+        tables.device_user, tables.device_num_contacts, tables.num_users
+    ))
+
+
+def build_num_calls_to_international_batch(tables):
+    outgoing = tables.call_outgoing
+    international = tables.address_flags(
+        tables.call_addresses[outgoing],
+        lambda address: phone_number_flags(address) & INTERNATIONAL
+    )
+    return column(group_count(
+        tables.call_user[outgoing][international], tables.num_users
+    ))
+
+
+def build_symbol_count_batch(prefix, symbol):
+    def build_symbol_count(tables):
+        users = getattr(tables, prefix + "_user")
+        addresses = getattr(tables, prefix + "_addresses")
+        has_symbol = tables.address_flags(
+            addresses, lambda address: symbol in address
+        )
+        return column(group_count(users[has_symbol], tables.num_users))
+    return build_symbol_count
+
+
+def build_ave_duration_batch(tables):
+    num_calls = group_count(tables.call_user, tables.num_users)
+    durations = group_sum(
+        tables.call_user, tables.call_durations, tables.num_users
+    )
+    # A user without calls gets 0.0 rather than None.
+    return column(durations / np.maximum(num_calls, 1).astype(np.float64))
+
+
+def build_call_stats_batch(tables):
+    num_users = tables.num_users
+    users = tables.call_user
+    valid = tables.call_valid
+    day_users, _ = distinct_pairs(users[valid], tables.call_days[valid])
+    num_days = group_count(day_users, num_users)
+    return {
+        "calls": column(group_count(users, num_users)),
+        "duration(s)": column(
+            group_sum(users, tables.call_durations, num_users)
+        ),
+        "ave_daily_calls": ave_column(
+            group_count(users[valid], num_users), num_days
+        ),
+        "ave_daily_duration(s)": ave_column(
+            group_sum(users[valid], tables.call_durations[valid], num_users),
+            num_days
+        ),
+    }
+
+
+def build_ave_daily_sms_count_batch(tables):
+    """
+    Like `features.build_ave_daily_sms_count`, only counts the smss of each
+    device from its first valid datetime up to, but not including, its last,
+    and a user with a device with a single valid sms gets None.
+    """
+    num_users = tables.num_users
+    valid = tables.sms_valid
+    devices = tables.sms_device[valid]
+    users = tables.sms_user[valid]
+    days = tables.sms_days[valid]
+    device_smss = np.bincount(devices, minlength=len(tables.device_user))
+    single_sms = group_count(
+        tables.device_user[device_smss == 1], num_users
+    ) > 0
+    # The smss of each device are in the order of its log, so its last valid
+    # sms is the last of its rows.
+    counted = np.zeros(len(devices), dtype=bool)
+    counted[:-1] = devices[1:] == devices[:-1]
+    day_users, _ = distinct_pairs(users[counted], days[counted])
+    num_days = group_count(day_users, num_users)
+    values, present = ave_column(
+        group_count(users[counted], num_users), num_days
+    )
+    return column(values, present & ~single_sms)
+
+
+def build_ave_message_body_length_batch(tables):
+    lengths = tables.sms_body_lengths
+    return ave_column(
+        group_sum(tables.sms_user, lengths, tables.num_users),
+        group_count(tables.sms_user[lengths != 0], tables.num_users)
+    )
+
+
+def build_interaction_stats_batch(tables):
+    num_users = tables.num_users
+    users, days, valid, addresses, is_call = tables.interactions(
+        sms_first=True
+    )
+    contacts = tables.contacts(addresses)
+    has_contact = contacts >= 0
+    # Each distinct (day, contact) pair is a contact interacted with that
+    # day, and contact ids are unique in the batch.
+    valid_interactions = valid & has_contact
+    day_users, _ = distinct_pairs(
+        users[valid_interactions], days[valid_interactions]
+    )
+    num_days = group_count(day_users, num_users)
+    pair_users, _ = distinct_pairs(
+        users[valid_interactions],
+        days[valid_interactions] * max(tables.num_addresses, 1) +
+        contacts[valid_interactions]
+    )
+    return {
+        "total_num_contacts_interacted_with": column(group_count(
+            tables.address_users()[np.unique(contacts[has_contact])],
+            num_users
+        )),
+        "total_interactions": column(group_count(users, num_users)),
+        "ave_daily_sms": ave_column(
+            group_count(users[valid & ~is_call], num_users), num_days
+        ),
+        "ave_daily_calls": ave_column(
+            group_count(users[valid & is_call], num_users), num_days
+        ),
+        "ave_daily_contacts_interacted_with": ave_column(
+            group_count(pair_users, num_users), num_days
+        ),
+    }
+
+
+def build_top_contact_stats_batch(tables):
+    num_users = tables.num_users
+    _, _, _, addresses, _ = tables.interactions(sms_first=True)
+    contacts = tables.contacts(addresses)
+    contacts = contacts[contacts >= 0]
+    address_users = tables.address_users()
+    totals = group_count(address_users[contacts], num_users)
+
+    # The interactions with each contact, largest first within each user.
+    counts = np.bincount(contacts, minlength=tables.num_addresses)
+    contacted = np.flatnonzero(counts)
+    users = address_users[contacted]
+    counts = counts[contacted]
+    order = pair_order(users, -counts)
+    users = users[order]
+    counts = counts[order]
+    ranks = np.arange(len(users)) - np.searchsorted(users, users)
+    top = ranks < CONCENTRATION_CONTACTS
+    users = users[top]
+    counts = counts[top]
+    ranks = ranks[top]
+
+    present = totals != 0
+    totals = np.where(present, totals, 1).astype(np.float64)
+    # bincount adds the weights in order, largest first, as
+    # `top_contact_features` does.
+    concentration = np.bincount(
+        users, weights=(counts / totals[users]) ** 2, minlength=num_users
+    )
+    return {
+        "top_contact_share": column(
+            group_sum(users[ranks == 0], counts[ranks == 0], num_users) /
+            totals,
+            present
+        ),
+        "top_{}_contacts_share".format(TOP_CONTACTS): column(
+            group_sum(
+                users[ranks < TOP_CONTACTS], counts[ranks < TOP_CONTACTS],
+                num_users
+            ) / totals,
+            present
+        ),
+        "contact_concentration": column(concentration, present),
+    }
+
+
+def build_activity_stats_batch(tables):
+    """
+    Like `activity.activity_features`, with every window ending on, and
+    including, each user's last active day.
+    """
+    num_users = tables.num_users
+    users, days, valid, addresses, is_call = tables.interactions()
+    durations = np.zeros(len(users), dtype=np.int64)
+    durations[:len(tables.call_durations)] = tables.call_durations
+    users = users[valid]
+    days = days[valid]
+    is_call = is_call[valid]
+    durations = durations[valid]
+    contacts = tables.contacts(addresses[valid])
+
+    day_users, active_days = distinct_pairs(users, days)
+    num_days = group_count(day_users, num_users)
+    present = num_days != 0
+    bounds = np.searchsorted(day_users, np.arange(num_users + 1))
+    last_index = np.maximum(bounds[1:] - 1, 0)
+    first_index = np.minimum(bounds[:-1], max(len(active_days) - 1, 0))
+    if len(active_days):
+        first_days = active_days[first_index]
+        end_days = active_days[last_index] + 1
+    else:
+        first_days = end_days = np.zeros(num_users, dtype=np.int64)
+
+    # The last day each contact was interacted with.
+    has_contact = contacts >= 0
+    contact_ids, contact_days = contacts[has_contact], days[has_contact]
+    order = pair_order(contact_ids, contact_days)
+    contact_ids = contact_ids[order]
+    contact_days = contact_days[order]
+    last = np.ones(len(contact_ids), dtype=bool)
+    last[:-1] = contact_ids[1:] != contact_ids[:-1]
+    contact_users = tables.address_users()[contact_ids[last]]
+    contact_last_days = contact_days[last]
+
+    def interactions_since(start, end=None):
+        in_window = days >= start[users]
+        if end is not None:
+            in_window &= days < end[users]
+        return group_count(users[in_window], num_users)
+
+    features = {}
+    for n in ACTIVITY_WINDOWS:
+        features["interactions_last_{}_days".format(n)] = column(
+            interactions_since(end_days - n), present
+        )
+        features["contacts_last_{}_days".format(n)] = column(
+            group_count(
+                contact_users[
+                    contact_last_days >= end_days[contact_users] - n
+                ],
+                num_users
+            ),
+            present
+        )
+
+    def month(days):
+        return days.astype("datetime64[D]").astype(
+            "datetime64[M]"
+        ).astype(np.int64)
+    num_months = month(end_days - 1) - month(first_days) + 1
+    for name, totals in (
+        ("ave_monthly_calls", group_count(users[is_call], num_users)),
+        ("ave_monthly_sms", group_count(users[~is_call], num_users)),
+        (
+            "ave_monthly_duration(s)",
+            group_sum(users[is_call], durations[is_call], num_users)
+        ),
+    ):
+        values, _ = ave_column(totals, num_months)
+        features[name] = column(values, present)
+
+    # The most days between two consecutive active days of each user.
+    same_user = day_users[1:] == day_users[:-1]
+    gaps = np.diff(active_days)[same_user]
+    gap_users = day_users[1:][same_user]
+    max_gaps = np.zeros(num_users, dtype=np.int64)
+    if len(gaps):
+        gap_user_ids, starts = np.unique(gap_users, return_index=True)
+        max_gaps[gap_user_ids] = np.maximum.reduceat(gaps, starts)
+    features["max_days_between_activity"] = column(max_gaps, num_days >= 2)
+
+    values, trend_present = ave_column(
+        interactions_since(end_days - TREND_WINDOW),
+        interactions_since(end_days - 2 * TREND_WINDOW,
+                           end_days - TREND_WINDOW)
+    )
+    features["activity_trend"] = column(values, present & trend_present)
+    return features
+
+
+def build_sms_message_stats_batch(tables):
+    num_users = tables.num_users
+    num_bad_words = group_sum(
+        tables.sms_user, tables.sms_num_bad_words, num_users
+    )
+    return {
+        "num_bad_words_used": column(num_bad_words),
+        "ratio_of_bad_words_used": ave_column(
+            num_bad_words,
+            group_sum(tables.sms_user, tables.sms_num_words, num_users)
+        ),
+        "num_derogatory_sms": column(group_count(
+            tables.sms_user[tables.sms_num_bad_words != 0], num_users
+        )),
+    }
+
+
+def build_sms_phrase_stats_batch(tables):
+    return format_phrase_hits(dict(
+        (name, column(group_sum(
+            tables.device_user, tables.device_phrase_hits[:, index],
+            tables.num_users
+        )))
+        for index, name in enumerate(tables.phrase_names)
+    ))
+
+
+def build_sms_text_stats_batch(tables):
+    counts = dict(
+        (name, group_sum(
+            tables.device_user, tables.device_text_counts[:, index],
+            tables.num_users
+        ))
+        for index, name in enumerate(TEXT_COUNTS)
+    )
+    return text_features(counts, ave=ave_column)
+
+
+BATCH_EXTRACTORS = {
+    "num_contacts": build_num_contacts_batch,
+    "num_calls_to_international": build_num_calls_to_international_batch,
+    "num_#_calls": build_symbol_count_batch("call", "#"),
+    "num_#_sms": build_symbol_count_batch("sms", "#"),
+    "num_*_calls": build_symbol_count_batch("call", "*"),
+    "num_*_sms": build_symbol_count_batch("sms", "*"),
+    "ave_duration(s)": build_ave_duration_batch,
+    "call_stats": build_call_stats_batch,
+    "ave_daily_sms_count": build_ave_daily_sms_count_batch,
+    "ave_message_body_length": build_ave_message_body_length_batch,
+    "interaction_stats": build_interaction_stats_batch,
+    "top_contact_stats": build_top_contact_stats_batch,
+    "activity_stats": build_activity_stats_batch,
+    "sms_message_stats": build_sms_message_stats_batch,
+    "sms_phrase_stats": build_sms_phrase_stats_batch,
+    "sms_text_stats": build_sms_text_stats_batch,
+}
+
+
+def build_features_batch(tables, features=None, telemetry=None):
+    """
+    Parameters:
+        tables (:class:`BatchTables`): The tables of a batch of users.
+        features (:class:`list`): The names of the features to build.
+            Defaults to `ALL_FEATURES`.
+        telemetry (:class:`telemetry.Telemetry`): If given, the time spent in
+            each extractor is added to it.
+
+    Returns:
+        :class:`list` of each user's list of (feature, value) tuples, like
+        `engine.FeatureEngine.build_features`, in the order of the users of
+        `tables`.
+    """
+    if features is None:
+        features = ALL_FEATURES
+    results = []
+    for feature in features:
+        extractor = BATCH_EXTRACTORS[feature]
+        if telemetry is not None:
+            extractor = telemetry.timed("extractors", feature, extractor)
+        results.append((feature, extractor(tables)))
+    # Whole columns are converted to Python values at once, then zipped into
+    # each user's values.
+    features_values = []
+    for feature, result in results:
+        if isinstance(result, dict):
+            names = list(result)
+            features_values.append([
+                dict(zip(names, values)) for values in zip(*[
+                    column_values(result[name]) for name in names
+                ])
+            ])
+        else:
+            features_values.append(column_values(result))
+    return [
+        zip(features, values) for values in zip(*features_values)
+    ] if features_values else [[] for _ in range(tables.num_users)]
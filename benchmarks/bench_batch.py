@@ -0,0 +1,63 @@
+"""
+Compares the feature time of many small users built one at a time, with the
+`FeatureEngine` and the columnar extractors, with `batch.py` building them
+all at once.
+
+To run from the root of the repository:
+```
+python -m benchmarks.bench_batch
+```
+"""
+import time
+from batch import BatchTables, build_features_batch
+from benchmarks.bench_columnar import build_device
+from columnar import AddressTable, DeviceColumns, build_features_columnar
+from engine import FeatureEngine
+
+
+def main(num_users=2000, num_calls=40, num_sms=80):
+    devices = [
+        build_device(num_calls, num_sms, seed=user)
+        for user in range(num_users)
+    ]
+    users = []
+    for device in devices:
+        address_table = AddressTable()
+        users.append(
+            ([DeviceColumns.from_device(device, address_table)], address_table)
+        )
+
+    engine = FeatureEngine()
+    start = time.time()
+    expected = [
+        engine.build_features({"devices": [device]}) for device in devices
+    ]
+    engine_time = time.time() - start
+    start = time.time()
+    columnar = [
+        build_features_columnar(columns, address_table)
+        for columns, address_table in users
+    ]
+    columnar_time = time.time() - start
+    start = time.time()
+    tables = BatchTables(users)
+    tables_time = time.time() - start
+    result = build_features_batch(tables)
+    batch_time = time.time() - start
+    assert columnar == expected, "The columnar features do not match."
+    assert result == expected, "The batch features do not match."
+
+    print("{} users of {} records".format(num_users, num_calls + num_sms))
+    print("FeatureEngine:       {:.3f}s".format(engine_time))
+    print("columnar extractors: {:.3f}s ({:.1f}x faster)".format(
+        columnar_time, engine_time / columnar_time
+    ))
+    print("batch extractors:    {:.3f}s ({:.1f}x faster than the engine, "
+          "{:.1f}x than columnar, {:.3f}s to build the tables)".format(
+              batch_time, engine_time / batch_time,
+              columnar_time / batch_time, tables_time
+          ))
+
+
+if __name__ == "__main__":
+    main()
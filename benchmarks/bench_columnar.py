@@ -0,0 +1,105 @@
+"""
+Compares the memory per record and feature time of parsed record dicts with
+`columnar.DeviceColumns`.
+
+To run from the root of the repository:
+```
+python -m benchmarks.bench_columnar
+```
+"""
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+from columnar import AddressTable, DeviceColumns, build_features_columnar
+from engine import FeatureEngine
+
+
+def build_device(num_calls, num_sms, seed=0):
+    """
+    Returns a parsed device shaped like the ones `build_device_data` builds,
+    including the fields no feature uses.
+    """
+    rand = random.Random(seed)
+    start = datetime(2017, 1, 1)
+
+    def random_datetime():
+        return start + timedelta(seconds=rand.randint(0, 365 * 86400))
+
+    def random_number():
+        return "+2547{:08d}".format(rand.randint(0, 2000))
+
+    call_log = [{
+        "cached_name": "Contact {}".format(i % 300),
+        "call_type": "1",
+        "country_iso": "KE",
+        "data_usage": None,
+        "datetime": random_datetime(),
+        "duration": str(rand.randint(0, 600)),
+        "features_video": "0",
+        "geocoded_location": "Kenya",
+        "is_read": "1",
+        "item_id": i,
+        "phone_number": random_number(),
+    } for i in range(num_calls)]
+    sms_log = [{
+        "contact_id": None,
+        "datetime": random_datetime(),
+        "item_id": i,
+        "message_body": "You are {} days late on your loan".format(i % 30),
+        "sms_address": random_number(),
+        "sms_type": "1",
+        "thread_id": i % 100,
+    } for i in range(num_sms)]
+    return {"call_log": call_log, "contacts": [], "sms_log": sms_log}
+
+
+def sizeof_records(records):
+    """
+    Returns the bytes held by a list of flat record dicts.
+    """
+    size = sys.getsizeof(records)
+    for record in records:
+        size += sys.getsizeof(record)
+        for key, value in record.items():
+            size += sys.getsizeof(value)
+    return size
+
+
+def main(num_calls=50000, num_sms=100000):
+    device = build_device(num_calls, num_sms)
+    num_records = num_calls + num_sms
+    dict_bytes = (
+        sizeof_records(device["call_log"]) + sizeof_records(device["sms_log"])
+    )
+
+    start = time.time()
+    address_table = AddressTable()
+    columns = DeviceColumns.from_device(device, address_table)
+    convert_time = time.time() - start
+    column_bytes = columns.nbytes
+
+    start = time.time()
+    expected = FeatureEngine().build_features({"devices": [device]})
+    engine_time = time.time() - start
+    start = time.time()
+    result = build_features_columnar([columns], address_table)
+    columnar_time = time.time() - start
+    assert result == expected, "The columnar features do not match."
+
+    print("{} records".format(num_records))
+    print("record dicts: {:.0f} bytes/record".format(
+        dict_bytes / float(num_records)
+    ))
+    print("columns:      {:.0f} bytes/record ({:.1f}x smaller)".format(
+        column_bytes / float(num_records), dict_bytes / float(column_bytes)
+    ))
+    print("FeatureEngine:      {:.3f}s".format(engine_time))
+    print("columnar extractors: {:.3f}s ({:.1f}x faster, {:.3f}s to build "
+          "the columns)".format(
+              columnar_time, engine_time / columnar_time, convert_time
+          ))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Measures how long importing each module takes in a fresh interpreter, as a
+new worker process or a serverless scoring call pays it, and checks that no
+optional or heavy dependency is imported before it is used.
+
+Every import is timed in its own interpreter, started from an empty folder so
+no module depends on the working directory, and the best of `--runs` runs
+is reported. It exits with status 1 if importing `features` takes more than
+`--budget-ms` or a module imports one of `LAZY_MODULES`.
+
+To run from the root of the repository:
+```
+python -m benchmarks.bench_import
+```
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from os.path import abspath, dirname
+
+
+REPO_PATH = dirname(dirname(abspath(__file__)))
+MODULES = ("utils", "features", "engine", "featurize", "generate_features")
+# The modules only the code paths that use them should import.
+LAZY_MODULES = (
+    "BaseHTTPServer",
+    "dateutil",
+    "multiprocessing",
+    "numpy",
+    "progress",
+    "pyarrow",
+)
+TIME_IMPORT = """
+import json, sys, time
+start = time.time()
+import {module}
+seconds = time.time() - start
+print(json.dumps([seconds, sorted(
+    name for name in {lazy_modules!r} if name in sys.modules
+)]))
+"""
+
+
+def time_import(module, cwd, env):
+    """
+    Returns the (seconds, lazy modules imported) of importing `module` in a
+    fresh interpreter.
+    """
+    output = subprocess.check_output(
+        [
+            sys.executable, "-c",
+            TIME_IMPORT.format(module=module, lazy_modules=LAZY_MODULES)
+        ],
+        cwd=cwd,
+        env=env
+    )
+    seconds, imported = json.loads(output.strip().splitlines()[-1])
+    return seconds, imported
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark the import time of each module."
+    )
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--budget-ms", type=float, default=10,
+                        help="The most ms importing `features` may take.")
+    args = parser.parse_args(argv)
+
+    env = dict(os.environ)
+    env["PYTHONPATH"] = REPO_PATH
+    # Time imports from bytecode, as a deployed worker would, rather than
+    # compiling the modules every run.
+    env.pop("PYTHONDONTWRITEBYTECODE", None)
+    cwd = tempfile.mkdtemp(prefix="bench_import_")
+    failed = False
+    try:
+        for module in MODULES:
+            # The first import writes the bytecode.
+            time_import(module, cwd, env)
+            runs = [time_import(module, cwd, env) for _ in range(args.runs)]
+            seconds = min(seconds for seconds, _ in runs)
+            imported = runs[0][1]
+            print("{:<20} {:>8.1f} ms  {}".format(
+                module, seconds * 1000,
+                "imports " + ", ".join(imported) if imported else ""
+            ))
+            if imported or (
+                module == "features" and seconds * 1000 > args.budget_ms
+            ):
+                failed = True
+    finally:
+        shutil.rmtree(cwd)
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+Compares the sms message stats as they used to be built, splitting each body
+on spaces and intersecting its words with the bad words before a second
+`matcher.PhraseMatcher` scan for the phrase stats, with
+`features.build_sms_message_stats` and the `FeatureEngine`, which count the bad
+words from the same scan as the phrases.
+
+To run from the root of the repository:
+```
+python -m benchmarks.bench_phrases
+```
+"""
+import random
+import time
+from benchmarks.bench_columnar import build_device
+from engine import FeatureEngine
+from features import (
+    build_sms_message_stats, build_sms_phrase_stats, get_sms_phrase_matcher
+)
+from utils import ave_or_none, get_bad_words, get_sms_phrase_lists
+
+
+def build_message_bodies(phrase_lists, num_sms, seed=0):
+    """
+    Returns message bodies of random words, a fifth of which contain one of
+    the phrases.
+    """
+    rand = random.Random(seed)
+    vocabulary = ["word{}".format(i) for i in range(5000)]
+    phrases = [
+        phrase for name in sorted(phrase_lists) for phrase in phrase_lists[name]
+    ]
+    message_bodies = []
+    for _ in range(num_sms):
+        words = [rand.choice(vocabulary) for _ in range(rand.randint(3, 30))]
+        if phrases and rand.random() < 0.2:
+            words.insert(rand.randint(0, len(words)), rand.choice(phrases))
+        message_bodies.append(" ".join(words))
+    return message_bodies
+
+
+def build_sms_message_stats_split(user_data):
+    """
+    `features.build_sms_message_stats` as it was before it counted the bad
+    words with the phrase matcher.
+    """
+    bad_words = get_bad_words()
+    num_bad_words_used = 0
+    total_words = 0
+    derogatory_sms_count = 0
+    for device_data in user_data.get("devices", []):
+        for sms in device_data.get("sms_log", []):
+            message_body = (sms.get("message_body", "") or "")
+            if len(message_body) > 2:
+                words = message_body.split(" ")
+                total_words += len(words)
+                num_bad_words = len(set(words) & bad_words)
+                num_bad_words_used += num_bad_words
+                if num_bad_words > 0:
+                    derogatory_sms_count += 1
+    return {
+        "num_bad_words_used": num_bad_words_used,
+        "ratio_of_bad_words_used": ave_or_none(num_bad_words_used, total_words),
+        "num_derogatory_sms": derogatory_sms_count,
+    }
+
+
+def timed(function, *args):
+    start = time.time()
+    result = function(*args)
+    return result, time.time() - start
+
+
+def main(num_sms=100000):
+    phrase_lists = get_sms_phrase_lists()
+    device = build_device(0, num_sms)
+    for sms, body in zip(
+        device["sms_log"], build_message_bodies(phrase_lists, num_sms)
+    ):
+        sms["message_body"] = body
+    user_data = {"devices": [device]}
+    megabytes = sum(
+        len(sms["message_body"]) for sms in device["sms_log"]
+    ) / float(1 << 20)
+    # Compile the matcher outside of the timings.
+    get_sms_phrase_matcher()
+
+    _, split_time = timed(build_sms_message_stats_split, user_data)
+    _, phrase_time = timed(build_sms_phrase_stats, user_data)
+    _, matcher_time = timed(build_sms_message_stats, user_data)
+    engine = FeatureEngine(["sms_message_stats", "sms_phrase_stats"])
+    _, engine_time = timed(engine.build_features, user_data)
+    sms_engine = FeatureEngine(["sms_phrase_stats"])
+    _, sms_engine_time = timed(sms_engine.build_features, user_data)
+
+    print("{} phrases, {} message bodies, {:.1f}MB".format(
+        sum(len(phrases) for phrases in phrase_lists.values()), num_sms,
+        megabytes
+    ))
+    print("sms_message_stats:")
+    print("  split and intersect:    {:.3f}s ({:.1f}MB/s)".format(
+        split_time, megabytes / split_time
+    ))
+    print("  PhraseMatcher:          {:.3f}s ({:.1f}MB/s)".format(
+        matcher_time, megabytes / matcher_time
+    ))
+    print("sms_message_stats and sms_phrase_stats:")
+    print("  split and intersect, then PhraseMatcher: {:.3f}s".format(
+        split_time + phrase_time
+    ))
+    print("  FeatureEngine, one PhraseMatcher scan:   {:.3f}s "
+          "(sms_phrase_stats alone {:.3f}s)".format(
+              engine_time, sms_engine_time
+          ))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,263 @@
+"""
+Times the stages of a feature generation run over a synthetic `user_logs/`
+tree and compares their throughput with a saved baseline.
+
+The stages are:
+ - `build_users`: reading and parsing every user's logs into memory,
+ - `extractor:<name>`: each extractor of `features.FEATURE_EXTRACTORS` over
+    every user,
+ - `engine`: the fused `FeatureEngine` building every feature,
+ - `generate_features`: the full streaming run, writing the csv file.
+
+Each stage runs in its own process so its peak RSS is its own. Records/sec
+counts the records of the logs a stage reads.
+
+To run from the root of the repository, and save or compare a baseline:
+```
+python -m benchmarks.bench_pipeline --save-baseline
+python -m benchmarks.bench_pipeline
+```
+A stage whose records/sec dropped by more than `--tolerance` compared to the
+baseline is reported as a regression and the benchmark exits with status 1.
+"""
+import argparse
+import json
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from multiprocessing import Process, Queue
+from os.path import dirname, join
+from benchmarks.synthetic_logs import generate_user_logs
+import generate_features
+from engine import FeatureEngine
+from features import FEATURE_EXTRACTORS, FEATURE_METADATA
+
+
+BASELINE_FILE = join(dirname(__file__), "baseline.json")
+# A stage is a regression if its records/sec drops by more than this ratio.
+TOLERANCE = 0.2
+# In memory stages are repeated until they took at least this long, so fast
+# extractors are not timed on a handful of clock ticks.
+MIN_SECONDS = 0.5
+
+
+def count_records(users, logs=("call_log", "contacts", "sms_log")):
+    return sum(
+        len(device_data.get(log, []))
+        for user_data in users.values()
+        for device_data in user_data.get("devices", [])
+        for log in logs
+    )
+
+
+def time_repeated(func, min_seconds=MIN_SECONDS):
+    """
+    Returns the average seconds per call of `func`, calling it until the
+    calls took at least `min_seconds`.
+    """
+    num_calls = 0
+    start = time.time()
+    while True:
+        func()
+        num_calls += 1
+        seconds = time.time() - start
+        if seconds >= min_seconds:
+            return seconds / num_calls
+
+
+def run_build_users():
+    start = time.time()
+    users = generate_features.build_users()
+    seconds = time.time() - start
+    return [("build_users", seconds, count_records(users))]
+
+
+def run_extractors():
+    users = generate_features.build_users()
+    results = []
+    for feature in sorted(FEATURE_EXTRACTORS):
+        extractor = FEATURE_EXTRACTORS[feature]
+
+        def extract():
+            for user_data in users.values():
+                extractor(user_data)
+        seconds = time_repeated(extract)
+        results.append((
+            "extractor:{}".format(feature),
+            seconds,
+            count_records(users, FEATURE_METADATA[feature]["logs"])
+        ))
+    return results
+
+
+def run_engine():
+    users = generate_features.build_users()
+    engine = FeatureEngine()
+
+    def extract():
+        for user_data in users.values():
+            engine.build_features(user_data)
+    seconds = time_repeated(extract)
+    return [("engine", seconds, count_records(users))]
+
+
+def run_generate_features(output_path, num_records):
+    start = time.time()
+    generate_features.generate_features_streaming(output_path)
+    seconds = time.time() - start
+    return [("generate_features", seconds, num_records)]
+
+
+def run_in_process(queue, func, args):
+    results = func(*args)
+    queue.put((results, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss))
+
+
+def run_stage(func, *args):
+    """
+    Runs a stage in a new process.
+
+    Returns:
+        :class:`list` of (name, seconds, records) and the peak RSS of the
+        process in KB.
+    """
+    queue = Queue()
+    process = Process(target=run_in_process, args=(queue, func, args))
+    process.start()
+    results, peak_rss_kb = queue.get()
+    process.join()
+    return results, peak_rss_kb
+
+
+def run_benchmark(data_path, num_records, repeat=3):
+    """
+    Returns :class:`dict` mapping each stage to its best time of `repeat`
+    runs, records, records/sec and peak RSS.
+    """
+    generate_features.DATA_PATH = data_path + "/"
+    output_path = join(data_path, "feature_data.csv")
+    stages = [
+        (run_build_users, ()),
+        (run_extractors, ()),
+        (run_engine, ()),
+        (run_generate_features, (output_path, num_records)),
+    ]
+    results = {}
+    for func, args in stages:
+        for _ in range(repeat):
+            stage_results, peak_rss_kb = run_stage(func, *args)
+            for name, seconds, records in stage_results:
+                result = results.get(name)
+                if result is None or seconds < result["seconds"]:
+                    results[name] = {
+                        "seconds": seconds,
+                        "records": records,
+                        "records_per_s": records / seconds if seconds else 0.0,
+                        "peak_rss_kb": peak_rss_kb,
+                    }
+    return results
+
+
+def compare(results, baseline, tolerance=TOLERANCE):
+    """
+    Prints each stage's throughput next to the baseline's.
+
+    Returns:
+        :class:`list` of the stages that regressed.
+    """
+    regressions = []
+    print("{:<42} {:>12} {:>10} {:>12} {:>8}".format(
+        "stage", "records/s", "peak MB", "baseline", "ratio"
+    ))
+    for name in sorted(results):
+        result = results[name]
+        line = "{:<42} {:>12.0f} {:>10.1f}".format(
+            name, result["records_per_s"], result["peak_rss_kb"] / 1024.0
+        )
+        baseline_result = baseline.get(name)
+        if baseline_result and baseline_result["records_per_s"]:
+            ratio = result["records_per_s"] / baseline_result["records_per_s"]
+            line += " {:>12.0f} {:>8.2f}".format(
+                baseline_result["records_per_s"], ratio
+            )
+            if ratio < 1 - tolerance:
+                line += "  REGRESSION"
+                regressions.append(name)
+        print(line)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark the stages of a feature generation run."
+    )
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--calls", type=int, default=500,
+                        help="The maximum number of calls per device.")
+    parser.add_argument("--sms", type=int, default=1000,
+                        help="The maximum number of smss per device.")
+    parser.add_argument("--contacts", type=int, default=200,
+                        help="The maximum number of contacts per device.")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="Keep the best of this many runs of each stage.")
+    parser.add_argument("--baseline", default=BASELINE_FILE)
+    parser.add_argument("--save-baseline", action="store_true",
+                        help="Save the results as the new baseline.")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE)
+    args = parser.parse_args(argv)
+
+    config = {
+        "users": args.users,
+        "calls": args.calls,
+        "sms": args.sms,
+        "contacts": args.contacts,
+    }
+    data_path = tempfile.mkdtemp(prefix="user_logs_")
+    try:
+        num_records = generate_user_logs(
+            join(data_path, "user_logs"),
+            num_users=args.users,
+            num_calls=args.calls,
+            num_sms=args.sms,
+            num_contacts=args.contacts
+        )
+        print("{} users, {} records".format(args.users, num_records))
+        results = run_benchmark(
+            join(data_path, "user_logs"), num_records, args.repeat
+        )
+    finally:
+        shutil.rmtree(data_path)
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as baseline_file:
+            json.dump(
+                {"config": config, "results": results}, baseline_file,
+                indent=2, sort_keys=True
+            )
+        compare(results, {}, args.tolerance)
+        print("Saved the baseline to {}".format(args.baseline))
+        return
+
+    baseline = {}
+    try:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+    except IOError:
+        print("No baseline at {}, run with --save-baseline to save one.".format(
+            args.baseline
+        ))
+    if baseline and baseline.get("config") != config:
+        print("The baseline was run with {}, the ratios may not be "
+              "comparable.".format(baseline.get("config")))
+    regressions = compare(results, baseline.get("results", {}), args.tolerance)
+    if regressions:
+        print("{} stages regressed by more than {:.0%}: {}".format(
+            len(regressions), args.tolerance, ", ".join(regressions)
+        ))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+"""
+Measures how much prefetching the next users' files hides the latency of
+slow, e.g. network mounted, storage in a streaming run.
+
+Every open of a data file, by the run or by the prefetcher, first sleeps for
+`--latency` ms to simulate the round trip to the storage. The run is timed
+with increasing prefetch depths, next to the time its I/O alone (the sum of
+the latencies, read one at a time) and its CPU alone (the run without
+latency) take. With enough depth the run should take about the larger of the
+two rather than their sum, or less since `prefetch.PREFETCH_THREADS` files are
+read at once.
+
+Before the timings, `check_budget` checks that the files being read or held
+never add up to more than the prefetcher's `max_bytes`, even when the run
+moves past users whose files are still being read.
+
+To run from the root of the repository:
+```
+python -m benchmarks.bench_prefetch
+```
+"""
+import argparse
+import shutil
+import tempfile
+import threading
+import time
+from os.path import join
+from benchmarks.synthetic_logs import generate_user_logs
+import generate_features
+import prefetch
+
+
+class SlowStorage(object):
+    """
+    Adds `latency` seconds to every open of a data file by
+    `generate_features` and `prefetch`.
+    """
+    def __init__(self, latency):
+        self.latency = latency
+        self.opens = 0
+
+    def open(self, file_path, *args):
+        self.opens += 1
+        time.sleep(self.latency)
+        return open(file_path, *args)
+
+    def __enter__(self):
+        generate_features.open = prefetch.open = self.open
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        del generate_features.open
+        del prefetch.open
+
+
+def check_budget(
+    num_items=50, file_size=600, max_bytes=1000, read_seconds=0.005
+):
+    """
+    Runs a :class:`prefetch.Prefetcher` over items of two files each, with
+    slow reads, opening the files of every other item and moving past the
+    others without opening them, often while they are being read.
+
+    Returns:
+        :class:`int` the peak bytes of the files being read or held at once,
+        which must not exceed `max_bytes`.
+    """
+    work_dir = tempfile.mkdtemp(prefix="prefetch_budget_")
+    lock = threading.Lock()
+    stats = {"reading": 0, "peak": 0}
+
+    def item_files(item):
+        return [join(work_dir, "{}-{}".format(item, part)) for part in (0, 1)]
+
+    def read(file_path):
+        with lock:
+            stats["reading"] += file_size
+            stats["peak"] = max(stats["peak"], stats["reading"])
+        time.sleep(read_seconds)
+        data = prefetch.read_file_bytes(file_path)
+        with lock:
+            stats["reading"] -= file_size
+        return data
+
+    try:
+        for item in range(num_items):
+            for file_path in item_files(item):
+                with open(file_path, "wb") as data_file:
+                    data_file.write(b"x" * file_size)
+        prefetcher = prefetch.Prefetcher(
+            range(num_items), item_files, depth=4, max_bytes=max_bytes,
+            read=read
+        )
+        try:
+            for item in prefetcher:
+                if item % 2:
+                    for file_path in item_files(item):
+                        prefetcher.open(file_path)
+                with lock:
+                    stats["peak"] = max(stats["peak"], prefetcher.held_bytes)
+                # Building the item's features, while its next files are
+                # read.
+                time.sleep(read_seconds / 2)
+        finally:
+            prefetcher.close()
+            for thread in prefetcher.threads:
+                thread.join()
+    finally:
+        shutil.rmtree(work_dir)
+    assert stats["peak"] <= max_bytes, (
+        "{} bytes were read or held at once, over the budget of {}.".format(
+            stats["peak"], max_bytes
+        )
+    )
+    return stats["peak"]
+
+
+def time_run(output_path, latency, prefetch_depth):
+    """
+    Returns the seconds of a streaming run and the number of files opened.
+    """
+    with SlowStorage(latency) as storage:
+        start = time.time()
+        generate_features.generate_features_streaming(
+            output_path, prefetch_depth=prefetch_depth
+        )
+        return time.time() - start, storage.opens
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark prefetching the files of the next users."
+    )
+    parser.add_argument("--users", type=int, default=30)
+    parser.add_argument("--latency", type=float, default=20,
+                        help="The ms added to every open of a data file.")
+    parser.add_argument("--depths", default="0,1,2,4,8",
+                        help="The comma separated prefetch depths to time.")
+    args = parser.parse_args(argv)
+
+    print("Peak bytes read or held: {} of a budget of 1000".format(
+        check_budget()
+    ))
+    data_path = tempfile.mkdtemp(prefix="user_logs_")
+    try:
+        user_logs_path = join(data_path, "user_logs")
+        num_records = generate_user_logs(
+            user_logs_path, num_users=args.users, num_calls=300, num_sms=600,
+            num_contacts=100
+        )
+        generate_features.DATA_PATH = user_logs_path + "/"
+        output_path = join(data_path, "feature_data.csv")
+        print("{} users, {} records, {:.0f} ms per open".format(
+            args.users, num_records, args.latency
+        ))
+        # The first run also warms up the page cache and the lazy setup.
+        time_run(output_path, 0, 0)
+        cpu_seconds, num_files = time_run(output_path, 0, 0)
+        io_seconds = num_files * args.latency / 1000.0
+        print("{:<24} {:>8.2f} s".format("CPU only", cpu_seconds))
+        print("{:<24} {:>8.2f} s".format("I/O only", io_seconds))
+        for depth in [int(depth) for depth in args.depths.split(",")]:
+            seconds, _ = time_run(output_path, args.latency / 1000.0, depth)
+            print("{:<24} {:>8.2f} s".format(
+                "prefetch depth {}".format(depth), seconds
+            ))
+    finally:
+        shutil.rmtree(data_path)
+
+
+if __name__ == "__main__":
+    main()
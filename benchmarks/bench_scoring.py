@@ -0,0 +1,96 @@
+"""
+Measures the latency of scoring a single user with `featurize.featurize_user`,
+with its default `SCORING_FEATURES` and with every feature, and of a whole JSON
+request through `featurize.handle_request`, for a typical user and a heavy
+one.
+
+To run from the root of the repository:
+```
+python -m benchmarks.bench_scoring
+```
+"""
+import argparse
+import json
+import time
+from benchmarks.synthetic_logs import LogGenerator
+from features import ALL_FEATURES
+from featurize import featurize_user, handle_request
+
+
+# (name, devices, calls, smss, contacts per device)
+USER_PROFILES = [
+    ("typical", 1, 300, 500, 150),
+    ("heavy", 3, 3000, 8000, 1500),
+]
+
+
+def build_payloads(num_devices, num_calls, num_sms, num_contacts, seed=0):
+    generator = LogGenerator(seed)
+    return [
+        {
+            "call_log": [generator.call(i) for i in range(num_calls)],
+            "contact_list": [
+                generator.contact(i) for i in range(num_contacts)
+            ],
+            "sms_log": [generator.sms(i) for i in range(num_sms)],
+        }
+        for _ in range(num_devices)
+    ]
+
+
+def percentile(sorted_values, fraction):
+    index = int(round(fraction * (len(sorted_values) - 1)))
+    return sorted_values[index]
+
+
+def time_calls(func, arg, repeat):
+    """
+    Returns the sorted latencies of `repeat` calls of `func(arg)` in ms.
+    """
+    # The first call builds the engine and the matchers, which a server
+    # does once.
+    func(arg)
+    latencies = []
+    for _ in range(repeat):
+        start = time.time()
+        func(arg)
+        latencies.append((time.time() - start) * 1000)
+    return sorted(latencies)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark the latency of scoring a single user."
+    )
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args(argv)
+
+    print("{:<10} {:<20} {:>8} {:>9} {:>9} {:>9}".format(
+        "user", "call", "records", "p50 ms", "p99 ms", "max ms"
+    ))
+    for name, num_devices, num_calls, num_sms, num_contacts in USER_PROFILES:
+        payloads = build_payloads(
+            num_devices, num_calls, num_sms, num_contacts
+        )
+        request = json.dumps({"devices": payloads})
+        num_records = num_devices * (num_calls + num_sms + num_contacts)
+        repeat = max(10, args.repeat * 1000 // num_records)
+        calls = [
+            ("featurize_user", featurize_user, payloads),
+            (
+                "featurize_user(all)",
+                lambda payloads: featurize_user(payloads, ALL_FEATURES),
+                payloads
+            ),
+            ("handle_request", handle_request, request),
+        ]
+        for call_name, func, arg in calls:
+            latencies = time_calls(func, arg, repeat)
+            print("{:<10} {:<20} {:>8} {:>9.2f} {:>9.2f} {:>9.2f}".format(
+                name, call_name, num_records, percentile(latencies, 0.5),
+                percentile(latencies, 0.99), latencies[-1]
+            ))
+
+
+if __name__ == "__main__":
+    main()
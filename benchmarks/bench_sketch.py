@@ -0,0 +1,166 @@
+"""
+Measures the error and the memory of the `--sketch` contact features against
+the exact ones, for users with more and more contacts.
+
+Each synthetic user's calls and smss go to their contacts with a skewed,
+power law like distribution, as real users' do, over a year. For every user
+the exact and the sketch accumulators of `engine.SKETCH_ACCUMULATORS` are fed
+the same records, and the relative error of each estimated column is
+printed next to the bytes each accumulator holds, not counting the address
+table they share.
+
+To run from the root of the repository:
+```
+python -m benchmarks.bench_sketch
+```
+"""
+import argparse
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+from engine import FeatureEngine, SKETCH_ACCUMULATORS
+
+
+COLUMNS = (
+    "total_num_contacts_interacted_with",
+    "ave_daily_contacts_interacted_with",
+    "top_contact_share",
+    "top_5_contacts_share",
+    "contact_concentration",
+)
+
+
+def build_device(num_records, num_contacts, skew=3.0, seed=0):
+    """
+    Returns a parsed device with `num_records` calls and smss split evenly,
+    to `num_contacts` numbers, where the chance of a number falls off with
+    its rank as `skew` grows.
+    """
+    rand = random.Random(seed)
+    start = datetime(2017, 1, 1)
+
+    def record():
+        contact = int(num_contacts * rand.random() ** skew)
+        return (
+            "07{:08d}".format(contact),
+            start + timedelta(seconds=rand.randint(0, 365 * 86400))
+        )
+
+    call_log = []
+    for _ in range(num_records // 2):
+        number, call_datetime = record()
+        call_log.append({
+            "phone_number": number, "datetime": call_datetime,
+            "duration": "60", "call_type": "1"
+        })
+    sms_log = []
+    for _ in range(num_records - num_records // 2):
+        address, sms_datetime = record()
+        sms_log.append({
+            "sms_address": address, "datetime": sms_datetime,
+            "message_body": ""
+        })
+    return {"call_log": call_log, "contacts": [], "sms_log": sms_log}
+
+
+def sizeof_state(value, seen=None):
+    """
+    Returns the bytes held by an accumulator, or any value it holds, without
+    the :class:`phone.PhoneNumberTable` shared by a user's accumulators.
+    """
+    if seen is None:
+        seen = set()
+    if id(value) in seen:
+        return 0
+    seen.add(id(value))
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(
+            sizeof_state(key, seen) + sizeof_state(item, seen)
+            for key, item in value.items()
+        )
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        size += sum(sizeof_state(item, seen) for item in value)
+    elif hasattr(value, "__dict__"):
+        size += sum(
+            sizeof_state(item, seen)
+            for name, item in vars(value).items() if name != "numbers"
+        )
+    return size
+
+
+def build(engine, device):
+    """
+    Returns the (features, state bytes, seconds) of a device.
+    """
+    start = time.time()
+    accumulators = engine.new_accumulators()
+    engine.add_device(accumulators, device)
+    seconds = time.time() - start
+    features = {}
+    for feature, value in engine.finalize(accumulators):
+        features.update(value)
+    return (
+        features,
+        sum(sizeof_state(acc) for acc in accumulators),
+        seconds
+    )
+
+
+def relative_error(estimate, exact):
+    if not exact:
+        return 0.0
+    return abs(estimate - exact) / float(exact)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark the error and memory of the sketch features."
+    )
+    parser.add_argument("--records", type=int, default=100000)
+    parser.add_argument("--contacts", default="100,1000,10000,50000",
+                        help="The comma separated numbers of contacts.")
+    parser.add_argument("--seeds", type=int, default=3,
+                        help="The number of users per number of contacts.")
+    args = parser.parse_args(argv)
+
+    features = sorted(SKETCH_ACCUMULATORS)
+    exact_engine = FeatureEngine(features)
+    sketch_engine = FeatureEngine(features, sketch=True)
+    print("{} records per user, the largest relative error of {} users".format(
+        args.records, args.seeds
+    ))
+    print("{:>8} {:>10} {:>10} {:>8} {:>8}  {}".format(
+        "contacts", "exact KB", "sketch KB", "exact s", "sketch s",
+        "  ".join(column[:24] for column in COLUMNS)
+    ))
+    for num_contacts in [int(num) for num in args.contacts.split(",")]:
+        errors = dict.fromkeys(COLUMNS, 0.0)
+        exact_bytes = sketch_bytes = 0
+        exact_seconds = sketch_seconds = 0.0
+        for seed in range(args.seeds):
+            device = build_device(args.records, num_contacts, seed=seed)
+            exact, num_bytes, seconds = build(exact_engine, device)
+            exact_bytes = max(exact_bytes, num_bytes)
+            exact_seconds += seconds
+            estimate, num_bytes, seconds = build(sketch_engine, device)
+            sketch_bytes = max(sketch_bytes, num_bytes)
+            sketch_seconds += seconds
+            for column in COLUMNS:
+                errors[column] = max(
+                    errors[column],
+                    relative_error(estimate[column], exact[column])
+                )
+        print("{:>8} {:>10.0f} {:>10.0f} {:>8.2f} {:>8.2f}  {}".format(
+            num_contacts, exact_bytes / 1024.0, sketch_bytes / 1024.0,
+            exact_seconds / args.seeds, sketch_seconds / args.seeds,
+            "  ".join(
+                "{:>{width}.2%}".format(errors[column], width=len(column[:24]))
+                for column in COLUMNS
+            )
+        ))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""
+Benchmarks `timestamps.TimestampParser` against the original
+`dateutil`-based `parse_timestamp`.
+
+To run from the root of the repository:
+```
+python -m benchmarks.bench_timestamps
+```
+"""
+import random
+import sys
+import time
+from datetime import datetime
+from timestamps import TimestampParser
+
+
+def legacy_parse_timestamp(timestamp_txt, default=None):
+    """
+    The original `generate_features.parse_timestamp`, kept as the baseline.
+    """
+    import dateutil.parser
+    try:
+        try:
+            timestamp = int(timestamp_txt) / 1000
+            if timestamp == 0:
+                return default
+        except ValueError:
+            # Try parsing iso format
+            return dateutil.parser.parse(timestamp_txt)
+        else:
+            return datetime.fromtimestamp(timestamp)
+    except:
+        # Invalid datetime, return default.
+        print("Received an invalid timestamp: {}".format(timestamp_txt))
+        return default
+
+
+class NullWriter(object):
+    def write(self, txt):
+        pass
+
+
+def build_timestamps(num_timestamps, seed=0):
+    """
+    Returns a mix of timestamps that looks like the user logs: mostly epoch
+    millis, some ISO strings, some zeros and a few invalid values. Synced
+    devices repeat a share of the timestamps.
+    """
+    rand = random.Random(seed)
+    timestamps = []
+    for _ in range(num_timestamps):
+        r = rand.random()
+        seconds = rand.randint(1420070400, 1514764800)
+        if r < 0.8:
+            timestamp = str(seconds * 1000 + rand.randint(0, 999))
+        elif r < 0.9:
+            timestamp = datetime.utcfromtimestamp(seconds).strftime(
+                rand.choice([
+                    "%Y-%m-%dT%H:%M:%SZ",
+                    "%Y-%m-%d %H:%M:%S",
+                    "%Y-%m-%dT%H:%M:%S.123456+03:00",
+                ])
+            )
+        elif r < 0.95:
+            timestamp = "0"
+        else:
+            timestamp = rand.choice(["", "null", "not a date"])
+        timestamps.append(timestamp)
+    # Roughly a fifth of the records are repeated by a synced device.
+    timestamps.extend(rand.sample(timestamps, num_timestamps // 5))
+    return timestamps
+
+
+def time_parser(parse, timestamps):
+    """
+    Returns the (seconds, results) of parsing every timestamp.
+    """
+    stdout = sys.stdout
+    # Silence the legacy parser's print on every invalid timestamp.
+    sys.stdout = NullWriter()
+    try:
+        start = time.time()
+        results = [parse(timestamp) for timestamp in timestamps]
+        return time.time() - start, results
+    finally:
+        sys.stdout = stdout
+
+
+def main(num_timestamps=200000):
+    timestamps = build_timestamps(num_timestamps)
+    parser = TimestampParser()
+
+    legacy_time, legacy_results = time_parser(
+        legacy_parse_timestamp, timestamps
+    )
+    new_time, new_results = time_parser(parser.parse, timestamps)
+    assert legacy_results == new_results, "The parsers do not agree."
+    print("Parsed {} timestamps".format(len(timestamps)))
+    print("legacy parse_timestamp: {:.3f}s ({:,.0f}/s)".format(
+        legacy_time, len(timestamps) / legacy_time
+    ))
+    print("TimestampParser:        {:.3f}s ({:,.0f}/s)".format(
+        new_time, len(timestamps) / new_time
+    ))
+    print("Speedup: {:.1f}x, {} invalid timestamps counted".format(
+        legacy_time / new_time, parser.invalid_count
+    ))
+
+
+if __name__ == "__main__":
+    main()
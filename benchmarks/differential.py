@@ -0,0 +1,809 @@
+"""
+Checks that every engine builds the same features as the reference
+extractors of `features.py`, column by column, over the same `user_logs/`
+trees, and reports the users they diverge on.
+
+The reference builds each user with `generate_features.build_user` and runs
+every extractor of `features.FEATURE_EXTRACTORS` on them. It is compared
+with each engine of `ENGINES`: the fused `FeatureEngine` in process, and
+runs of `generate_features.py` streaming, in two phases, over several
+workers, with a cold then a warm `--cache-dir`, with `--columnar` and
+`--batch` (if numpy is installed) and with `--sketch`, whose estimated
+columns are compared with the tolerances of `COLUMN_TOLERANCES`.
+`--normalize-numbers` counts differently on purpose, so it has no reference
+to be compared with.
+
+`--dedup-devices` is checked over a tree of fixtures written by
+`write_synced_device_logs`: each user is written once as a single device of
+the records it should keep, and once more with calls, smss and contacts
+synced to other devices, their numbers written in other formats. Each engine
+of `DEDUP_ENGINES` must build the synced user the same features as the
+reference builds the single device user, and drop exactly the synced copies,
+as counted in `duplicates`.
+
+The trees are a synthetic one from `benchmarks.synthetic_logs`, one of
+fixtures written by `write_edge_case_logs` for the edge cases the engines
+must agree on (users without devices or data files, `None` averages from
+`ave_or_none`, smss without a valid datetime that `build_ave_daily_sms_count`
+skips, a device with a single sms, malformed files, service addresses, ...)
+and any tree passed with `--logs`. Numbers match if they are within
+`--rel-tol` or `--abs-tol` of each other; a missing value, e.g. a `None`
+average, only matches another missing value.
+
+To run from the root of the repository:
+```
+python -m benchmarks.differential
+python -m benchmarks.differential --logs user_logs --engines engine,columnar
+```
+It exits with status 1 if any engine diverges from the reference.
+"""
+import argparse
+import csv
+import json
+import math
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+from itertools import count
+from os import makedirs, symlink
+from os.path import abspath, basename, dirname, join
+from benchmarks.synthetic_logs import (
+    NUMBER_FORMATS, LogGenerator, generate_user_logs
+)
+import generate_features
+from dedup import DEDUP_LOGS, new_duplicates
+from engine import FeatureEngine
+from features import ALL_FEATURES, FEATURE_EXTRACTORS
+from phone import canonical_phone_number
+
+
+GENERATE_FEATURES = join(dirname(dirname(abspath(__file__))),
+                         "generate_features.py")
+# The engines compared with the reference, in the order they run: None for
+# the in process `FeatureEngine`, or the arguments of a `generate_features.py`
+# run. The runs of the same cache folder run cold, then warm.
+ENGINES = (
+    ("engine", None),
+    ("streaming", []),
+    ("two-phase", ["--two-phase"]),
+    ("workers", ["--workers", "2"]),
+    ("cache-cold", ["--cache-dir", "{cache_dir}"]),
+    ("cache-warm", ["--cache-dir", "{cache_dir}"]),
+    ("columnar", ["--columnar"]),
+    ("columnar-cache-cold", ["--columnar", "--cache-dir", "{columns_dir}"]),
+    ("columnar-cache-warm", ["--columnar", "--cache-dir", "{columns_dir}"]),
+    ("batch", ["--batch"]),
+    ("batch-workers", ["--batch", "--batch-users", "3", "--workers", "2"]),
+    ("batch-cache-warm", ["--batch", "--cache-dir", "{columns_dir}"]),
+    ("sketch", ["--sketch"]),
+)
+# The engines run with `--dedup-devices` over the synced devices fixtures:
+# None for `generate_features.featurize_user_row` in process, or the
+# arguments of a `generate_features.py` run.
+DEDUP_ENGINES = (
+    ("dedup-user-row", None),
+    ("dedup-streaming", ["--dedup-devices"]),
+    ("dedup-two-phase", ["--dedup-devices", "--two-phase"]),
+    ("dedup-workers", ["--dedup-devices", "--workers", "2"]),
+)
+# The suffix of the user ids of the synced users of `write_synced_device_logs`.
+SYNCED_SUFFIX = "-synced"
+COLUMNAR_ENGINES = (
+    "columnar", "columnar-cache-cold", "columnar-cache-warm", "batch",
+    "batch-workers", "batch-cache-warm"
+)
+# The relative tolerances of the columns an engine estimates rather than
+# counts, well above the errors `benchmarks.bench_sketch` measures.
+COLUMN_TOLERANCES = {
+    "sketch": {
+        "total_num_contacts_interacted_with": 0.1,
+        "ave_daily_contacts_interacted_with": 0.1,
+        "top_contact_share": 0.05,
+        "top_5_contacts_share": 0.05,
+        "contact_concentration": 0.05,
+    },
+}
+REL_TOL = 1e-9
+ABS_TOL = 1e-9
+MAX_EXAMPLES = 10
+
+
+################################################################################
+#                              FIXTURES
+################################################################################
+def write_json(file_path, records):
+    with open(file_path, "w") as json_file:
+        json.dump(records, json_file)
+
+
+def write_user_logs(output_path, users):
+    """
+    Writes a `user_logs/` tree to `output_path` from a list of (user_id,
+    status, devices), where each device is a dict of file names to their
+    records, or None to leave a file out, or a string to write as is.
+    """
+    makedirs(output_path)
+    with open(join(output_path, "user_status.csv"), "w") as status_file:
+        writer = csv.writer(status_file)
+        writer.writerow(["user_id", "status"])
+        for user_id, status, devices in users:
+            writer.writerow([user_id, status])
+            makedirs(join(output_path, "user-{}".format(user_id)))
+            for number, files in enumerate(devices, 1):
+                device_folder_path = join(
+                    output_path,
+                    "user-{}".format(user_id),
+                    "device-{}".format(number)
+                )
+                makedirs(device_folder_path)
+                for file_name, file_records in files.items():
+                    file_path = join(device_folder_path, file_name)
+                    if file_records is None:
+                        continue
+                    if isinstance(file_records, basestring):
+                        with open(file_path, "w") as data_file:
+                            data_file.write(file_records)
+                    else:
+                        write_json(file_path, file_records)
+
+
+def write_edge_case_logs(output_path, seed=0):
+    """
+    Writes a `user_logs/` tree of small users that each hit an edge case of
+    the extractors to `output_path`.
+
+    Returns:
+        :class:`int` the number of users written.
+    """
+    generator = LogGenerator(seed)
+
+    def records(build_record, num, timestamp=None):
+        built = [build_record(item_id) for item_id in range(num)]
+        if timestamp is not None:
+            for record in built:
+                record["date_added" if "date_added" in record else
+                       "datetime"] = timestamp
+        return built
+
+    def device(calls=(), smss=(), contacts=()):
+        return {
+            generate_features.CALL_LOG_FILENAME: list(calls),
+            generate_features.SMS_LOG_FILENAME: list(smss),
+            generate_features.CONTACT_LIST_FILENAME: list(contacts),
+        }
+
+    same_day = str(1500000000000)
+    no_fields_sms = [{"datetime": same_day} for _ in range(3)]
+    service_calls = records(generator.call, 10)
+    for number, call in enumerate(service_calls):
+        call["phone_number"] = ["*144#", "#21#", None, ""][number % 4]
+    service_smss = records(generator.sms, 10)
+    for number, sms in enumerate(service_smss):
+        sms["sms_address"] = ["*144#", "MPESA", None][number % 3]
+        sms["message_body"] = [None, "", "ok", u"\xe9t\xe9 ok"][number % 4]
+    # Each user is a folder of devices, a device a dict of file names to
+    # their records, or None to leave a file out, or a string to write as is.
+    users = [
+        ("no-devices", []),
+        ("empty-device", [
+            dict.fromkeys(device(), None)
+        ]),
+        ("empty-logs", [device()]),
+        ("invalid-datetimes", [device(
+            records(generator.call, 20, "garbage"),
+            records(generator.sms, 20, "0"),
+            records(generator.contact, 5, "0")
+        )]),
+        ("single-sms-device", [
+            device(records(generator.call, 20), records(generator.sms, 1)),
+            device(records(generator.call, 20), records(generator.sms, 30)),
+        ]),
+        ("one-valid-sms", [device(
+            smss=records(generator.sms, 1) + records(generator.sms, 5, "0")
+        )]),
+        ("one-day", [device(
+            records(generator.call, 10, same_day),
+            records(generator.sms, 10, same_day),
+            records(generator.contact, 10, same_day)
+        )]),
+        ("service-addresses", [device(service_calls, service_smss)]),
+        ("missing-fields", [device(
+            [{"datetime": same_day}, {"phone_number": "0712345678"}],
+            no_fields_sms,
+            [{"phone_numbers": None}, {}]
+        )]),
+        ("malformed-json", [dict(
+            device(records(generator.call, 10)),
+            **{
+                generate_features.SMS_LOG_FILENAME: json.dumps(
+                    records(generator.sms, 10)
+                )[:-200],
+                generate_features.CONTACT_LIST_FILENAME: "not json"
+            }
+        )]),
+        ("many-devices", [
+            device(
+                records(generator.call, 50), records(generator.sms, 50),
+                records(generator.contact, 20)
+            )
+            for _ in range(4)
+        ]),
+    ]
+    write_user_logs(output_path, [
+        (user_id, ["repaid", "defaulted"][index % 2], devices)
+        for index, (user_id, devices) in enumerate(users)
+    ])
+    return len(users)
+
+
+def reformat_number(number, rand):
+    """
+    Returns a Kenyan `number` written in another of the formats of
+    `NUMBER_FORMATS`, or any other number as it is.
+    """
+    canonical = canonical_phone_number(number)
+    if not (canonical.startswith("+2547") and len(canonical) == 13):
+        return number
+    national = canonical[4:]
+    formats = [
+        number_format.format(
+            national, national[:3], national[3:6], national[6:]
+        )
+        for number_format in NUMBER_FORMATS
+    ]
+    return rand.choice([
+        formatted for formatted in formats if formatted != number
+    ])
+
+
+def synced_copy(log, record, rand):
+    """
+    Returns a copy of a record as another device syncs it: its number in
+    another format, and the fields that are not part of its dedup key, like
+    its item id, changed.
+    """
+    copy = dict(record, item_id=rand.randint(10000, 20000))
+    if log == "call_log":
+        copy["phone_number"] = reformat_number(record["phone_number"], rand)
+        copy["cached_name"] = None
+    elif log == "sms_log":
+        copy["sms_address"] = reformat_number(record["sms_address"], rand)
+        copy["thread_id"] = rand.randint(1, 100)
+    else:
+        copy["display_name"] = record["display_name"].upper()
+        copy["phone_numbers"] = [
+            reformat_number(number, rand) for number in record["phone_numbers"]
+        ]
+        copy["times_contacted"] = rand.randint(0, 50)
+    return copy
+
+
+def write_synced_device_logs(output_path, num_users=4, seed=0):
+    """
+    Writes a `user_logs/` tree to `output_path` of users whose records are
+    synced across their devices. Each user "<n>" has a single device of the
+    records `--dedup-devices` should keep, and the user "<n>-synced" the same
+    records spread over three devices:
+     - the first holds "<n>"'s first records, plus a call and an sms without
+       a valid datetime,
+     - the second synced copies of some of the first device's records,
+       including the records without a datetime, which are kept, followed by
+       new records,
+     - the third synced copies of records of both, followed by new records.
+
+    Returns:
+        :class:`dict` mapping the user id of each synced user to the number
+        of records of each log that should be dropped, as
+        `dedup.DeviceMerger.duplicates`.
+    """
+    sizes = {"call_log": 40, "sms_log": 60, "contacts": 20}
+    file_names = {
+        "call_log": generate_features.CALL_LOG_FILENAME,
+        "contacts": generate_features.CONTACT_LIST_FILENAME,
+        "sms_log": generate_features.SMS_LOG_FILENAME,
+    }
+    build_records = {
+        "call_log": LogGenerator.call,
+        "contacts": LogGenerator.contact,
+        "sms_log": LogGenerator.sms,
+    }
+    users = []
+    expected_duplicates = {}
+    for user in range(num_users):
+        generator = LogGenerator(seed + user, num_numbers=50)
+        rand = random.Random(seed + user)
+        item_ids = count()
+        start_ms = 1480000000000
+
+        def new_records(log, num):
+            records = []
+            for _ in range(num):
+                item_id = next(item_ids)
+                record = build_records[log](generator, item_id)
+                if log != "contacts":
+                    # A distinct valid datetime, so no two new records share
+                    # a dedup key.
+                    record["datetime"] = str(start_ms + item_id * 3600000)
+                records.append(record)
+            return records
+
+        kept = {}
+        synced = [{}, {}, {}]
+        duplicates = new_duplicates()
+        for log in DEDUP_LOGS:
+            first = new_records(log, sizes[log])
+            without_datetime = []
+            if log != "contacts":
+                without_datetime = new_records(log, 1)
+                without_datetime[0]["datetime"] = "0"
+            second_copies = [
+                synced_copy(log, record, rand)
+                for record in rand.sample(first, sizes[log] // 2)
+            ]
+            # Copies without a valid datetime can't be told apart from new
+            # records, so they are kept.
+            second_kept = [
+                synced_copy(log, record, rand) for record in without_datetime
+            ]
+            second_new = new_records(log, sizes[log] // 4)
+            third_copies = [
+                synced_copy(log, record, rand)
+                for record in rand.sample(first, sizes[log] // 4) +
+                rand.sample(second_new, sizes[log] // 8)
+            ]
+            third_new = new_records(log, sizes[log] // 4)
+            synced[0][log] = first + without_datetime
+            synced[1][log] = second_copies + second_kept + second_new
+            synced[2][log] = third_copies + third_new
+            kept[log] = (
+                first + without_datetime + second_kept + second_new +
+                third_new
+            )
+            duplicates[log] = len(second_copies) + len(third_copies)
+        status = ["repaid", "defaulted"][user % 2]
+        users.append((str(user), status, [
+            dict((file_names[log], kept[log]) for log in DEDUP_LOGS)
+        ]))
+        users.append((str(user) + SYNCED_SUFFIX, status, [
+            dict((file_names[log], device[log]) for log in DEDUP_LOGS)
+            for device in synced
+        ]))
+        expected_duplicates[str(user) + SYNCED_SUFFIX] = duplicates
+    write_user_logs(output_path, users)
+    return expected_duplicates
+
+
+################################################################################
+#                              RUNS
+################################################################################
+def build_rows(logs_path, build_features):
+    """
+    Returns :class:`dict` mapping each user id of a `user_logs/` tree to the
+    row of their features, built by `build_features(user_data)`, which
+    returns the (feature, value) tuples of a user.
+    """
+    generate_features.DATA_PATH = logs_path.rstrip("/") + "/"
+    rows = {}
+    for row in generate_features.read_user_status():
+        user_id = row.get("user_id")
+        user_data = generate_features.build_user(row)
+        rows[user_id] = generate_features.merge_user_features(
+            user_id, row.get("status"), build_features(user_data)
+        )
+    return rows
+
+
+def build_reference_features(user_data):
+    return [
+        (feature, FEATURE_EXTRACTORS[feature](user_data))
+        for feature in ALL_FEATURES
+    ]
+
+
+def run_generate_features(logs_path, args, work_dir, report=None):
+    """
+    Runs `generate_features.py` with `args` over a `user_logs/` tree, from a
+    folder of `work_dir` where `user_logs` links to it. If `report` is a
+    dict, it is updated with the run's telemetry report.
+
+    Returns:
+        :class:`dict` mapping each user id to their row of the csv file.
+    """
+    run_dir = tempfile.mkdtemp(prefix="run_", dir=work_dir)
+    symlink(abspath(logs_path), join(run_dir, "user_logs"))
+    output_path = join(run_dir, "feature_data.csv")
+    if report is None:
+        args = ["--no-telemetry"] + args
+    with open(os.devnull, "w") as devnull:
+        subprocess.check_call(
+            [
+                sys.executable, GENERATE_FEATURES, "--output", output_path
+            ] + args,
+            cwd=run_dir,
+            stdout=devnull
+        )
+    if report is not None:
+        report_path = generate_features.telemetry_report_path(output_path)
+        with open(report_path) as report_file:
+            report.update(json.load(report_file))
+    with open(output_path) as csv_file:
+        return dict(
+            (row["user_id"], row) for row in csv.DictReader(csv_file)
+        )
+
+
+def build_dedup_rows(logs_path, user_ids):
+    """
+    Builds the users of `user_ids` of a `user_logs/` tree with
+    `generate_features.featurize_user_row`, merging their devices.
+
+    Returns:
+        :class:`tuple` of (rows, duplicates) where rows maps each user id to
+        their row and duplicates each user id to the records dropped from
+        each log.
+    """
+    generate_features.DATA_PATH = logs_path.rstrip("/") + "/"
+    rows = {}
+    duplicates = {}
+    for row in generate_features.read_user_status():
+        user_id = row.get("user_id")
+        if user_id not in user_ids:
+            continue
+        _, status, user_features, _, _, user_duplicates = (
+            generate_features.featurize_user_row(row, dedup=True)
+        )
+        rows[user_id] = generate_features.merge_user_features(
+            user_id, status, user_features
+        )
+        duplicates[user_id] = user_duplicates
+    return rows, duplicates
+
+
+################################################################################
+#                              COMPARISON
+################################################################################
+def normalize_value(value):
+    """
+    Returns a value of the reference or of a csv file as a :class:`float`,
+    None if it is missing, or else as it is.
+    """
+    if value is None or value == "":
+        return None
+    if isinstance(value, (bool, int, long, float)):
+        return float(value)
+    try:
+        return float(value)
+    except ValueError:
+        return value
+
+
+def values_match(expected, actual, rel_tol=REL_TOL, abs_tol=ABS_TOL):
+    expected = normalize_value(expected)
+    actual = normalize_value(actual)
+    if not isinstance(expected, float) or not isinstance(actual, float):
+        return expected == actual
+    if math.isnan(expected) or math.isnan(actual):
+        return math.isnan(expected) and math.isnan(actual)
+    return abs(expected - actual) <= max(
+        rel_tol * max(abs(expected), abs(actual)), abs_tol
+    )
+
+
+def compare_rows(
+    expected_rows, actual_rows, columns, rel_tol=REL_TOL, abs_tol=ABS_TOL,
+    column_tolerances=None
+):
+    """
+    Returns :class:`list` of the (user_id, column, expected, actual) of every
+    value of `actual_rows` that diverges from `expected_rows`. A user missing
+    from either is reported with the column None.
+    """
+    if column_tolerances is None:
+        column_tolerances = {}
+    divergences = []
+    user_ids = sorted(
+        set(expected_rows) | set(actual_rows),
+        key=lambda user_id: generate_features.user_id_sort_key(
+            {"user_id": user_id}
+        )
+    )
+    for user_id in user_ids:
+        expected = expected_rows.get(user_id)
+        actual = actual_rows.get(user_id)
+        if expected is None or actual is None:
+            divergences.append((
+                user_id, None,
+                "row" if expected is not None else None,
+                "row" if actual is not None else None
+            ))
+            continue
+        for column in columns:
+            if not values_match(
+                expected.get(column), actual.get(column),
+                column_tolerances.get(column, rel_tol), abs_tol
+            ):
+                divergences.append(
+                    (user_id, column, expected.get(column), actual.get(column))
+                )
+    return divergences
+
+
+def compare_duplicates(expected_duplicates, actual_duplicates):
+    """
+    Returns :class:`list` of the (user_id, "duplicates:<log>", expected,
+    actual) of every number of dropped records of `actual_duplicates` that
+    differs from `expected_duplicates`, both mapping user ids to the
+    records dropped from each log.
+    """
+    divergences = []
+    for user_id in sorted(expected_duplicates):
+        expected = expected_duplicates[user_id]
+        actual = actual_duplicates.get(user_id) or {}
+        for log in DEDUP_LOGS:
+            if actual.get(log) != expected[log]:
+                divergences.append((
+                    user_id, "duplicates:" + log, expected[log],
+                    actual.get(log)
+                ))
+    return divergences
+
+
+def print_divergences(divergences, max_examples=MAX_EXAMPLES):
+    columns = {}
+    for _, column, _, _ in divergences:
+        columns[column] = columns.get(column, 0) + 1
+    print("    diverging columns: {}".format(", ".join(
+        "{} ({})".format(column or "missing rows", count)
+        for column, count in sorted(columns.items())
+    )))
+    for user_id, column, expected, actual in divergences[:max_examples]:
+        print("    user {}: {} expected {!r}, got {!r}".format(
+            user_id, column or "the row", expected, actual
+        ))
+
+
+def run_differential(
+    datasets, engines, work_dir, rel_tol=REL_TOL, abs_tol=ABS_TOL,
+    max_examples=MAX_EXAMPLES
+):
+    """
+    Compares each engine with the reference over each dataset and prints
+    the users they diverge on.
+
+    Parameters:
+        datasets (:class:`list`): The (name, path) of each `user_logs/` tree.
+        engines (:class:`list`): The (name, args) of each engine, as
+            `ENGINES`.
+
+    Returns:
+        :class:`dict` mapping each "<dataset>/<engine>" to the list of its
+        divergences, as `compare_rows`.
+    """
+    columns = generate_features.output_fieldnames()
+    results = {}
+    print("{:<14} {:<20} {:>6} {:>10}".format(
+        "dataset", "engine", "users", "diverging"
+    ))
+    for dataset, logs_path in datasets:
+        dataset_dir = tempfile.mkdtemp(prefix=dataset + "_", dir=work_dir)
+        paths = {
+            "cache_dir": join(dataset_dir, "cache"),
+            "columns_dir": join(dataset_dir, "columns_cache"),
+        }
+        expected_rows = build_rows(logs_path, build_reference_features)
+        for engine, args in engines:
+            if args is None:
+                feature_engine = FeatureEngine()
+                actual_rows = build_rows(
+                    logs_path, feature_engine.build_features
+                )
+            else:
+                actual_rows = run_generate_features(
+                    logs_path, [arg.format(**paths) for arg in args],
+                    dataset_dir
+                )
+            divergences = compare_rows(
+                expected_rows, actual_rows, columns, rel_tol, abs_tol,
+                COLUMN_TOLERANCES.get(engine)
+            )
+            results["{}/{}".format(dataset, engine)] = divergences
+            print("{:<14} {:<20} {:>6} {:>10}".format(
+                dataset, engine, len(expected_rows),
+                len(set(user_id for user_id, _, _, _ in divergences))
+            ))
+            if divergences:
+                print_divergences(divergences, max_examples)
+    return results
+
+
+def run_dedup_differential(
+    logs_path, expected_duplicates, engines, work_dir, rel_tol=REL_TOL,
+    abs_tol=ABS_TOL, max_examples=MAX_EXAMPLES
+):
+    """
+    Compares the features each engine builds with `--dedup-devices` for the
+    synced users of a tree written by `write_synced_device_logs` with the
+    reference features of their single device twins, and the records each
+    engine dropped with `expected_duplicates`. The runs of
+    `generate_features.py` only report the duplicates of the whole run.
+
+    Parameters:
+        engines (:class:`list`): The (name, args) of each engine, as
+            `DEDUP_ENGINES`.
+
+    Returns:
+        :class:`dict` mapping each "synced-devices/<engine>" to the list of
+        its divergences, as `compare_rows` and `compare_duplicates`.
+    """
+    columns = [
+        column for column in generate_features.output_fieldnames()
+        if column != "user_id"
+    ]
+    synced_ids = set(expected_duplicates)
+    generate_features.DATA_PATH = logs_path.rstrip("/") + "/"
+    twin_rows = dict(
+        (row.get("user_id") + SYNCED_SUFFIX, row)
+        for row in generate_features.read_user_status()
+    )
+    expected_rows = {}
+    for user_id in synced_ids:
+        row = twin_rows[user_id]
+        user_data = generate_features.build_user(row)
+        # The twin's records are counted as the synced user's, whose learned
+        # phrases, see `utils.phrase_fold`, may be those of another fold.
+        user_data["user_id"] = user_id
+        expected_rows[user_id] = generate_features.merge_user_features(
+            user_id, row.get("status"), build_reference_features(user_data)
+        )
+    total_duplicates = new_duplicates()
+    for duplicates in expected_duplicates.values():
+        for log in DEDUP_LOGS:
+            total_duplicates[log] += duplicates[log]
+    dataset_dir = tempfile.mkdtemp(prefix="synced_devices_", dir=work_dir)
+    results = {}
+    for engine, args in engines:
+        if args is None:
+            actual_rows, actual_duplicates = build_dedup_rows(
+                logs_path, synced_ids
+            )
+            divergences = compare_duplicates(
+                expected_duplicates, actual_duplicates
+            )
+        else:
+            report = {}
+            actual_rows = run_generate_features(
+                logs_path, args, dataset_dir, report
+            )
+            divergences = compare_duplicates(
+                {"all": total_duplicates},
+                {"all": report.get("duplicates")}
+            )
+        actual_rows = dict(
+            (user_id, row) for user_id, row in actual_rows.items()
+            if user_id in synced_ids
+        )
+        divergences = compare_rows(
+            expected_rows, actual_rows, columns, rel_tol, abs_tol
+        ) + divergences
+        results["synced-devices/{}".format(engine)] = divergences
+        print("{:<14} {:<20} {:>6} {:>10}".format(
+            "synced-devices", engine, len(expected_rows),
+            len(set(user_id for user_id, _, _, _ in divergences))
+        ))
+        if divergences:
+            print_divergences(divergences, max_examples)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Compare every engine's features with the reference "
+        "extractors."
+    )
+    parser.add_argument(
+        "--logs", action="append", default=[],
+        help="A user_logs/ tree to compare over, on top of the generated "
+        "ones. Can be given several times."
+    )
+    parser.add_argument(
+        "--no-generated", action="store_true",
+        help="Only compare over the --logs trees, not the synthetic and edge "
+        "case ones."
+    )
+    parser.add_argument("--users", type=int, default=30,
+                        help="The number of synthetic users.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--engines",
+        help="A comma separated list of the engines to compare, out of {}. "
+        "Defaults to every engine.".format(
+            ", ".join(engine for engine, _ in ENGINES + DEDUP_ENGINES)
+        )
+    )
+    parser.add_argument("--rel-tol", type=float, default=REL_TOL)
+    parser.add_argument("--abs-tol", type=float, default=ABS_TOL)
+    parser.add_argument("--max-examples", type=int, default=MAX_EXAMPLES,
+                        help="The most divergences printed per engine.")
+    parser.add_argument("--report",
+                        help="A JSON file to write every divergence to.")
+    args = parser.parse_args(argv)
+
+    engines = list(ENGINES)
+    dedup_engines = list(DEDUP_ENGINES)
+    if args.engines:
+        names = [name.strip() for name in args.engines.split(",")]
+        unknown = set(names) - set(
+            engine for engine, _ in ENGINES + DEDUP_ENGINES
+        )
+        if unknown:
+            parser.error("Unknown engines: {}".format(
+                ", ".join(sorted(unknown))
+            ))
+        engines = [engine for engine in ENGINES if engine[0] in names]
+        dedup_engines = [
+            engine for engine in DEDUP_ENGINES if engine[0] in names
+        ]
+    if not generate_features.columnar_installed():
+        skipped = [
+            engine for engine, _ in engines if engine in COLUMNAR_ENGINES
+        ]
+        if skipped:
+            print("Skipping {} without numpy.".format(", ".join(skipped)))
+        engines = [
+            engine for engine in engines if engine[0] not in COLUMNAR_ENGINES
+        ]
+    if args.no_generated and not args.logs:
+        parser.error("--no-generated requires --logs")
+
+    work_dir = tempfile.mkdtemp(prefix="differential_")
+    try:
+        datasets = []
+        if not args.no_generated:
+            synthetic_path = join(work_dir, "synthetic")
+            generate_user_logs(
+                synthetic_path, num_users=args.users, num_calls=200,
+                num_sms=400, num_contacts=100, seed=args.seed
+            )
+            edge_cases_path = join(work_dir, "edge_cases")
+            write_edge_case_logs(edge_cases_path, args.seed)
+            datasets.extend([
+                ("synthetic", synthetic_path), ("edge-cases", edge_cases_path)
+            ])
+        datasets.extend(
+            (basename(logs_path.rstrip("/")) or logs_path, logs_path)
+            for logs_path in args.logs
+        )
+        results = run_differential(
+            datasets, engines, work_dir, args.rel_tol, args.abs_tol,
+            args.max_examples
+        )
+        if not args.no_generated and dedup_engines:
+            synced_path = join(work_dir, "synced_devices")
+            expected_duplicates = write_synced_device_logs(
+                synced_path, seed=args.seed
+            )
+            results.update(run_dedup_differential(
+                synced_path, expected_duplicates, dedup_engines, work_dir,
+                args.rel_tol, args.abs_tol, args.max_examples
+            ))
+    finally:
+        shutil.rmtree(work_dir)
+
+    if args.report:
+        with open(args.report, "w") as report_file:
+            json.dump(results, report_file, indent=2, sort_keys=True)
+    diverged = sorted(name for name, divergences in results.items()
+                      if divergences)
+    if diverged:
+        print("{} runs diverged from the reference: {}".format(
+            len(diverged), ", ".join(diverged)
+        ))
+        sys.exit(1)
+    print("Every engine matches the reference.")
+
+
+if __name__ == "__main__":
+    main()
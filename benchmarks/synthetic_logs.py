@@ -0,0 +1,234 @@
+"""
+Generates a synthetic `user_logs/` tree for benchmarks.
+
+The tree has the layout `generate_features.py` reads, with a
+`user_status.csv` and `user-{user_id}/device-{n}/collated_*.txt` files
+holding records with the same keys as the real logs (see the README). Values
+are random but shaped like the real ones: most timestamps are epoch
+milliseconds, some are ISO strings, 0 or garbage, numbers are written in
+several formats ("+254712...", "0712...", "254 712 ..."), a few addresses are
+USSD codes like "*144#" or international numbers and some sms bodies are loan
+reminders or contain bad words.
+
+To generate 200 users in ./user_logs from the root of the repository:
+```
+python -m benchmarks.synthetic_logs --users 200 --output user_logs
+```
+"""
+import argparse
+import csv
+import json
+import random
+from os import makedirs
+from os.path import join
+
+
+WORDS = (
+    "hi hello how are you ok thanks please send money tomorrow today call me "
+    "when home good morning night love see you soon where at work school "
+    "church market bus fare airtime bundles mpesa received confirmed"
+).split()
+LOAN_REMINDERS = [
+    "{name}, don't let a small debt affect your credit history. You are "
+    "{days} days late on your Branch loan! Honour your debt of Ksh {amount} "
+    "to Paybill: 998608.",
+    "Dear {name}, your loan of Ksh {amount} is due tomorrow. Repay via "
+    "Paybill 998608.",
+]
+NAMES = ["Sylviah", "John", "Mary", "Peter", "Grace", "James", "Ann"]
+BAD_WORDS = ["fuck", "shit", "damn"]
+USSD_CODES = ["*144#", "*131#", "*100#", "*544#"]
+INTERNATIONAL_CODES = ["1", "44", "255", "256"]
+# The ways a Kenyan number "7xxxxxxxx" is written in the logs, formatted with
+# the number and its three groups of digits.
+NUMBER_FORMATS = [
+    "+254{0}", "+254{0}", "+254{0}", "0{0}", "254{0}", "+254 {1} {2} {3}"
+]
+
+
+class LogGenerator(object):
+    """
+    Builds random records for a user's logs.
+
+    Parameters:
+        seed (:class:`int`): The seed of the random generator, the same seed
+            always builds the same records.
+        num_numbers (:class:`int`): The number of distinct phone numbers
+            each user calls and texts.
+    """
+    def __init__(self, seed=0, num_numbers=200):
+        self.rand = random.Random(seed)
+        self.num_numbers = num_numbers
+
+    def timestamp(self):
+        rand = self.rand
+        epoch_ms = rand.randint(1480000000000, 1510000000000)
+        r = rand.random()
+        if r < 0.85:
+            return str(epoch_ms)
+        if r < 0.95:
+            return "2017-{:02d}-{:02d}T{:02d}:{:02d}:{:02d}Z".format(
+                rand.randint(1, 12), rand.randint(1, 28), rand.randint(0, 23),
+                rand.randint(0, 59), rand.randint(0, 59)
+            )
+        if r < 0.99:
+            return "0"
+        return "garbage"
+
+    def phone_number(self):
+        rand = self.rand
+        r = rand.random()
+        if r < 0.03:
+            return rand.choice(USSD_CODES)
+        if r < 0.05:
+            return None
+        number = "7{:08d}".format(rand.randint(0, self.num_numbers))
+        if r < 0.07:
+            return "+{}{}".format(rand.choice(INTERNATIONAL_CODES), number)
+        return rand.choice(NUMBER_FORMATS).format(
+            number, number[:3], number[3:6], number[6:]
+        )
+
+    def message_body(self):
+        rand = self.rand
+        r = rand.random()
+        if r < 0.05:
+            return rand.choice(LOAN_REMINDERS).format(
+                name=rand.choice(NAMES),
+                days=rand.randint(1, 60),
+                amount=rand.randint(100, 5000)
+            )
+        if r < 0.08:
+            return ""
+        words = [rand.choice(WORDS) for _ in range(rand.randint(1, 25))]
+        if r < 0.12:
+            words.insert(rand.randint(0, len(words)), rand.choice(BAD_WORDS))
+        return " ".join(words)
+
+    def contact(self, item_id):
+        rand = self.rand
+        return {
+            "date_added": self.timestamp(),
+            "display_name": "{} {}".format(rand.choice(NAMES), item_id),
+            "item_id": item_id,
+            "last_time_contacted": self.timestamp(),
+            "phone_numbers": [self.phone_number()],
+            "photo_id": None,
+            "times_contacted": rand.randint(0, 50),
+        }
+
+    def call(self, item_id):
+        rand = self.rand
+        return {
+            "cached_name": rand.choice(NAMES),
+            "call_type": str(rand.randint(1, 3)),
+            "country_iso": "KE",
+            "data_usage": None,
+            "datetime": self.timestamp(),
+            "duration": str(rand.randint(0, 900)),
+            "features_video": "0",
+            "geocoded_location": "Kenya",
+            "is_read": "1",
+            "item_id": item_id,
+            "phone_number": self.phone_number(),
+        }
+
+    def sms(self, item_id):
+        rand = self.rand
+        return {
+            "contact_id": None,
+            "datetime": self.timestamp(),
+            "item_id": item_id,
+            "message_body": self.message_body(),
+            "sms_address": self.phone_number(),
+            "sms_type": str(rand.randint(1, 2)),
+            "thread_id": rand.randint(1, 100),
+        }
+
+
+def write_json(file_path, records):
+    with open(file_path, "w") as json_file:
+        json.dump(records, json_file)
+
+
+def generate_user_logs(
+    output_path, num_users=100, max_devices=3, num_calls=500, num_sms=1000,
+    num_contacts=200, seed=0
+):
+    """
+    Writes a synthetic `user_logs/` tree to `output_path`.
+
+    Each user gets between 1 and `max_devices` devices, and each device gets
+    between half and all of `num_calls`, `num_sms` and `num_contacts`
+    records.
+
+    Returns:
+        :class:`int` the total number of records written.
+    """
+    generator = LogGenerator(seed)
+    rand = generator.rand
+    num_records = 0
+    makedirs(output_path)
+    with open(join(output_path, "user_status.csv"), "w") as status_file:
+        writer = csv.writer(status_file)
+        writer.writerow(["user_id", "status"])
+        for user_id in range(1, num_users + 1):
+            writer.writerow(
+                [user_id, rand.choice(["repaid", "repaid", "defaulted"])]
+            )
+            for device in range(1, rand.randint(1, max_devices) + 1):
+                device_folder_path = join(
+                    output_path,
+                    "user-{}".format(user_id),
+                    "device-{}".format(device)
+                )
+                makedirs(device_folder_path)
+                logs = [
+                    ("collated_call_log.txt", generator.call, num_calls),
+                    ("collated_sms_log.txt", generator.sms, num_sms),
+                    (
+                        "collated_contact_list.txt", generator.contact,
+                        num_contacts
+                    ),
+                ]
+                for file_name, build_record, num in logs:
+                    records = [
+                        build_record(item_id)
+                        for item_id in range(rand.randint(num // 2, num))
+                    ]
+                    write_json(join(device_folder_path, file_name), records)
+                    num_records += len(records)
+    return num_records
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Generate a synthetic user_logs/ tree."
+    )
+    parser.add_argument("--output", default="user_logs")
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--max-devices", type=int, default=3)
+    parser.add_argument("--calls", type=int, default=500,
+                        help="The maximum number of calls per device.")
+    parser.add_argument("--sms", type=int, default=1000,
+                        help="The maximum number of smss per device.")
+    parser.add_argument("--contacts", type=int, default=200,
+                        help="The maximum number of contacts per device.")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+    num_records = generate_user_logs(
+        args.output,
+        num_users=args.users,
+        max_devices=args.max_devices,
+        num_calls=args.calls,
+        num_sms=args.sms,
+        num_contacts=args.contacts,
+        seed=args.seed
+    )
+    print("Wrote {} records for {} users to {}".format(
+        num_records, args.users, args.output
+    ))
+
+
+if __name__ == "__main__":
+    main()
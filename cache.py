@@ -0,0 +1,359 @@
+"""
+An on-disk cache of the per-device partial aggregates built by the
+`FeatureEngine`.
+
+Each device folder gets one cache file per list of features, holding the
+partials of those features along with the size, mtime and content hash of
+each of the device's data files that they read, and the fingerprint of the
+word lists the sms features are counted with. On a rerun a device is only
+re-parsed and re-aggregated if one of those files, or the word lists,
+changed:
+ - If the size and mtime of every file match, the entry is used as is.
+ - Otherwise the content of the files whose size or mtime changed is hashed,
+    and the entry is still used if the hashes match (e.g. the files were
+    copied or touched).
+
+The hashes an entry is stored with are taken from the bytes the parser reads,
+see :class:`HashingFile`, so building a device never reads its files twice. A
+file whose read failed has no hash, and its entry is rebuilt once its size or
+mtime change.
+"""
+from os import getpid, makedirs, rename, stat
+from os.path import isdir, join
+import hashlib
+from features import word_lists_fingerprint
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+
+CACHE_VERSION = 6
+HASH_BLOCK_SIZE = 1 << 20
+
+
+def hash_file(file_path):
+    """
+    Returns the sha1 hex digest of the file's content.
+    """
+    sha1 = hashlib.sha1()
+    with open(file_path, "rb") as data_file:
+        while True:
+            block = data_file.read(HASH_BLOCK_SIZE)
+            if not block:
+                break
+            sha1.update(block)
+    return sha1.hexdigest()
+
+
+class HashingFile(object):
+    """
+    Wraps a data file being parsed, hashing every byte read from it. Once it
+    is closed, the rest of the file is read and the sha1 hex digest of the
+    whole of it, as `hash_file` returns, is added to `hashes` under
+    `file_path`, unless reading it failed.
+    """
+    def __init__(self, data_file, file_path, hashes):
+        self.data_file = data_file
+        self.file_path = file_path
+        self.hashes = hashes
+        self.sha1 = hashlib.sha1()
+
+    def read(self, size=-1):
+        try:
+            data = self.data_file.read(size)
+        except (IOError, OSError):
+            self.sha1 = None
+            raise
+        if self.sha1 is not None:
+            self.sha1.update(data)
+        return data
+
+    def close(self):
+        if self.sha1 is not None:
+            try:
+                while True:
+                    block = self.data_file.read(HASH_BLOCK_SIZE)
+                    if not block:
+                        break
+                    self.sha1.update(block)
+                self.hashes[self.file_path] = self.sha1.hexdigest()
+            except (IOError, OSError):
+                pass
+            self.sha1 = None
+        self.data_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def stat_file(file_path):
+    """
+    Returns (size, mtime) of the file or None if it does not exist.
+    """
+    try:
+        file_stat = stat(file_path)
+    except OSError:
+        return None
+    return file_stat.st_size, file_stat.st_mtime
+
+
+class DeviceCache(object):
+    """
+    Caches the partials of each device.
+
+    Parameters:
+        cache_dir (:class:`str`): The folder to store the cache files in.
+            Created if it does not exist.
+        file_names (:class:`list`): The names of the data files in each
+            device folder that the partials are built from.
+    """
+    entry_extension = ".pickle"
+
+    def __init__(self, cache_dir, file_names):
+        self.cache_dir = cache_dir
+        self.file_names = sorted(file_names)
+        self.fingerprint = word_lists_fingerprint()
+        if not isdir(cache_dir):
+            try:
+                makedirs(cache_dir)
+            except OSError:
+                # Another worker may have just created it.
+                if not isdir(cache_dir):
+                    raise
+
+    def entry_path(self, device_folder_path, features):
+        # A run over a subset of the features gets its own entry so it does
+        # not evict the entry of a full run.
+        key = "\0".join([device_folder_path] + list(features))
+        return join(
+            self.cache_dir,
+            hashlib.sha1(key).hexdigest() + self.entry_extension
+        )
+
+    def file_keys(self, device_folder_path):
+        """
+        Returns :class:`dict` mapping each data file name to its (size, mtime)
+        or None if the file does not exist.
+        """
+        return dict(
+            (file_name, stat_file(join(device_folder_path, file_name)))
+            for file_name in self.file_names
+        )
+
+    def get(self, device_folder_path, features):
+        """
+        Returns the cached (partials, invalid_timestamps) of the device or
+        None if there is no entry for it, the entry was built for a different
+        list of features or any of the device's data files changed.
+        """
+        try:
+            entry_path = self.entry_path(device_folder_path, features)
+            with open(entry_path, "rb") as cache_file:
+                entry = pickle.load(cache_file)
+        except Exception:
+            # A missing or corrupt entry is just a cache miss.
+            return None
+        if (
+            entry.get("version") != CACHE_VERSION or
+            entry.get("fingerprint") != self.fingerprint or
+            entry.get("device_folder_path") != device_folder_path or
+            entry.get("features") != list(features)
+        ):
+            return None
+
+        file_keys = self.check_files(
+            device_folder_path, entry["file_keys"], entry["file_hashes"]
+        )
+        if file_keys is None:
+            return None
+        if file_keys != entry["file_keys"]:
+            # Only the stats changed, refresh them so the next run does not
+            # have to hash the files again.
+            entry["file_keys"] = file_keys
+            self._write(entry)
+        return entry["partials"], entry["invalid_timestamps"]
+
+    def check_files(self, device_folder_path, entry_file_keys, entry_hashes):
+        """
+        Checks the device's data files against the stats and hashes they had
+        when an entry was built.
+
+        Returns:
+            :class:`dict` of the current `file_keys` of the device if the
+            content of its files did not change, or None if it did.
+        """
+        file_keys = self.file_keys(device_folder_path)
+        for file_name in self.file_names:
+            if file_keys[file_name] == entry_file_keys.get(file_name):
+                continue
+            if file_keys[file_name] is None or (
+                entry_file_keys.get(file_name) is None
+            ):
+                # A data file was added or removed.
+                return None
+            if entry_hashes.get(file_name) is None:
+                # The file was not read in full when the entry was built.
+                return None
+            file_hash = hash_file(join(device_folder_path, file_name))
+            if file_hash != entry_hashes.get(file_name):
+                return None
+        return file_keys
+
+    def describe(self, device_folder_path):
+        """
+        Returns (file_keys, read_hashes) of the device's data files, where
+        read_hashes is an empty :class:`dict` for the parser to add the hash
+        of each file it reads to, keyed by path, with :class:`HashingFile`.
+        Should be called before the files are read so a file that changes
+        while it is being read is picked up on the next run.
+        """
+        return self.file_keys(device_folder_path), {}
+
+    def file_hashes(self, device_folder_path, read_hashes):
+        """
+        Returns :class:`dict` mapping each data file name to its hash in
+        `read_hashes`, keyed by path, or None if it was not read in full.
+        """
+        return dict(
+            (file_name, read_hashes.get(join(device_folder_path, file_name)))
+            for file_name in self.file_names
+        )
+
+    def put(
+        self, device_folder_path, features, partials, invalid_timestamps,
+        description
+    ):
+        """
+        Stores the partials of a device.
+
+        Parameters:
+            description (:class:`tuple`): The `describe` of the device taken
+                before its files were read, with the hashes of the files
+                read since.
+        """
+        file_keys, read_hashes = description
+        file_hashes = self.file_hashes(device_folder_path, read_hashes)
+        self._write({
+            "version": CACHE_VERSION,
+            "fingerprint": self.fingerprint,
+            "device_folder_path": device_folder_path,
+            "features": list(features),
+            "file_keys": file_keys,
+            "file_hashes": file_hashes,
+            "partials": partials,
+            "invalid_timestamps": invalid_timestamps,
+        })
+
+    def _write(self, entry):
+        # Write to a temporary file first so a reader never sees a partially
+        # written entry.
+        entry_path = self.entry_path(
+            entry["device_folder_path"], entry["features"]
+        )
+        tmp_path = "{}.{}.tmp".format(entry_path, getpid())
+        with open(tmp_path, "wb") as cache_file:
+            pickle.dump(entry, cache_file, pickle.HIGHEST_PROTOCOL)
+        rename(tmp_path, entry_path)
+
+
+class DeviceColumnsCache(DeviceCache):
+    """
+    Caches the parsed records of each device as a binary file of columns,
+    see `columnar.write_device_columns`, that is memory mapped on later runs
+    so the device's logs are neither read nor parsed again.
+
+    Unlike the partials, the columns hold what every columnar extractor
+    needs, so one entry serves any list of features.
+    """
+    entry_extension = ".columns"
+
+    def __init__(self, cache_dir, file_names):
+        # numpy is only imported by the runs that need it.
+        from columnar import columns_fingerprint
+        super(DeviceColumnsCache, self).__init__(cache_dir, file_names)
+        # The columns also depend on their layout.
+        self.fingerprint = columns_fingerprint()
+
+    def get(self, device_folder_path, address_table, phrase_fold=None):
+        """
+        Returns the cached (columns, invalid_timestamps) of the device, with
+        its addresses interned into `address_table`, or None if there is no
+        entry for it, its phrase hits were counted for another
+        `utils.phrase_fold` or any of the device's data files changed.
+        """
+        from columnar import read_device_columns
+        try:
+            columns, header = read_device_columns(
+                self.entry_path(device_folder_path, ()), address_table
+            )
+        except Exception:
+            # A missing or corrupt entry is just a cache miss.
+            return None
+        if (
+            header.get("version") != CACHE_VERSION or
+            header.get("fingerprint") != self.fingerprint or
+            header.get("device_folder_path") != device_folder_path or
+            header.get("phrase_fold") != phrase_fold
+        ):
+            return None
+        # JSON turned the (size, mtime) tuples into lists.
+        entry_file_keys = dict(
+            (file_name, tuple(key) if key is not None else None)
+            for file_name, key in header["file_keys"].items()
+        )
+        file_keys = self.check_files(
+            device_folder_path, entry_file_keys, header["file_hashes"]
+        )
+        if file_keys is None:
+            return None
+        invalid_timestamps = tuple(header["invalid_timestamps"])
+        if file_keys != entry_file_keys:
+            # Only the stats changed, refresh them so the next run does not
+            # have to hash the files again.
+            self.put(
+                device_folder_path,
+                columns,
+                address_table,
+                invalid_timestamps,
+                (file_keys, dict(
+                    (join(device_folder_path, file_name), file_hash)
+                    for file_name, file_hash in header["file_hashes"].items()
+                )),
+                phrase_fold
+            )
+        return columns, invalid_timestamps
+
+    def put(
+        self, device_folder_path, columns, address_table, invalid_timestamps,
+        description, phrase_fold=None
+    ):
+        """
+        Stores the columns of a device.
+
+        Parameters:
+            description (:class:`tuple`): The `describe` of the device taken
+                before its files were read, with the hashes of the files
+                read since.
+            phrase_fold (:class:`int`): The `utils.phrase_fold` the phrase
+                hits of the columns were counted for.
+        """
+        from columnar import write_device_columns
+        file_keys, read_hashes = description
+        file_hashes = self.file_hashes(device_folder_path, read_hashes)
+        entry_path = self.entry_path(device_folder_path, ())
+        tmp_path = "{}.{}.tmp".format(entry_path, getpid())
+        with open(tmp_path, "wb") as columns_file:
+            write_device_columns(columns_file, columns, address_table, {
+                "version": CACHE_VERSION,
+                "fingerprint": self.fingerprint,
+                "device_folder_path": device_folder_path,
+                "file_keys": file_keys,
+                "file_hashes": file_hashes,
+                "invalid_timestamps": invalid_timestamps,
+                "phrase_fold": phrase_fold,
+            })
+        rename(tmp_path, entry_path)
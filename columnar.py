@@ -0,0 +1,661 @@
+"""
+A columnar, array-backed representation of a user's parsed device logs.
+
+Parsed records are full JSON dicts holding `datetime` objects and many fields
+no feature uses (`photo_id`, `features_video`, `geocoded_location`, ...),
+which costs hundreds of bytes per record. `DeviceColumns` only keeps the
+fields the features need, as typed NumPy columns:
+ - times as int64 wall-clock seconds since 1970-01-01 in the record's own
+    timezone, so `time // SECONDS_PER_DAY` is the day `datetime.date()` gives,
+ - durations, message body lengths and word counts as int32,
+ - whether each call is outgoing as a bool,
+ - addresses as int32 ids into the user's `AddressTable`.
+
+Every feature in `features.FEATURE_EXTRACTORS` has a matching vectorized
+extractor in `COLUMNAR_EXTRACTORS` that computes the same value with NumPy
+reductions over these columns.
+
+NumPy is only needed when this module is used. To install it:
+```
+pip install numpy
+```
+"""
+from datetime import date, datetime
+import hashlib
+import json
+import mmap
+import struct
+from features import (
+    ALL_FEATURES, format_phrase_hits, get_sms_phrase_matcher,
+    top_contact_features, word_lists_fingerprint
+)
+from phone import INTERNATIONAL, canonical_phone_number, phone_number_flags
+from activity import DailyActivity, activity_features
+from text_stats import (
+    TEXT_COUNTS, TextStats, text_features
+)
+from utils import (
+    ave_or_none, BAD_WORDS_LIST, OUTGOING_CALL_TYPES, parse_duration
+)
+numpy_installed = False
+try:
+    import numpy as np
+    numpy_installed = True
+except ImportError:
+    pass
+
+
+# Stored in place of the time of a record without a valid datetime.
+INVALID_TIME = -(2 ** 63)
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+SECONDS_PER_DAY = 86400
+# The start of a file written by `write_device_columns`. Bump the version when
+# the columns or their layout change.
+COLUMNS_MAGIC = "DEVCOLS4"
+COLUMNS_ALIGNMENT = 8
+ADDRESS_COLUMNS = ("call_addresses", "sms_addresses")
+
+
+class AddressTable(object):
+    """
+    Interns the lowercased addresses of a user's calls and smss into integer
+    ids so the same address on any of the user's devices gets the same id.
+    Empty addresses get the id -1.
+
+    Parameters:
+        normalize (:class:`bool`): Whether addresses with the same canonical
+            phone number count as the same contact, like
+            :class:`phone.PhoneNumberTable`.
+    """
+    def __init__(self, normalize=False):
+        self.normalize = normalize
+        self.ids = {}
+        self.addresses = []
+
+    def intern(self, address):
+        if not address:
+            return -1
+        address = address.lower()
+        address_id = self.ids.get(address)
+        if address_id is None:
+            address_id = self.ids[address] = len(self.addresses)
+            self.addresses.append(address)
+        return address_id
+
+    def intern_lowercased(self, addresses):
+        """
+        Returns :class:`list` of the ids of non empty addresses that are
+        already lowercased, e.g. the addresses of another table.
+        """
+        ids = self.ids
+        table_addresses = self.addresses
+        address_ids = []
+        for address in addresses:
+            address_id = ids.get(address)
+            if address_id is None:
+                address_id = ids[address] = len(table_addresses)
+                table_addresses.append(address)
+            address_ids.append(address_id)
+        return address_ids
+
+    def symbol_flags(self, symbol):
+        """
+        Returns a boolean array, indexed by address id, that is True for the
+        addresses containing `symbol`, e.g. "#" or "*".
+        """
+        return np.array(
+            [symbol in address for address in self.addresses], dtype=bool
+        )
+
+    def number_flags(self):
+        """
+        Returns an int array, indexed by address id, of the
+        `phone.phone_number_flags` of each address.
+        """
+        return np.array(
+            [phone_number_flags(address) for address in self.addresses],
+            dtype=np.int32
+        )
+
+    def number_ids(self):
+        """
+        Returns an int array mapping each address id to the id of the first
+        address with the same canonical phone number.
+        """
+        numbers = {}
+        return np.array(
+            [
+                numbers.setdefault(canonical_phone_number(address), address_id)
+                for address_id, address in enumerate(self.addresses)
+            ],
+            dtype=np.int64
+        )
+
+
+def wall_time(record_datetime):
+    """
+    Returns the wall-clock seconds since 1970-01-01 of a datetime, in its own
+    timezone, or `INVALID_TIME` if it is not a valid datetime.
+    """
+    if not record_datetime or not isinstance(record_datetime, datetime):
+        return INVALID_TIME
+    return (
+        (record_datetime.toordinal() - EPOCH_ORDINAL) * SECONDS_PER_DAY +
+        record_datetime.hour * 3600 +
+        record_datetime.minute * 60 +
+        record_datetime.second
+    )
+
+
+def count_words(message_body, hits):
+    """
+    Returns (num_words, num_bad_words) of a message body the way
+    `features.build_sms_message_stats` counts them, given `hits`, the lists
+    hit in the body as found by `matcher.PhraseMatcher.find`.
+    """
+    if len(message_body) <= 2:
+        return 0, 0
+    return len(message_body.split(" ")), hits.count(BAD_WORDS_LIST)
+
+
+class DeviceColumns(object):
+    """
+    The columns of a single device's calls and smss.
+
+    `sms_phrase_hits` and `sms_text_counts` are not columns but the device's
+    total hits of each list of `SMS_PHRASE_LISTS` and its
+    `text_stats.TEXT_COUNTS`, since only the totals are ever used.
+    """
+    __slots__ = (
+        "num_contacts",
+        "call_times",
+        "call_durations",
+        "call_outgoing",
+        "call_addresses",
+        "sms_times",
+        "sms_addresses",
+        "sms_body_lengths",
+        "sms_num_words",
+        "sms_num_bad_words",
+        "sms_phrase_hits",
+        "sms_text_counts",
+    )
+
+    def __init__(self, **columns):
+        for name in self.__slots__:
+            setattr(self, name, columns[name])
+
+    @classmethod
+    def from_device(cls, device_data, address_table, phrase_fold=None):
+        """
+        Builds the columns of a device from its parsed records.
+
+        Parameters:
+            device_data (:class:`dict`): A device as built by
+                `generate_features.build_device_data`.
+            address_table (:class:`AddressTable`): The address table of the
+                user the device belongs to.
+            phrase_fold (:class:`int`): The `utils.phrase_fold` of the user,
+                whose learned lists the phrase hits are counted with.
+        """
+        intern = address_table.intern
+        call_log = device_data.get("call_log", [])
+        sms_log = device_data.get("sms_log", [])
+        message_bodies = [
+            sms.get("message_body", "") or "" for sms in sms_log
+        ]
+        matcher = get_sms_phrase_matcher(phrase_fold)
+        phrase_hits = matcher.count("")
+        word_counts = []
+        for body in message_bodies:
+            hits = matcher.find(body)
+            for name in hits:
+                phrase_hits[name] += 1
+            word_counts.append(count_words(body, hits))
+        text_stats = TextStats()
+        text_stats.add_bodies(message_bodies)
+        return cls(
+            num_contacts=len(device_data.get("contacts", [])),
+            call_times=np.array(
+                [wall_time(call.get("datetime")) for call in call_log],
+                dtype=np.int64
+            ),
+            call_durations=np.array(
+                [parse_duration(call.get("duration")) for call in call_log],
+                dtype=np.int32
+            ),
+            call_outgoing=np.array(
+                [
+                    call.get("call_type") in OUTGOING_CALL_TYPES
+                    for call in call_log
+                ],
+                dtype=bool
+            ),
+            call_addresses=np.array(
+                [intern(call.get("phone_number")) for call in call_log],
+                dtype=np.int32
+            ),
+            sms_times=np.array(
+                [wall_time(sms.get("datetime")) for sms in sms_log],
+                dtype=np.int64
+            ),
+            sms_addresses=np.array(
+                [intern(sms.get("sms_address")) for sms in sms_log],
+                dtype=np.int32
+            ),
+            sms_body_lengths=np.array(
+                [len(body) for body in message_bodies], dtype=np.int32
+            ),
+            sms_num_words=np.array(
+                [num_words for num_words, _ in word_counts], dtype=np.int32
+            ),
+            sms_num_bad_words=np.array(
+                [num_bad_words for _, num_bad_words in word_counts],
+                dtype=np.int32
+            ),
+            sms_phrase_hits=phrase_hits,
+            sms_text_counts=text_stats.counts,
+        )
+
+    @property
+    def nbytes(self):
+        """
+        The number of bytes held by the columns.
+        """
+        return sum(
+            getattr(self, name).nbytes for name in self.__slots__
+            if isinstance(getattr(self, name), np.ndarray)
+        )
+
+
+def concat(devices, column):
+    if not devices:
+        return np.zeros(0, dtype=np.int64)
+    return np.concatenate([getattr(device, column) for device in devices])
+
+
+def valid_days(times):
+    return times[times != INVALID_TIME] // SECONDS_PER_DAY
+
+
+################################################################################
+#                              BINARY FILES
+################################################################################
+_columns_fingerprint = None
+
+
+def columns_fingerprint():
+    """
+    Returns a digest of the layout of the columns and the word lists the sms
+    columns are counted with, so columns counted with different lists are not
+    mixed.
+    """
+    global _columns_fingerprint
+    if _columns_fingerprint is None:
+        sha1 = hashlib.sha1(COLUMNS_MAGIC)
+        sha1.update(word_lists_fingerprint())
+        _columns_fingerprint = sha1.hexdigest()
+    return _columns_fingerprint
+
+
+def align(offset):
+    return -(-offset // COLUMNS_ALIGNMENT) * COLUMNS_ALIGNMENT
+
+
+def write_device_columns(columns_file, device, address_table, metadata):
+    """
+    Writes the columns of a device to a binary file that
+    `read_device_columns` memory maps.
+
+    The file holds `COLUMNS_MAGIC`, the length of a JSON header as a little
+    endian uint32, the header and then the raw bytes of each column, aligned
+    to `COLUMNS_ALIGNMENT`. Addresses are stored as ids into the list of the
+    device's own addresses in the header, so the file does not depend on the
+    :class:`AddressTable` of the user.
+
+    Parameters:
+        columns_file (:class:`file`): A file opened in binary mode.
+        device (:class:`DeviceColumns`): The columns of the device.
+        address_table (:class:`AddressTable`): The address table the
+            device's address ids are from.
+        metadata (:class:`dict`): JSON serializable items to add to the
+            header.
+    """
+    address_ids = np.unique(np.concatenate([
+        device.call_addresses, device.sms_addresses
+    ]))
+    address_ids = address_ids[address_ids >= 0]
+    header = dict(metadata)
+    header["addresses"] = [address_table.addresses[i] for i in address_ids]
+    header["num_contacts"] = device.num_contacts
+    header["sms_phrase_hits"] = device.sms_phrase_hits
+    header["sms_text_counts"] = device.sms_text_counts
+    header["columns"] = []
+    arrays = []
+    offset = 0
+    for name in DeviceColumns.__slots__:
+        array = getattr(device, name)
+        if not isinstance(array, np.ndarray):
+            continue
+        if name in ADDRESS_COLUMNS:
+            local_ids = np.searchsorted(address_ids, array).astype(np.int32)
+            local_ids[array < 0] = -1
+            array = local_ids
+        array = np.ascontiguousarray(array)
+        header["columns"].append([name, array.dtype.str, offset, len(array)])
+        arrays.append(array)
+        offset = align(offset + array.nbytes)
+
+    header_txt = json.dumps(header)
+    data_start = align(len(COLUMNS_MAGIC) + 4 + len(header_txt))
+    columns_file.write(COLUMNS_MAGIC)
+    columns_file.write(struct.pack("<I", len(header_txt)))
+    columns_file.write(header_txt)
+    position = len(COLUMNS_MAGIC) + 4 + len(header_txt)
+    for (_, _, column_offset, _), array in zip(header["columns"], arrays):
+        padding = data_start + column_offset - position
+        columns_file.write("\0" * padding)
+        columns_file.write(array.tobytes())
+        position += padding + array.nbytes
+
+
+def read_device_columns(file_path, address_table):
+    """
+    Memory maps a file written by `write_device_columns`. The columns are
+    read only views of the file, so nothing is parsed or copied until a
+    feature reads them.
+
+    Returns:
+        :class:`tuple` of (:class:`DeviceColumns`, header) where the device's
+        address ids are interned into `address_table`.
+
+    Raises:
+        ValueError if the file is not a columns file.
+    """
+    with open(file_path, "rb") as columns_file:
+        mapped = mmap.mmap(columns_file.fileno(), 0, access=mmap.ACCESS_READ)
+    if mapped[:len(COLUMNS_MAGIC)] != COLUMNS_MAGIC:
+        raise ValueError("{} is not a columns file".format(file_path))
+    header_start = len(COLUMNS_MAGIC) + 4
+    header_length, = struct.unpack(
+        "<I", mapped[len(COLUMNS_MAGIC):header_start]
+    )
+    header = json.loads(mapped[header_start:header_start + header_length])
+    data_start = align(header_start + header_length)
+    # The last id maps the -1 of empty addresses to -1.
+    address_ids = np.array(
+        address_table.intern_lowercased(header["addresses"]) + [-1],
+        dtype=np.int32
+    )
+    columns = {
+        "num_contacts": header["num_contacts"],
+        "sms_phrase_hits": header["sms_phrase_hits"],
+        "sms_text_counts": header["sms_text_counts"],
+    }
+    for name, dtype, offset, length in header["columns"]:
+        if length:
+            array = np.frombuffer(
+                mapped, dtype=dtype, count=length, offset=data_start + offset
+            )
+        else:
+            array = np.zeros(0, dtype=dtype)
+        if name in ADDRESS_COLUMNS:
+            array = address_ids[array]
+        columns[str(name)] = array
+    return DeviceColumns(**columns), header
+
+
+################################################################################
+#                        VECTORIZED FEATURE EXTRACTORS
+################################################################################
+def build_num_contacts_columnar(devices, address_table):
+    return sum(device.num_contacts for device in devices)
+
+
+def build_num_calls_to_international_columnar(devices, address_table):
+    addresses = concat(devices, "call_addresses")
+    outgoing = concat(devices, "call_outgoing").astype(bool)
+    addresses = addresses[outgoing & (addresses >= 0)]
+    if not len(addresses):
+        return 0
+    international = (address_table.number_flags() & INTERNATIONAL) != 0
+    return int(international[addresses].sum())
+
+
+def build_symbol_count_columnar(column, symbol):
+    def build_symbol_count(devices, address_table):
+        addresses = concat(devices, column)
+        addresses = addresses[addresses >= 0]
+        if not len(addresses):
+            return 0
+        return int(address_table.symbol_flags(symbol)[addresses].sum())
+    return build_symbol_count
+
+
+def build_ave_duration_columnar(devices, address_table):
+    durations = concat(devices, "call_durations")
+    if len(durations) == 0:
+        return 0.0
+    return ave_or_none(int(durations.sum(dtype=np.int64)), len(durations))
+
+
+def build_call_stats_columnar(devices, address_table):
+    times = concat(devices, "call_times")
+    durations = concat(devices, "call_durations").astype(np.int64)
+    valid = times != INVALID_TIME
+    num_days = len(np.unique(times[valid] // SECONDS_PER_DAY))
+    return {
+        "calls": len(times),
+        "duration(s)": int(durations.sum()),
+        "ave_daily_calls": ave_or_none(int(valid.sum()), num_days),
+        "ave_daily_duration(s)": ave_or_none(
+            int(durations[valid].sum()), num_days
+        )
+    }
+
+
+def build_ave_daily_sms_count_columnar(devices, address_table):
+    """
+    Like `features.build_ave_daily_sms_count`, only counts the smss of each
+    device from its first valid datetime up to, but not including, its last.
+    """
+    sms_count = 0
+    days = []
+    for device in devices:
+        device_days = valid_days(device.sms_times)
+        if len(device_days) == 0:
+            continue
+        if len(device_days) < 2:
+            # Can't compute ave sms without at least 2 smss.
+            return None
+        sms_count += len(device_days) - 1
+        days.append(device_days[:-1])
+    if not days:
+        return None
+    return ave_or_none(sms_count, len(np.unique(np.concatenate(days))))
+
+
+def build_ave_message_body_length_columnar(devices, address_table):
+    lengths = concat(devices, "sms_body_lengths")
+    return ave_or_none(
+        int(lengths.sum(dtype=np.int64)), int(np.count_nonzero(lengths))
+    )
+
+
+def build_interaction_stats_columnar(devices, address_table):
+    times = np.concatenate([
+        concat(devices, "sms_times"), concat(devices, "call_times")
+    ])
+    addresses = np.concatenate([
+        concat(devices, "sms_addresses"), concat(devices, "call_addresses")
+    ]).astype(np.int64)
+    valid = times != INVALID_TIME
+    has_address = addresses >= 0
+    if address_table.normalize and has_address.any():
+        # Count the addresses with the same canonical number once.
+        addresses = np.where(
+            has_address, address_table.number_ids()[addresses], -1
+        )
+    num_sms = sum(len(device.sms_times) for device in devices)
+
+    # Each distinct (day, address) pair is a contact interacted with that day.
+    valid_interactions = valid & has_address
+    days = times[valid_interactions] // SECONDS_PER_DAY
+    day_address_pairs = np.unique(
+        days * len(address_table.addresses) + addresses[valid_interactions]
+    )
+    num_days = float(len(np.unique(days)))
+    return {
+        "total_num_contacts_interacted_with": len(
+            np.unique(addresses[has_address])
+        ),
+        "total_interactions": len(times),
+        "ave_daily_sms": ave_or_none(int(valid[:num_sms].sum()), num_days),
+        "ave_daily_calls": ave_or_none(int(valid[num_sms:].sum()), num_days),
+        "ave_daily_contacts_interacted_with": ave_or_none(
+            len(day_address_pairs), num_days
+        )
+    }
+
+
+def build_top_contact_stats_columnar(devices, address_table):
+    addresses = np.concatenate([
+        concat(devices, "sms_addresses"), concat(devices, "call_addresses")
+    ]).astype(np.int64)
+    addresses = addresses[addresses >= 0]
+    if address_table.normalize and len(addresses):
+        addresses = address_table.number_ids()[addresses]
+    counts = np.sort(np.bincount(addresses))[::-1]
+    return top_contact_features(
+        counts[counts > 0].tolist(), len(addresses)
+    )
+
+
+def build_activity_stats_columnar(devices, address_table):
+    call_times = concat(devices, "call_times")
+    sms_times = concat(devices, "sms_times")
+    times = np.concatenate([call_times, sms_times])
+    addresses = np.concatenate([
+        concat(devices, "call_addresses"), concat(devices, "sms_addresses")
+    ]).astype(np.int64)
+    is_call = np.arange(len(times)) < len(call_times)
+    durations = concat(devices, "call_durations").astype(np.int64)
+
+    valid = times != INVALID_TIME
+    days, day_index = np.unique(
+        times[valid] // SECONDS_PER_DAY + EPOCH_ORDINAL, return_inverse=True
+    )
+    num_days = len(days)
+    calls = np.bincount(day_index[is_call[valid]], minlength=num_days)
+    smss = np.bincount(day_index[~is_call[valid]], minlength=num_days)
+    call_durations = np.zeros(num_days, dtype=np.int64)
+    np.add.at(
+        call_durations,
+        day_index[is_call[valid]],
+        durations[valid[:len(call_times)]]
+    )
+
+    addresses = addresses[valid]
+    has_address = addresses >= 0
+    if address_table.normalize and has_address.any():
+        addresses = np.where(
+            has_address, address_table.number_ids()[addresses], -1
+        )
+    # Each distinct (day, address) pair is a contact interacted with that day.
+    num_addresses = max(len(address_table.addresses), 1)
+    pairs = np.unique(
+        day_index[has_address] * num_addresses + addresses[has_address]
+    )
+    contacts = np.bincount(pairs // num_addresses, minlength=num_days)
+    contact_last_days = np.full(num_addresses, -1, dtype=np.int64)
+    np.maximum.at(
+        contact_last_days, pairs % num_addresses, pairs // num_addresses
+    )
+    contact_last_days = np.sort(
+        days[contact_last_days[contact_last_days >= 0]]
+    )
+    return activity_features(DailyActivity(
+        days.tolist(),
+        calls.tolist(),
+        call_durations.tolist(),
+        smss.tolist(),
+        contacts.tolist(),
+        contact_last_days.tolist()
+    ))
+
+
+def build_sms_message_stats_columnar(devices, address_table):
+    num_words = concat(devices, "sms_num_words")
+    num_bad_words = concat(devices, "sms_num_bad_words")
+    num_bad_words_used = int(num_bad_words.sum(dtype=np.int64))
+    return {
+        "num_bad_words_used": num_bad_words_used,
+        "ratio_of_bad_words_used": ave_or_none(
+            num_bad_words_used, int(num_words.sum(dtype=np.int64))
+        ),
+        "num_derogatory_sms": int(np.count_nonzero(num_bad_words)),
+    }
+
+
+def build_sms_phrase_stats_columnar(devices, address_table):
+    counts = get_sms_phrase_matcher().count("")
+    for device in devices:
+        for name, hits in device.sms_phrase_hits.items():
+            counts[name] += hits
+    return format_phrase_hits(counts)
+
+
+def build_sms_text_stats_columnar(devices, address_table):
+    counts = dict.fromkeys(TEXT_COUNTS, 0)
+    for device in devices:
+        for name, count in device.sms_text_counts.items():
+            counts[name] += count
+    return text_features(counts)
+
+
+COLUMNAR_EXTRACTORS = {
+    "num_contacts": build_num_contacts_columnar,
+    "num_calls_to_international": build_num_calls_to_international_columnar,
+    "num_#_calls": build_symbol_count_columnar("call_addresses", "#"),
+    "num_#_sms": build_symbol_count_columnar("sms_addresses", "#"),
+    "num_*_calls": build_symbol_count_columnar("call_addresses", "*"),
+    "num_*_sms": build_symbol_count_columnar("sms_addresses", "*"),
+    "ave_duration(s)": build_ave_duration_columnar,
+    "call_stats": build_call_stats_columnar,
+    "ave_daily_sms_count": build_ave_daily_sms_count_columnar,
+    "ave_message_body_length": build_ave_message_body_length_columnar,
+    "interaction_stats": build_interaction_stats_columnar,
+    "top_contact_stats": build_top_contact_stats_columnar,
+    "activity_stats": build_activity_stats_columnar,
+    "sms_message_stats": build_sms_message_stats_columnar,
+    "sms_phrase_stats": build_sms_phrase_stats_columnar,
+    "sms_text_stats": build_sms_text_stats_columnar,
+}
+
+
+def build_features_columnar(
+    devices, address_table, features=None, telemetry=None
+):
+    """
+    Parameters:
+        devices (:class:`list`): The :class:`DeviceColumns` of each of the
+            user's devices.
+        address_table (:class:`AddressTable`): The user's address table.
+        features (:class:`list`): The names of the features to build.
+            Defaults to `ALL_FEATURES`.
+        telemetry (:class:`telemetry.Telemetry`): If given, the time spent in
+            each extractor is added to it.
+
+    Returns:
+        :class:`list` of (feature, value) tuples, like
+        `engine.FeatureEngine.build_features`.
+    """
+    if features is None:
+        features = ALL_FEATURES
+    user_features = []
+    for feature in features:
+        extractor = COLUMNAR_EXTRACTORS[feature]
+        if telemetry is not None:
+            extractor = telemetry.timed("extractors", feature, extractor)
+        user_features.append((feature, extractor(devices, address_table)))
+    return user_features
@@ -0,0 +1,128 @@
+"""
+Removes the records that were synced across the devices of a user.
+
+Users with several devices often have the same contacts and an overlapping
+call and sms history on each of them, which inflates counts like
+`num_contacts` and `num_calls` and costs extra work. A :class:`DeviceMerger`
+chains a user's devices into a single device, dropping every record whose key
+is already in a hash index of the records seen so far:
+ - calls on their canonical number, datetime and call type,
+ - smss on their canonical address, datetime, sms type and message body,
+ - contacts on their display name and canonical numbers.
+
+Calls and smss without a valid datetime can't be told apart from a genuinely
+new record, so they are always kept.
+"""
+from itertools import chain
+from phone import canonical_phone_number
+
+
+# The logs of a device, in the order their duplicates are reported.
+DEDUP_LOGS = ("call_log", "sms_log", "contacts")
+
+
+def call_key(call):
+    call_datetime = call.get("datetime")
+    if call_datetime is None:
+        return None
+    return (
+        canonical_phone_number(call.get("phone_number")),
+        call_datetime,
+        call.get("call_type")
+    )
+
+
+def sms_key(sms):
+    sms_datetime = sms.get("datetime")
+    if sms_datetime is None:
+        return None
+    return (
+        canonical_phone_number(sms.get("sms_address")),
+        sms_datetime,
+        sms.get("sms_type"),
+        sms.get("message_body")
+    )
+
+
+def contact_key(contact):
+    display_name = (contact.get("display_name") or "").strip().lower()
+    phone_numbers = tuple(sorted(
+        canonical_phone_number(phone_number)
+        for phone_number in contact.get("phone_numbers") or []
+    ))
+    if not display_name and not any(phone_numbers):
+        return None
+    return (display_name, phone_numbers)
+
+
+# Maps each log to the function returning the dedup key of its records, or
+# None for records that are always kept.
+RECORD_KEYS = {
+    "call_log": call_key,
+    "contacts": contact_key,
+    "sms_log": sms_key,
+}
+
+
+def iter_log(devices, log):
+    """
+    Yields the records of `log` of every device in `devices`, in order.
+    """
+    return chain.from_iterable(
+        device_data.get(log, []) for device_data in devices
+    )
+
+
+def new_duplicates():
+    return dict((log, 0) for log in DEDUP_LOGS)
+
+
+def add_duplicates(duplicates, other):
+    for log in DEDUP_LOGS:
+        duplicates[log] += other[log]
+
+
+class DeviceMerger(object):
+    """
+    Merges the devices of a single user into one deduplicated device.
+
+    Attributes:
+        duplicates (:class:`dict`): Maps each log to the number of its
+            records that were dropped as duplicates so far.
+    """
+    def __init__(self):
+        self.seen = dict((log, set()) for log in DEDUP_LOGS)
+        self.duplicates = new_duplicates()
+
+    def iter_unique(self, log, records):
+        """
+        Yields the records of `log` whose key was not seen before.
+        """
+        record_key = RECORD_KEYS[log]
+        seen = self.seen[log]
+        duplicates = 0
+        for record in records:
+            key = record_key(record)
+            if key is not None:
+                if key in seen:
+                    duplicates += 1
+                    continue
+                seen.add(key)
+            yield record
+        self.duplicates[log] += duplicates
+
+    def merge(self, devices):
+        """
+        Returns the device data of every device in `devices` merged into a
+        single device, in the order of the devices. Each log is a generator,
+        so devices read with `build_device_stream` are still read one record
+        at a time, and `duplicates` is only complete once every log was
+        iterated.
+        """
+        logs = set()
+        for device_data in devices:
+            logs.update(device_data)
+        return dict(
+            (log, self.iter_unique(log, iter_log(devices, log)))
+            for log in logs
+        )
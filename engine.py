@@ -0,0 +1,911 @@
+"""
+A fused feature engine that builds every feature in a single pass over each
+device's records.
+
+Every extractor in `features.FEATURE_EXTRACTORS` walks the whole call/sms log
+on its own, so building all the features scans a user's logs once per feature.
+Here each feature registers an accumulator instead. The engine walks each
+device's contacts, calls and smss exactly once, decoding the fields most
+features share (the address and the day of each record) a single time. The
+records are handed to the accumulators that care about them in chunks of
+`CHUNK_SIZE`, which keeps the per-record overhead of dispatching to many
+accumulators low, and each accumulator is then asked to finalize its value.
+
+Accumulators return exactly what the matching extractor in `features.py`
+returns, so the two can be used interchangeably.
+"""
+from datetime import datetime
+from collections import defaultdict
+from itertools import islice
+from activity import ActivityIndex, activity_features
+from features import (
+    ALL_FEATURES, CONCENTRATION_CONTACTS, format_phrase_hits,
+    get_sms_phrase_matcher, top_contact_features, user_phrase_fold
+)
+from phone import INTERNATIONAL, SYMBOL_FLAGS, PhoneNumberTable
+from sketches import HyperLogLog, MisraGries, hash64, pair_hash
+from text_stats import TextStats
+from utils import (
+    ave_or_none, BAD_WORDS_LIST, OUTGOING_CALL_TYPES, parse_duration
+)
+
+
+CALL = "call"
+CONTACT = "contact"
+SMS = "sms"
+# Smss along with the phrase hits of their bodies, which are found once per
+# chunk for every accumulator that reads them.
+SMS_HITS = "sms_hits"
+# The number of records decoded and handed to the accumulators at a time.
+CHUNK_SIZE = 1024
+
+
+class Accumulator(object):
+    """
+    Base class for a feature that is built from a stream of records.
+
+    Subclasses list the kinds of records they need in `record_types` and
+    implement the matching `add_*` methods. Each method receives a chunk of a
+    device's records along with the fields the engine already decoded for
+    them: `addresses` holds the id of each call's `phone_number` or each
+    sms's `sms_address` in `numbers` (0 if missing) and `days` holds the
+    :class:`date` of each record's datetime or None if the record does not
+    have a valid datetime. Accumulators of `SMS_HITS` records also receive
+    `hits`, the names of the `SMS_PHRASE_LISTS` hit in each sms's
+    `message_body`, see `matcher.PhraseMatcher.find`, so each body is only
+    scanned once.
+
+    Attributes:
+        numbers (:class:`phone.PhoneNumberTable`): The table the address ids
+            are from, shared by every accumulator of a user.
+    """
+    record_types = ()
+    numbers = None
+
+    def add_contacts(self, contacts):
+        pass
+
+    def add_calls(self, calls, addresses, days):
+        pass
+
+    def add_smss(self, smss, addresses, days):
+        pass
+
+    def add_sms_hits(self, smss, addresses, days, hits):
+        pass
+
+    def end_device(self):
+        """
+        Called once all of a device's records have been added.
+        """
+        pass
+
+    def merge(self, other):
+        """
+        Adds the state of `other`, an accumulator of the same feature that
+        was fed a different set of devices, to this accumulator.
+        """
+        raise NotImplementedError
+
+    def finalize(self):
+        """
+        Returns the value of the feature. Should be a primitive type or a dict
+        of primitive types.
+        """
+        raise NotImplementedError
+
+
+################################################################################
+#                              ACCUMULATORS
+################################################################################
+class NumContactsAccumulator(Accumulator):
+    record_types = (CONTACT,)
+
+    def __init__(self):
+        self.num_contacts = 0
+
+    def add_contacts(self, contacts):
+        self.num_contacts += len(contacts)
+
+    def merge(self, other):
+        self.num_contacts += other.num_contacts
+
+    def finalize(self):
+        return self.num_contacts
+
+
+class AddressSymbolAccumulator(Accumulator):
+    """
+    Counts the calls or smss whose address contains `symbol`, e.g. "#" or "*".
+    """
+    def __init__(self, record_type, symbol):
+        self.record_types = (record_type,)
+        self.flag = SYMBOL_FLAGS[symbol]
+        self.count = 0
+
+    def add_calls(self, calls, addresses, days):
+        flags = self.numbers.flags
+        flag = self.flag
+        self.count += len(
+            [address for address in addresses if flags[address] & flag]
+        )
+
+    add_smss = add_calls
+
+    def merge(self, other):
+        self.count += other.count
+
+    def finalize(self):
+        return self.count
+
+
+class NumCallsToInternationalAccumulator(Accumulator):
+    record_types = (CALL,)
+
+    def __init__(self):
+        self.count = 0
+
+    def add_calls(self, calls, addresses, days):
+        flags = self.numbers.flags
+        self.count += len([
+            call for call, address in zip(calls, addresses)
+            if flags[address] & INTERNATIONAL and
+            call.get("call_type") in OUTGOING_CALL_TYPES
+        ])
+
+    def merge(self, other):
+        self.count += other.count
+
+    def finalize(self):
+        return self.count
+
+
+class AveDurationAccumulator(Accumulator):
+    record_types = (CALL,)
+
+    def __init__(self):
+        self.total_duration = 0
+        self.num_calls = 0
+
+    def add_calls(self, calls, addresses, days):
+        self.num_calls += len(calls)
+        total_duration = 0
+        for call in calls:
+            try:
+                total_duration += int(call.get("duration", 0))
+            except:
+                continue
+        self.total_duration += total_duration
+
+    def merge(self, other):
+        self.total_duration += other.total_duration
+        self.num_calls += other.num_calls
+
+    def finalize(self):
+        if self.num_calls == 0:
+            return 0.0
+        return ave_or_none(self.total_duration, self.num_calls)
+
+
+class CallStatsAccumulator(Accumulator):
+    record_types = (CALL,)
+
+    def __init__(self):
+        self.total_calls = 0
+        self.total_duration = 0
+        self.valid_calls = 0
+        self.valid_duration = 0
+        self.days_visited = set()
+
+    def add_calls(self, calls, addresses, days):
+        days_visited = self.days_visited
+        total_duration = 0
+        valid_calls = 0
+        valid_duration = 0
+        for call, day in zip(calls, days):
+            call_duration = int(call.get("duration", 0) or 0)
+            total_duration += call_duration
+            if day is not None:
+                days_visited.add(day)
+                valid_calls += 1
+                valid_duration += call_duration
+        self.total_calls += len(calls)
+        self.total_duration += total_duration
+        self.valid_calls += valid_calls
+        self.valid_duration += valid_duration
+
+    def merge(self, other):
+        self.total_calls += other.total_calls
+        self.total_duration += other.total_duration
+        self.valid_calls += other.valid_calls
+        self.valid_duration += other.valid_duration
+        self.days_visited |= other.days_visited
+
+    def finalize(self):
+        num_days = len(self.days_visited)
+        return {
+            "calls": self.total_calls,
+            "duration(s)": self.total_duration,
+            "ave_daily_calls": ave_or_none(self.valid_calls, num_days),
+            "ave_daily_duration(s)": ave_or_none(self.valid_duration, num_days)
+        }
+
+
+class AveDailySmsCountAccumulator(Accumulator):
+    """
+    Mirrors `features.build_ave_daily_sms_count`, which only counts the smss
+    from the first valid datetime of each device up to, but not including, the
+    last valid datetime. The last valid sms of a device is therefore held back
+    until the next valid sms shows up, along with the number of invalid smss
+    in between when `require_valid_datetime` is False.
+    """
+    record_types = (SMS,)
+
+    def __init__(self, require_valid_datetime=True):
+        self.require_valid_datetime = require_valid_datetime
+        self.sms_count = 0
+        self.days_visited = set()
+        self.too_few_sms = False
+        self._reset_device()
+
+    def _reset_device(self):
+        self.device_sms_count = 0
+        self.last_valid_day = None
+        self.invalid_since_last_valid = 0
+
+    def add_smss(self, smss, addresses, days):
+        require_valid_datetime = self.require_valid_datetime
+        days_visited = self.days_visited
+        device_sms_count = self.device_sms_count
+        last_valid_day = self.last_valid_day
+        invalid_since_last_valid = self.invalid_since_last_valid
+        sms_count = 0
+        for day in days:
+            if day is None:
+                if require_valid_datetime:
+                    continue
+                device_sms_count += 1
+                if last_valid_day is not None:
+                    invalid_since_last_valid += 1
+                continue
+            device_sms_count += 1
+            if last_valid_day is not None:
+                sms_count += 1 + invalid_since_last_valid
+                days_visited.add(last_valid_day)
+            last_valid_day = day
+            invalid_since_last_valid = 0
+        self.sms_count += sms_count
+        self.device_sms_count = device_sms_count
+        self.last_valid_day = last_valid_day
+        self.invalid_since_last_valid = invalid_since_last_valid
+
+    def end_device(self):
+        if self.last_valid_day is not None and self.device_sms_count < 2:
+            # Can't compute ave sms without at least 2 smss.
+            self.too_few_sms = True
+        self._reset_device()
+
+    def merge(self, other):
+        self.sms_count += other.sms_count
+        self.days_visited |= other.days_visited
+        self.too_few_sms = self.too_few_sms or other.too_few_sms
+
+    def finalize(self):
+        if self.too_few_sms:
+            return None
+        return ave_or_none(self.sms_count, len(self.days_visited))
+
+
+class AveMessageBodyLengthAccumulator(Accumulator):
+    record_types = (SMS,)
+
+    def __init__(self):
+        self.sms_count = 0
+        self.body_length = 0
+
+    def add_smss(self, smss, addresses, days):
+        lengths = [
+            len(sms.get("message_body", "") or "") for sms in smss
+        ]
+        self.body_length += sum(lengths)
+        self.sms_count += len(lengths) - lengths.count(0)
+
+    def merge(self, other):
+        self.sms_count += other.sms_count
+        self.body_length += other.body_length
+
+    def finalize(self):
+        return ave_or_none(self.body_length, self.sms_count)
+
+
+class InteractionStatsAccumulator(Accumulator):
+    record_types = (CALL, SMS)
+
+    def __init__(self):
+        self.contacts_interacted_with = set()
+        self.total_interactions = 0
+        self.total_valid_calls = 0
+        self.total_valid_sms = 0
+        self.contacts_interacted_with_per_day = defaultdict(set)
+
+    def _add_interactions(self, addresses, days):
+        """
+        Returns the number of interactions with a valid datetime.
+        """
+        contacts_interacted_with = self.contacts_interacted_with
+        per_day = self.contacts_interacted_with_per_day
+        num_valid = 0
+        for address, day in zip(addresses, days):
+            if address:
+                contacts_interacted_with.add(address)
+                if day is not None:
+                    per_day[day].add(address)
+            if day is not None:
+                num_valid += 1
+        self.total_interactions += len(addresses)
+        return num_valid
+
+    def add_calls(self, calls, addresses, days):
+        self.total_valid_calls += self._add_interactions(addresses, days)
+
+    def add_smss(self, smss, addresses, days):
+        self.total_valid_sms += self._add_interactions(addresses, days)
+
+    def merge(self, other):
+        # The other accumulator's address ids may be from another table, e.g.
+        # if it was cached.
+        ids = self.numbers.translation(other.numbers)
+        self.contacts_interacted_with.update(
+            ids[address] for address in other.contacts_interacted_with
+        )
+        self.total_interactions += other.total_interactions
+        self.total_valid_calls += other.total_valid_calls
+        self.total_valid_sms += other.total_valid_sms
+        per_day = self.contacts_interacted_with_per_day
+        for day, contacts in other.contacts_interacted_with_per_day.items():
+            per_day[day].update(ids[address] for address in contacts)
+
+    def finalize(self):
+        per_day = self.contacts_interacted_with_per_day
+        contacts_interacted_with = self.contacts_interacted_with
+        if self.numbers.normalize:
+            # Count the addresses with the same canonical number once.
+            ids = self.numbers.contact_ids()
+            contacts_interacted_with = set(
+                ids[address] for address in contacts_interacted_with
+            )
+            per_day = dict(
+                (day, set(ids[address] for address in contacts))
+                for day, contacts in per_day.items()
+            )
+        num_days = float(len(per_day))
+        total_valid_contacts_interactions = sum([
+            len(contacts) for contacts in per_day.values()
+        ])
+        return {
+            "total_num_contacts_interacted_with": len(
+                contacts_interacted_with
+            ),
+            "total_interactions": self.total_interactions,
+            "ave_daily_sms": ave_or_none(self.total_valid_sms, num_days),
+            "ave_daily_calls": ave_or_none(self.total_valid_calls, num_days),
+            "ave_daily_contacts_interacted_with": ave_or_none(
+                total_valid_contacts_interactions, num_days
+            )
+        }
+
+
+class TopContactStatsAccumulator(Accumulator):
+    record_types = (CALL, SMS)
+
+    def __init__(self):
+        self.interactions = defaultdict(int)
+
+    def add_calls(self, calls, addresses, days):
+        interactions = self.interactions
+        for address in addresses:
+            if address:
+                interactions[address] += 1
+
+    add_smss = add_calls
+
+    def merge(self, other):
+        ids = self.numbers.translation(other.numbers)
+        interactions = self.interactions
+        for address, count in other.interactions.items():
+            interactions[ids[address]] += count
+
+    def finalize(self):
+        interactions = self.interactions
+        if self.numbers.normalize:
+            ids = self.numbers.contact_ids()
+            interactions = defaultdict(int)
+            for address, count in self.interactions.items():
+                interactions[ids[address]] += count
+        counts = sorted(interactions.values(), reverse=True)
+        return top_contact_features(counts, sum(counts))
+
+
+class ActivityStatsAccumulator(Accumulator):
+    record_types = (CALL, SMS)
+
+    def __init__(self):
+        self.index = ActivityIndex()
+
+    def add_calls(self, calls, addresses, days):
+        self.index.add_calls(
+            days,
+            addresses,
+            [parse_duration(call.get("duration")) for call in calls]
+        )
+
+    def add_smss(self, smss, addresses, days):
+        self.index.add_smss(days, addresses)
+
+    def merge(self, other):
+        self.index.merge(
+            other.index, self.numbers.translation(other.numbers)
+        )
+
+    def finalize(self):
+        return activity_features(
+            self.index.daily(self.numbers.contact_ids())
+        )
+
+
+class SmsMessageStatsAccumulator(Accumulator):
+    record_types = (SMS_HITS,)
+
+    def __init__(self):
+        self.num_bad_words_used = 0
+        self.total_words = 0
+        self.derogatory_sms_count = 0
+
+    def add_sms_hits(self, smss, addresses, days, hits):
+        total_words = 0
+        num_bad_words_used = 0
+        derogatory_sms_count = 0
+        for sms, sms_hits in zip(smss, hits):
+            message_body = (sms.get("message_body", "") or "")
+            if len(message_body) > 2:
+                total_words += len(message_body.split(" "))
+                num_bad_words = sms_hits.count(BAD_WORDS_LIST)
+                if num_bad_words > 0:
+                    num_bad_words_used += num_bad_words
+                    derogatory_sms_count += 1
+        self.total_words += total_words
+        self.num_bad_words_used += num_bad_words_used
+        self.derogatory_sms_count += derogatory_sms_count
+
+    def merge(self, other):
+        self.num_bad_words_used += other.num_bad_words_used
+        self.total_words += other.total_words
+        self.derogatory_sms_count += other.derogatory_sms_count
+
+    def finalize(self):
+        return {
+            "num_bad_words_used": self.num_bad_words_used,
+            "ratio_of_bad_words_used": ave_or_none(
+                self.num_bad_words_used, self.total_words
+            ),
+            "num_derogatory_sms": self.derogatory_sms_count,
+        }
+
+
+class SmsPhraseStatsAccumulator(Accumulator):
+    record_types = (SMS_HITS,)
+
+    def __init__(self):
+        self.counts = get_sms_phrase_matcher().count("")
+
+    def add_sms_hits(self, smss, addresses, days, hits):
+        counts = self.counts
+        for sms_hits in hits:
+            for name in sms_hits:
+                counts[name] += 1
+
+    def merge(self, other):
+        for name, hits in other.counts.items():
+            self.counts[name] += hits
+
+    def finalize(self):
+        return format_phrase_hits(self.counts)
+
+
+class SmsTextStatsAccumulator(Accumulator):
+    record_types = (SMS,)
+
+    def __init__(self):
+        self.stats = TextStats()
+
+    def add_smss(self, smss, addresses, days):
+        self.stats.add_bodies([
+            sms.get("message_body", "") or "" for sms in smss
+        ])
+
+    def merge(self, other):
+        self.stats.merge(other.stats)
+
+    def finalize(self):
+        return self.stats.features()
+
+
+################################################################################
+#                           SKETCH ACCUMULATORS
+################################################################################
+class SketchInteractionStatsAccumulator(Accumulator):
+    """
+    Builds `interaction_stats` from a :class:`sketches.HyperLogLog` of the
+    contacts interacted with and one of the (day, contact) pairs instead of
+    their exact sets, so its memory does not grow with the number of
+    contacts. Only the set of the days with interactions is kept exactly.
+    """
+    record_types = (CALL, SMS)
+
+    def __init__(self):
+        self.contacts = HyperLogLog()
+        self.day_contacts = HyperLogLog()
+        self.days = set()
+        self.total_interactions = 0
+        self.total_valid_calls = 0
+        self.total_valid_sms = 0
+
+    def _add_interactions(self, addresses, days):
+        """
+        Returns the number of interactions with a valid datetime.
+        """
+        # The addresses are hashed by their contact key, which is the same in
+        # every table, so the sketches of other devices can be merged.
+        keys = self.numbers.contact_keys()
+        hashes = dict(
+            (address, hash64(keys[address]))
+            for address in set(addresses) if address
+        )
+        self.contacts.add_hashes(hashes.values())
+        # Adding a hash twice does not change a sketch, so each distinct
+        # (address, day) of the chunk is only added once.
+        pairs = set(zip(addresses, days))
+        self.day_contacts.add_hashes([
+            pair_hash(hashes[address], day.toordinal())
+            for address, day in pairs if address and day is not None
+        ])
+        self.days.update(
+            day for address, day in pairs if address and day is not None
+        )
+        self.total_interactions += len(addresses)
+        return len(days) - days.count(None)
+
+    def add_calls(self, calls, addresses, days):
+        self.total_valid_calls += self._add_interactions(addresses, days)
+
+    def add_smss(self, smss, addresses, days):
+        self.total_valid_sms += self._add_interactions(addresses, days)
+
+    def merge(self, other):
+        self.contacts.merge(other.contacts)
+        self.day_contacts.merge(other.day_contacts)
+        self.days.update(other.days)
+        self.total_interactions += other.total_interactions
+        self.total_valid_calls += other.total_valid_calls
+        self.total_valid_sms += other.total_valid_sms
+
+    def finalize(self):
+        num_days = float(len(self.days))
+        return {
+            "total_num_contacts_interacted_with": int(
+                round(self.contacts.count())
+            ),
+            "total_interactions": self.total_interactions,
+            "ave_daily_sms": ave_or_none(self.total_valid_sms, num_days),
+            "ave_daily_calls": ave_or_none(self.total_valid_calls, num_days),
+            "ave_daily_contacts_interacted_with": ave_or_none(
+                self.day_contacts.count(), num_days
+            )
+        }
+
+
+class SketchTopContactStatsAccumulator(Accumulator):
+    """
+    Builds `top_contact_stats` from a :class:`sketches.MisraGries` of the
+    interactions with each contact instead of their exact counts, so each of
+    its shares is a lower bound of the exact one.
+    """
+    record_types = (CALL, SMS)
+
+    def __init__(self):
+        self.top_contacts = MisraGries()
+        self.total = 0
+
+    def add_calls(self, calls, addresses, days):
+        keys = self.numbers.contact_keys()
+        interactions = defaultdict(int)
+        for address in addresses:
+            if address:
+                interactions[address] += 1
+        add = self.top_contacts.add
+        for address, count in interactions.items():
+            add(keys[address], count)
+            self.total += count
+
+    add_smss = add_calls
+
+    def merge(self, other):
+        self.top_contacts.merge(other.top_contacts)
+        self.total += other.total
+
+    def finalize(self):
+        return top_contact_features(
+            self.top_contacts.top(CONCENTRATION_CONTACTS), self.total
+        )
+
+
+# Maps each feature in `features.FEATURE_EXTRACTORS` to a callable that
+# returns a fresh accumulator for it.
+ACCUMULATORS = {
+    "num_contacts": NumContactsAccumulator,
+    "num_calls_to_international": NumCallsToInternationalAccumulator,
+    "num_#_calls": lambda: AddressSymbolAccumulator(CALL, "#"),
+    "num_#_sms": lambda: AddressSymbolAccumulator(SMS, "#"),
+    "num_*_calls": lambda: AddressSymbolAccumulator(CALL, "*"),
+    "num_*_sms": lambda: AddressSymbolAccumulator(SMS, "*"),
+    "ave_duration(s)": AveDurationAccumulator,
+    "call_stats": CallStatsAccumulator,
+    "ave_daily_sms_count": AveDailySmsCountAccumulator,
+    "ave_message_body_length": AveMessageBodyLengthAccumulator,
+    "interaction_stats": InteractionStatsAccumulator,
+    "top_contact_stats": TopContactStatsAccumulator,
+    "activity_stats": ActivityStatsAccumulator,
+    "sms_message_stats": SmsMessageStatsAccumulator,
+    "sms_phrase_stats": SmsPhraseStatsAccumulator,
+    "sms_text_stats": SmsTextStatsAccumulator,
+}
+# The accumulators of the features that are built from fixed size sketches
+# instead in `FeatureEngine(sketch=True)`, with the suffix their partials are
+# cached under.
+SKETCH_ACCUMULATORS = {
+    "interaction_stats": SketchInteractionStatsAccumulator,
+    "top_contact_stats": SketchTopContactStatsAccumulator,
+}
+SKETCH_SUFFIX = ":sketch"
+# The features whose partials count the learned phrase lists, which differ
+# between the users of each `utils.phrase_fold`.
+PHRASE_FOLD_FEATURES = ("sms_phrase_stats",)
+PHRASE_FOLD_SUFFIX = ":phrases{}"
+
+
+################################################################################
+#                                 ENGINE
+################################################################################
+def iter_chunks(records, size=CHUNK_SIZE):
+    """
+    Yields lists of up to `size` records from any iterable of records.
+    """
+    records = iter(records)
+    while True:
+        chunk = list(islice(records, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def find_phrase_hits(smss, phrase_fold=None):
+    """
+    Returns :class:`list` of the names of the `SMS_PHRASE_LISTS` hit in the
+    body of each sms of a chunk, with the learned lists of `phrase_fold`.
+    """
+    find = get_sms_phrase_matcher(phrase_fold).find
+    return [find(sms.get("message_body", "") or "") for sms in smss]
+
+
+def decode_chunk(records, address_key, numbers):
+    """
+    Returns the (addresses, days) of a chunk of calls or smss, where addresses
+    are the ids of the records' addresses in `numbers`, a
+    :class:`phone.PhoneNumberTable`.
+    """
+    ids = numbers.ids
+    intern = numbers.intern
+    addresses = []
+    for record in records:
+        address = record.get(address_key)
+        address_id = ids.get(address)
+        if address_id is None:
+            address_id = intern(address)
+        addresses.append(address_id)
+    days = []
+    for record in records:
+        record_datetime = record.get("datetime")
+        if record_datetime and isinstance(record_datetime, datetime):
+            days.append(record_datetime.date())
+        else:
+            days.append(None)
+    return addresses, days
+
+
+class FeatureEngine(object):
+    """
+    Builds a set of features for a user in a single pass over each device.
+
+    Parameters:
+        features (:class:`list`): The names of the features to build, in the
+            order they should be returned. Defaults to `ALL_FEATURES`.
+        telemetry (:class:`telemetry.Telemetry`): If given, the time spent
+            reading, decoding and in each accumulator is added to it.
+        normalize_numbers (:class:`bool`): Whether addresses with the same
+            canonical phone number count as the same contact, see
+            :class:`phone.PhoneNumberTable`.
+        sketch (:class:`bool`): Whether the features in
+            `SKETCH_ACCUMULATORS` are estimated from fixed size sketches
+            rather than built from the exact sets of the contacts.
+    """
+    def __init__(
+        self, features=None, telemetry=None, normalize_numbers=False,
+        sketch=False
+    ):
+        self.features = list(ALL_FEATURES if features is None else features)
+        self.telemetry = telemetry
+        self.normalize_numbers = normalize_numbers
+        self.sketch = sketch
+        for feature in self.features:
+            if feature not in ACCUMULATORS:
+                raise KeyError(
+                    "Accumulator does not exist for: {}".format(feature)
+                )
+
+    def new_accumulators(self):
+        """
+        Returns :class:`list` of a fresh accumulator per feature, sharing a
+        new :class:`phone.PhoneNumberTable`.
+        """
+        numbers = PhoneNumberTable(self.normalize_numbers)
+        accumulators = [
+            self._accumulator_type(feature)() for feature in self.features
+        ]
+        for acc in accumulators:
+            acc.numbers = numbers
+        return accumulators
+
+    def _accumulator_type(self, feature):
+        if self.sketch and feature in SKETCH_ACCUMULATORS:
+            return SKETCH_ACCUMULATORS[feature]
+        return ACCUMULATORS[feature]
+
+    def partial_names(self, phrase_fold=None):
+        """
+        Returns :class:`list` of the names the partials of each feature are
+        cached under: the feature, with `SKETCH_SUFFIX` if it is built from
+        sketches and `PHRASE_FOLD_SUFFIX` if it counts the learned phrases of
+        a `phrase_fold`, since those partials are not interchangeable.
+        """
+        names = []
+        for feature in self.features:
+            name = feature
+            if self.sketch and feature in SKETCH_ACCUMULATORS:
+                name += SKETCH_SUFFIX
+            if phrase_fold is not None and feature in PHRASE_FOLD_FEATURES:
+                name += PHRASE_FOLD_SUFFIX.format(phrase_fold)
+            names.append(name)
+        return names
+
+    def _handlers(self, accumulators, record_type, method):
+        """
+        Returns the `method` of each accumulator of `record_type` records.
+        """
+        handlers = []
+        for feature, acc in zip(self.features, accumulators):
+            if record_type in acc.record_types:
+                handler = getattr(acc, method)
+                if self.telemetry is not None:
+                    handler = self.telemetry.timed(
+                        "extractors", feature, handler
+                    )
+                handlers.append(handler)
+        return handlers
+
+    def _chunks(self, device_data, log):
+        chunks = iter_chunks(device_data.get(log, []))
+        if self.telemetry is not None:
+            # Streamed logs are read and parsed as their chunks are pulled.
+            chunks = self.telemetry.timed_iter(
+                "phases", "read_{}".format(log), chunks
+            )
+        return chunks
+
+    def add_device(self, accumulators, device_data, phrase_fold=None):
+        """
+        Feeds every record of a device to `accumulators`, with the phrase
+        hits of the learned lists of `phrase_fold`.
+        """
+        contact_handlers = self._handlers(
+            accumulators, CONTACT, "add_contacts"
+        )
+        call_handlers = self._handlers(accumulators, CALL, "add_calls")
+        sms_handlers = self._handlers(accumulators, SMS, "add_smss")
+        hits_handlers = self._handlers(
+            accumulators, SMS_HITS, "add_sms_hits"
+        )
+        if not accumulators:
+            return
+        numbers = accumulators[0].numbers
+        decode = decode_chunk
+        find_hits = find_phrase_hits
+        if self.telemetry is not None:
+            decode = self.telemetry.timed("phases", "decode", decode_chunk)
+            find_hits = self.telemetry.timed(
+                "phases", "find_phrases", find_phrase_hits
+            )
+        if contact_handlers:
+            for contacts in self._chunks(device_data, "contacts"):
+                for handler in contact_handlers:
+                    handler(contacts)
+        if call_handlers:
+            for calls in self._chunks(device_data, "call_log"):
+                addresses, days = decode(calls, "phone_number", numbers)
+                for handler in call_handlers:
+                    handler(calls, addresses, days)
+        if sms_handlers or hits_handlers:
+            for smss in self._chunks(device_data, "sms_log"):
+                addresses, days = decode(smss, "sms_address", numbers)
+                for handler in sms_handlers:
+                    handler(smss, addresses, days)
+                if hits_handlers:
+                    hits = find_hits(smss, phrase_fold)
+                    for handler in hits_handlers:
+                        handler(smss, addresses, days, hits)
+        for acc in accumulators:
+            acc.end_device()
+
+    def build_device_partials(self, device_data, phrase_fold=None):
+        """
+        Returns :class:`list` of accumulators, one per feature, fed only the
+        records of a single device of a user of `phrase_fold`. The partials
+        of a user's devices can be combined with `merge_partials`, e.g. after
+        being cached.
+        """
+        accumulators = self.new_accumulators()
+        self.add_device(accumulators, device_data, phrase_fold)
+        return accumulators
+
+    def merge_partials(self, devices_partials):
+        """
+        Returns :class:`list` of accumulators with the merged state of the
+        partials of every device in `devices_partials`.
+        """
+        accumulators = self.new_accumulators()
+        for partials in devices_partials:
+            for acc, partial in zip(accumulators, partials):
+                acc.merge(partial)
+        return accumulators
+
+    def finalize(self, accumulators):
+        """
+        Returns :class:`list` of (feature, value) tuples in the order of
+        `self.features`.
+        """
+        if self.telemetry is None:
+            return [
+                (feature, acc.finalize())
+                for feature, acc in zip(self.features, accumulators)
+            ]
+        with self.telemetry.phase("finalize"):
+            return [
+                (feature, acc.finalize())
+                for feature, acc in zip(self.features, accumulators)
+            ]
+
+    def build_features(self, user_data):
+        """
+        Parameters:
+            user_data (:class:`dict:`): The dict of the user data information
+                to build the features with.
+
+        Returns:
+            :class:`list` of (feature, value) tuples in the order of
+            `self.features`. Each value is the same value `build_feature`
+            would return for that feature.
+        """
+        accumulators = self.new_accumulators()
+        phrase_fold = user_phrase_fold(user_data)
+        for device_data in user_data.get("devices", []):
+            self.add_device(accumulators, device_data, phrase_fold)
+        return self.finalize(accumulators)
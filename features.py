@@ -1,7 +1,16 @@
 from datetime import datetime
-from utils import next_valid_datetime, ave_or_none, BAD_WORDS_SET
+from utils import (
+    next_valid_datetime, ave_or_none, BAD_WORDS_LIST, OUTGOING_CALL_TYPES,
+    SMS_PHRASE_LISTS, get_bad_words, get_sms_phrase_lists, parse_duration,
+    phrase_fold, read_learned_phrases
+)
+from activity import (
+    ACTIVITY_COLUMNS, ACTIVITY_COUNT_COLUMNS, ActivityIndex, activity_features
+)
 from collections import defaultdict
-# from textblob import TextBlob
+from matcher import PhraseMatcher
+from phone import INTERNATIONAL, phone_number_flags
+from text_stats import TEXT_STATS_COLUMNS, TextStats, get_sentiment_lexicon
 
 
 def build_feature(feature, user_data):
@@ -34,6 +43,22 @@ def build_num_contacts(user_data):
     return num_contacts
 
 
+def build_num_calls_to_international(user_data):
+    """
+    Returns :class:`int` number of outgoing calls to numbers with a country
+    code other than `phone.HOME_COUNTRY_CODE`.
+    """
+    num_calls_to_international = 0
+    for device_data in user_data.get("devices", []):
+        for call in device_data.get("call_log", []):
+            if call.get("call_type") not in OUTGOING_CALL_TYPES:
+                continue
+            phone_number = (call.get("phone_number", "") or "").lower()
+            if phone_number_flags(phone_number) & INTERNATIONAL:
+                num_calls_to_international += 1
+    return num_calls_to_international
+
+
 def build_num_pound_calls(user_data):
     num_pound_calls = 0
     for device_data in user_data.get("devices", []):
@@ -282,6 +307,103 @@ def build_interaction_stats(user_data, require_valid_datetime=True):
     }
 
 
+# The number of most contacted numbers whose interactions are summed, and
+# whose shares make up the concentration.
+TOP_CONTACTS = 5
+CONCENTRATION_CONTACTS = 10
+TOP_CONTACT_COLUMNS = (
+    "top_contact_share",
+    "top_{}_contacts_share".format(TOP_CONTACTS),
+    "contact_concentration",
+)
+
+
+def top_contact_features(top_counts, total):
+    """
+    Returns :class:`dict` of the shares of the `total` interactions with an
+    address that went to the most contacted numbers, keyed by
+    `TOP_CONTACT_COLUMNS`. The concentration is the Herfindahl index of the
+    shares of the top `CONCENTRATION_CONTACTS` numbers, from 0 when they
+    only got a few of the interactions to 1 when one number got all of them.
+
+    Parameters:
+        top_counts (:class:`list`): The interactions with the top
+            `CONCENTRATION_CONTACTS` numbers or more, largest first. It can
+            be shorter, e.g. when there are fewer numbers.
+        total (:class:`int`): The interactions with any number.
+    """
+    top_counts = top_counts[:CONCENTRATION_CONTACTS]
+    if not total:
+        return dict.fromkeys(TOP_CONTACT_COLUMNS)
+    total = float(total)
+    return {
+        "top_contact_share": sum(top_counts[:1]) / total,
+        "top_{}_contacts_share".format(TOP_CONTACTS): sum(
+            top_counts[:TOP_CONTACTS]
+        ) / total,
+        "contact_concentration": sum(
+            (count / total) ** 2 for count in top_counts
+        ),
+    }
+
+
+def build_top_contact_stats(user_data):
+    """
+    Counts the calls and smss with each address and returns how much of them
+    went to the most contacted numbers, see `top_contact_features`.
+    """
+    interactions = defaultdict(int)
+    for device_data in user_data.get("devices", []):
+        for sms in device_data.get("sms_log", []):
+            sms_address = (sms.get("sms_address", "") or "").lower()
+            if sms_address:
+                interactions[sms_address] += 1
+        for call in device_data.get("call_log", []):
+            phone_number = (call.get("phone_number", "") or "").lower()
+            if phone_number:
+                interactions[phone_number] += 1
+    return top_contact_features(
+        sorted(interactions.values(), reverse=True),
+        sum(interactions.values())
+    )
+
+
+def valid_day(record):
+    """
+    Returns the :class:`date` of a record's datetime or None if it does not
+    have a valid datetime.
+    """
+    record_datetime = record.get("datetime")
+    if record_datetime and isinstance(record_datetime, datetime):
+        return record_datetime.date()
+    return None
+
+
+def build_activity_stats(user_data):
+    """
+    Returns the windowed activity features of `activity.activity_features`:
+    the interactions and contacts of the last days, monthly averages, the
+    longest gap between active days and the trend of the interactions.
+    """
+    index = ActivityIndex()
+    for device_data in user_data.get("devices", []):
+        call_log = device_data.get("call_log", [])
+        index.add_calls(
+            [valid_day(call) for call in call_log],
+            [
+                (call.get("phone_number", "") or "").lower()
+                for call in call_log
+            ],
+            [parse_duration(call.get("duration")) for call in call_log]
+        )
+        sms_log = device_data.get("sms_log", [])
+        index.add_smss(
+            [valid_day(sms) for sms in sms_log],
+            [(sms.get("sms_address", "") or "").lower() for sms in sms_log]
+        )
+    return activity_features(index.daily())
+
+
 def build_sms_message_stats(user_data):
     """
     Returns a set of stats from the actual sms messages including:
@@ -289,13 +411,14 @@ def build_sms_message_stats(user_data):
      - The ratio of bad to non-bad words used.
      - The total number of messages sent with at least one bad word.
 
+    The bad words are the hits of the `BAD_WORDS_LIST` of the sms phrase
+    matcher, so they are matched case insensitively, punctuation next to a
+    word does not hide it and every hit counts.
+
     Note:
-     - Sentiment analysis is being done with TextBlob which can currently only
-        perform analysis on english text.
      - All bad words are in english. Consider getting a set of bad words in
         other languages.
-     - Sentiment analysis has been commented out because TextBlob uses a public
-        API to detect language and that makes this script take way too long.
+     - Sentiment is scored locally from a word list by `build_sms_text_stats`.
 
 
 
@@ -304,45 +427,126 @@ def build_sms_message_stats(user_data):
      - grammer score
      - spelling score
     """
+    find = get_sms_phrase_matcher().find
     num_bad_words_used = 0
     total_words = 0
     derogatory_sms_count = 0
-    # sentiment_count = 0
-    # polarity = 0
-    # subjectivity = 0
     for device_data in user_data.get("devices", []):
         for sms in device_data.get("sms_log", []):
             message_body = (sms.get("message_body", "") or "")
             if len(message_body) > 2:
                 # Check if any and count the number of bad words used
-                words = message_body.split(" ")
-                total_words += len(words)
-                bad_words_used = set(words) & BAD_WORDS_SET
-                num_bad_words = len(bad_words_used)
+                total_words += len(message_body.split(" "))
+                num_bad_words = find(message_body).count(BAD_WORDS_LIST)
                 num_bad_words_used += num_bad_words
                 if num_bad_words > 0:
                     derogatory_sms_count += 1
 
-                # TODO: Find something better/faster than TextBlob for sentiment
-                # analysis. Build you're own model using NLTK.
-                # # TextBlob sentiment analysis
-                # message_blob = TextBlob(message_body)
-                # if message_blob.detect_language() == "en":
-                #     sentiment_count += 1
-                #     message_blob.sentiment.polarity
-                #     message_blob.sentiment.subjectivity
-
     return {
         "num_bad_words_used": num_bad_words_used,
         "ratio_of_bad_words_used": ave_or_none(num_bad_words_used, total_words),
         "num_derogatory_sms": derogatory_sms_count,
-        # "sentiment_polarity": ave_or_none(polarity, sentiment_count),
-        # "sentiment_subjectivity": ave_or_none(subjectivity, sentiment_count)
     }
 
+
+_sms_phrase_matchers = {}
+
+
+def get_sms_phrase_matcher(fold=None):
+    """
+    Returns the :class:`PhraseMatcher` of `SMS_PHRASE_LISTS` with the learned
+    lists of the users of `fold`, see `utils.phrase_fold`, compiled on first
+    use. The lists other than the learned ones, and so their hits, are the
+    same in every fold's matcher.
+    """
+    if fold not in _sms_phrase_matchers:
+        _sms_phrase_matchers[fold] = PhraseMatcher(get_sms_phrase_lists(fold))
+    return _sms_phrase_matchers[fold]
+
+
+def user_phrase_fold(user_data):
+    """
+    Returns the `utils.phrase_fold` of a user's data, None if it has no
+    `user_id`, e.g. a new applicant being scored.
+    """
+    if user_data.get("user_id") is None:
+        return None
+    return phrase_fold(user_data.get("user_id"), user_data.get("status"))
+
+
+_word_lists_fingerprint = None
+
+
+def word_lists_fingerprint():
+    """
+    Returns a digest of the bad words, `SMS_PHRASE_LISTS` and sentiment
+    lexicon the sms features are counted with, so cached counts are not used
+    once any of them changes, e.g. when `sms_phrases.py` learns new phrases.
+    """
+    global _word_lists_fingerprint
+    if _word_lists_fingerprint is None:
+        import hashlib
+        import json
+        sha1 = hashlib.sha1(json.dumps(sorted(get_bad_words())))
+        # None, the lists of unlabeled users, sorts before every fold.
+        for fold in sorted(read_learned_phrases()):
+            phrase_lists = get_sms_phrase_lists(fold)
+            for name in sorted(phrase_lists):
+                sha1.update(json.dumps(
+                    [fold, name, sorted(phrase_lists[name])]
+                ))
+        sha1.update(json.dumps(sorted(get_sentiment_lexicon().items())))
+        _word_lists_fingerprint = sha1.hexdigest()
+    return _word_lists_fingerprint
+
+
+def format_phrase_hits(counts):
+    return dict(
+        ("num_{}_hits".format(name), count) for name, count in counts.items()
+    )
+
+
+def build_sms_phrase_stats(user_data):
+    """
+    Counts the hits of each list in `SMS_PHRASE_LISTS` in the sms bodies.
+
+    Unlike `build_sms_message_stats`, the words and phrases are matched case
+    insensitively and punctuation next to a word does not hide it.
+
+    The learned lists are those of the user's `user_phrase_fold`.
+
+    Returns :class:`dict`: A dict with a `num_<name>_hits` key per list.
+    """
+    matcher = get_sms_phrase_matcher(user_phrase_fold(user_data))
+    counts = None
+    for device_data in user_data.get("devices", []):
+        for sms in device_data.get("sms_log", []):
+            message_body = (sms.get("message_body", "") or "")
+            counts = matcher.count(message_body, counts)
+    if counts is None:
+        counts = matcher.count("")
+    return format_phrase_hits(counts)
+
+
+def build_sms_text_stats(user_data):
+    """
+    Returns the text statistics of all the sms bodies, see
+    `text_stats.TEXT_STATS_COLUMNS`: the average words per sms and length of
+    a word, the ratios of digit, uppercase and non-ASCII characters and the
+    lexicon based sentiment of the words.
+    """
+    stats = TextStats()
+    for device_data in user_data.get("devices", []):
+        stats.add_bodies(
+            sms.get("message_body", "") or ""
+            for sms in device_data.get("sms_log", [])
+        )
+    return stats.features()
+
+
 FEATURE_EXTRACTORS = {
     "num_contacts": build_num_contacts,
-    # "num_calls_to_international": build_num_calls_to_international,
+    "num_calls_to_international": build_num_calls_to_international,
     # "num_calls_from_international": build_num_calls_from_international,
     "num_#_calls": build_num_pound_calls,
     "num_#_sms": build_num_pound_sms,
@@ -353,7 +557,11 @@ FEATURE_EXTRACTORS = {
     "ave_daily_sms_count": build_ave_daily_sms_count,
     "ave_message_body_length": build_ave_message_body_length,
     "interaction_stats": build_interaction_stats,
+    "top_contact_stats": build_top_contact_stats,
+    "activity_stats": build_activity_stats,
     "sms_message_stats": build_sms_message_stats,
+    "sms_phrase_stats": build_sms_phrase_stats,
+    "sms_text_stats": build_sms_text_stats,
     # DEPRECATED until we can get reliable `date_added` information.
     # "age_of_contacts_stats": build_age_of_contacts_stats,
     # "ave_num_times_contacted": build_ave_num_times_contacted,  # I don't know
@@ -368,9 +576,175 @@ FEATURE_EXTRACTORS = {
     # # how many contacts do you have of people who defaulted / repaid. Can't do
     #   this because I don't have the phone numbers of the users. But I imagine
     #   this would be interesting to check.
-    # Number of contacts in common with people who defauled / repaid
-    # Number of people interacted with in common with people who defaulted /
-    #   repaid
+    # Number of contacts in common with people who defauled / repaid, and of
+    #   people interacted with in common: built across users by
+    #   `shared_contacts.py`, since they depend on every other user.
 }
 
 ALL_FEATURES = FEATURE_EXTRACTORS.keys()
+
+SMS_PHRASE_COLUMNS = tuple(sorted(
+    format_phrase_hits(dict.fromkeys(SMS_PHRASE_LISTS, 0))
+))
+
+# The device logs each extractor reads, the output columns it returns and
+# which of them are counts, whose values are ints, rather than averages or
+# ratios, whose values are floats. Extractors that return a single value
+# return a column named after themselves.
+FEATURE_METADATA = {
+    "num_contacts": {"logs": ("contacts",), "counts": ("num_contacts",)},
+    "num_calls_to_international": {
+        "logs": ("call_log",),
+        "counts": ("num_calls_to_international",),
+    },
+    "num_#_calls": {"logs": ("call_log",), "counts": ("num_#_calls",)},
+    "num_#_sms": {"logs": ("sms_log",), "counts": ("num_#_sms",)},
+    "num_*_calls": {"logs": ("call_log",), "counts": ("num_*_calls",)},
+    "num_*_sms": {"logs": ("sms_log",), "counts": ("num_*_sms",)},
+    "ave_duration(s)": {"logs": ("call_log",)},
+    "call_stats": {
+        "logs": ("call_log",),
+        "columns": (
+            "calls", "duration(s)", "ave_daily_calls", "ave_daily_duration(s)"
+        ),
+        "counts": ("calls", "duration(s)"),
+    },
+    "ave_daily_sms_count": {"logs": ("sms_log",)},
+    "ave_message_body_length": {"logs": ("sms_log",)},
+    "interaction_stats": {
+        "logs": ("call_log", "sms_log"),
+        "columns": (
+            "total_num_contacts_interacted_with",
+            "total_interactions",
+            "ave_daily_sms",
+            "ave_daily_calls",
+            "ave_daily_contacts_interacted_with",
+        ),
+        "counts": (
+            "total_num_contacts_interacted_with", "total_interactions"
+        ),
+    },
+    "top_contact_stats": {
+        "logs": ("call_log", "sms_log"),
+        "columns": TOP_CONTACT_COLUMNS,
+    },
+    "activity_stats": {
+        "logs": ("call_log", "sms_log"),
+        "columns": ACTIVITY_COLUMNS,
+        "counts": ACTIVITY_COUNT_COLUMNS,
+    },
+    "sms_message_stats": {
+        "logs": ("sms_log",),
+        "columns": (
+            "num_bad_words_used",
+            "ratio_of_bad_words_used",
+            "num_derogatory_sms",
+        ),
+        "counts": ("num_bad_words_used", "num_derogatory_sms"),
+    },
+    "sms_phrase_stats": {
+        "logs": ("sms_log",),
+        "columns": SMS_PHRASE_COLUMNS,
+        "counts": SMS_PHRASE_COLUMNS,
+    },
+    "sms_text_stats": {
+        "logs": ("sms_log",),
+        "columns": TEXT_STATS_COLUMNS,
+    },
+}
+
+
+def feature_columns(feature):
+    """
+    Returns :class:`tuple` of the output columns of a feature extractor.
+    """
+    return FEATURE_METADATA[feature].get("columns", (feature,))
+
+
+def column_types():
+    """
+    Returns :class:`dict` mapping each output column to its type, :class:`int`
+    for the counts of `FEATURE_METADATA` and :class:`float` for the averages
+    and ratios.
+    """
+    types = {}
+    for feature in ALL_FEATURES:
+        counts = FEATURE_METADATA[feature].get("counts", ())
+        for column in feature_columns(feature):
+            types[column] = int if column in counts else float
+    return types
+
+
+def feature_providers():
+    """
+    Returns :class:`dict` mapping each output column to the extractor whose
+    value ends up in it. A column returned by several extractors, e.g.
+    `ave_daily_calls`, is provided by the last of them in `ALL_FEATURES`,
+    since its value overwrites the others.
+    """
+    providers = {}
+    for feature in ALL_FEATURES:
+        for column in feature_columns(feature):
+            providers[column] = feature
+    return providers
+
+
+def output_columns(features=None):
+    """
+    Returns :class:`list` of the output columns of `features`, or of
+    `ALL_FEATURES`, in a fixed order: by extractor name and then in the order
+    of each extractor's metadata. A column returned by several extractors is
+    only listed once.
+    """
+    if features is None:
+        features = ALL_FEATURES
+    columns = []
+    for feature in sorted(features):
+        for column in feature_columns(feature):
+            if column not in columns:
+                columns.append(column)
+    return columns
+
+
+def select_features(names):
+    """
+    Works out the extractors needed to build a subset of the output.
+
+    Parameters:
+        names (:class:`list`): Output column names or extractor names. An
+            extractor name selects every column it returns.
+
+    Returns:
+        :class:`tuple` of (features, columns) where features is the
+        :class:`list` of extractors to run, in the order of `ALL_FEATURES`,
+        and columns is the :class:`list` of the selected output columns.
+
+    Raises:
+        ValueError if a name is neither an output column nor an extractor.
+    """
+    providers = feature_providers()
+    columns = []
+    for name in names:
+        if name in FEATURE_METADATA:
+            name_columns = feature_columns(name)
+        elif name in providers:
+            name_columns = (name,)
+        else:
+            raise ValueError("Unknown feature or column: {}".format(name))
+        for column in name_columns:
+            if column not in columns:
+                columns.append(column)
+    selected = set(providers[column] for column in columns)
+    features = [feature for feature in ALL_FEATURES if feature in selected]
+    return features, columns
+
+
+def required_logs(features):
+    """
+    Returns :class:`set` of the device logs the features read, e.g.
+    `call_log`.
+    """
+    logs = set()
+    for feature in features:
+        logs.update(FEATURE_METADATA[feature]["logs"])
+    return logs
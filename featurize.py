@@ -0,0 +1,350 @@
+"""
+Builds the features of a single user from in-memory payloads, for scoring
+loan applicants at request time.
+
+`featurize_user` takes the parsed JSON of a user's device logs, the same
+records the `collated_*.txt` files hold, and returns the user's features as a
+dict keyed by the columns of `feature_data.csv`. Nothing is read from or
+written to disk.
+
+It can also be run as a small local server, either over HTTP:
+```
+python featurize.py --port 8000
+curl -d '{"devices": [{"call_log": [...], "sms_log": [...]}]}' \\
+    localhost:8000/featurize
+```
+or over stdin and stdout, one JSON request and response per line:
+```
+python featurize.py --stdin < requests.jsonl
+```
+Requests are `{"devices": [...]}` with an optional `"features"` list of
+columns or extractors to build, `SCORING_FEATURES` by default, `"dedup": true`
+to drop the records synced across devices and `"normalize_numbers": true` to
+count the addresses with the same phone number as the same contact, and
+responses are `{"features": {...}}` or `{"error": "..."}`. A malformed request
+gets an error response and never stops the server.
+"""
+import json
+import sys
+from dedup import DeviceMerger
+from engine import FeatureEngine
+from features import required_logs, select_features
+from timestamps import TimestampParser
+
+
+# The fields of each log's records that hold timestamps.
+DATETIME_FIELDS = {
+    "call_log": ("datetime",),
+    "contacts": ("date_added", "last_time_contacted"),
+    "sms_log": ("datetime",),
+}
+STRING = (basestring,)
+STRING_OR_NUMBER = (basestring, int, long, float)
+# The types the fields the extractors read can have, besides null, so a
+# malformed record is rejected before it reaches them.
+FIELD_TYPES = {
+    "call_log": {
+        "call_type": STRING_OR_NUMBER,
+        "datetime": STRING_OR_NUMBER,
+        "duration": STRING_OR_NUMBER,
+        "phone_number": STRING,
+    },
+    "contacts": {
+        "date_added": STRING_OR_NUMBER,
+        "display_name": STRING,
+        "last_time_contacted": STRING_OR_NUMBER,
+        "phone_numbers": (list,),
+    },
+    "sms_log": {
+        "datetime": STRING_OR_NUMBER,
+        "message_body": STRING,
+        "sms_address": STRING,
+        "sms_type": STRING_OR_NUMBER,
+    },
+}
+# The extractors `featurize_user` builds by default: those of the original
+# feature_data.csv and `num_calls_to_international`. Together they take about
+# 8 ms for a typical applicant in `benchmarks.bench_scoring`, while every
+# feature takes about 22 ms, mostly in the sms text, phrase and activity
+# extractors, which can still be asked for with `features`.
+SCORING_FEATURES = (
+    "num_contacts",
+    "num_calls_to_international",
+    "num_#_calls",
+    "num_#_sms",
+    "num_*_calls",
+    "num_*_sms",
+    "ave_duration(s)",
+    "call_stats",
+    "ave_daily_sms_count",
+    "ave_message_body_length",
+    "interaction_stats",
+    "sms_message_stats",
+)
+DEFAULT_PORT = 8000
+
+_timestamp_parser = None
+_engines = {}
+
+
+def get_timestamp_parser():
+    """
+    Returns the :class:`TimestampParser` shared by every request, created on
+    first use so importing this module does no work.
+    """
+    global _timestamp_parser
+    if _timestamp_parser is None:
+        _timestamp_parser = TimestampParser()
+    return _timestamp_parser
+
+
+def get_engine(features=None, normalize_numbers=False):
+    """
+    Returns the :class:`FeatureEngine` and output columns of a list of
+    column or extractor names, or of `SCORING_FEATURES` if `features` is
+    None.
+    """
+    if features is None:
+        features = SCORING_FEATURES
+    key = (tuple(features), normalize_numbers)
+    engine = _engines.get(key)
+    if engine is None:
+        features, columns = select_features(features)
+        engine = _engines[key] = (
+            FeatureEngine(features, normalize_numbers=normalize_numbers),
+            columns
+        )
+    return engine
+
+
+def check_record(log, record):
+    """
+    Raises ValueError if a record of `log` is not a JSON object or one of its
+    fields has a type the extractors can't read.
+    """
+    if not isinstance(record, dict):
+        raise ValueError(
+            "Each record of {} must be a JSON object.".format(log)
+        )
+    for field, types in FIELD_TYPES[log].items():
+        value = record.get(field)
+        if value is not None and not isinstance(value, types):
+            raise ValueError("Invalid {} of a record of {}: {!r}".format(
+                field, log, value
+            ))
+    if log == "contacts":
+        for phone_number in record.get("phone_numbers") or []:
+            if phone_number is not None and not isinstance(
+                phone_number, basestring
+            ):
+                raise ValueError(
+                    "Invalid phone number of a contact: {!r}".format(
+                        phone_number
+                    )
+                )
+
+
+def normalize_records(log, records, datetime_fields, parse):
+    """
+    Returns copies of the records of a log with their timestamps parsed, the
+    way `generate_features.iter_call_log` and co. normalize them. The
+    caller's records are left untouched.
+
+    Raises:
+        ValueError if a record is malformed, see `check_record`.
+    """
+    normalized = []
+    for record in records:
+        check_record(log, record)
+        record = dict(record)
+        for field in datetime_fields:
+            if field in record:
+                record[field] = parse(record[field])
+        normalized.append(record)
+    return normalized
+
+
+def normalize_device(device_payload, parse, logs=None):
+    """
+    Returns the device data `FeatureEngine` expects from the payload of a
+    device, with only `logs` if it is given. The contacts can be under
+    `contacts` or `contact_list`.
+    """
+    if not isinstance(device_payload, dict):
+        raise ValueError("Each device must be a JSON object.")
+    device_payload = dict(device_payload)
+    if "contacts" not in device_payload:
+        device_payload["contacts"] = device_payload.get("contact_list") or []
+    device_data = {}
+    for log, datetime_fields in DATETIME_FIELDS.items():
+        records = device_payload.get(log) or []
+        if not isinstance(records, list):
+            raise ValueError("{} must be a JSON array.".format(log))
+        if logs is not None and log not in logs:
+            # No extractor reads it, so it isn't copied or parsed.
+            records = []
+        device_data[log] = normalize_records(
+            log, records, datetime_fields, parse
+        )
+    return device_data
+
+
+def featurize_user(
+    device_payloads, features=None, dedup=False, normalize_numbers=False
+):
+    """
+    Builds the features of a single user.
+
+    Parameters:
+        device_payloads (:class:`list`): One :class:`dict` per device of the
+            user, with the records of its `call_log`, `contacts` (or
+            `contact_list`) and `sms_log`, as found in the collated files.
+        features (:class:`list`): The output columns or extractors to build,
+            like `--features`. Defaults to `SCORING_FEATURES`, pass
+            `features.ALL_FEATURES` for every column of feature_data.csv.
+        dedup (:class:`bool`): Merge the devices into one without the
+            records synced across them, like `--dedup-devices`.
+        normalize_numbers (:class:`bool`): Count the addresses with the same
+            phone number as the same contact, like `--normalize-numbers`.
+
+    Returns:
+        :class:`dict` mapping each output column to its value.
+
+    Raises:
+        ValueError if a payload is malformed or a feature does not exist.
+    """
+    engine, columns = get_engine(features, normalize_numbers)
+    parse = get_timestamp_parser().parse
+    logs = required_logs(engine.features)
+    devices = [
+        normalize_device(device_payload, parse, logs)
+        for device_payload in device_payloads
+    ]
+    if dedup:
+        devices = [DeviceMerger().merge(devices)]
+    user_data = {"devices": devices}
+    user_features = {}
+    for feature, feature_data in engine.build_features(user_data):
+        # Some features return dicts with multiple data points.
+        if isinstance(feature_data, dict):
+            user_features.update(feature_data)
+        else:
+            user_features[feature] = feature_data
+    user_features = dict(
+        (column, user_features.get(column)) for column in columns
+    )
+    # The invalid timestamps of a request are not reported.
+    get_timestamp_parser().pop_invalid()
+    return user_features
+
+
+def handle_request(request_txt):
+    """
+    Returns the JSON response to a JSON request. A request that fails for any
+    reason gets an error response, so it can't bring a server down.
+    """
+    try:
+        request = json.loads(request_txt)
+        if not isinstance(request, dict):
+            raise ValueError("The request must be a JSON object.")
+        devices = request.get("devices")
+        if not isinstance(devices, list):
+            raise ValueError("`devices` must be a JSON array.")
+        features = request.get("features")
+        if features is not None and (
+            not isinstance(features, list) or
+            not all(isinstance(feature, basestring) for feature in features)
+        ):
+            raise ValueError("`features` must be a JSON array of strings.")
+        response = {
+            "features": featurize_user(
+                devices,
+                features,
+                bool(request.get("dedup")),
+                bool(request.get("normalize_numbers"))
+            )
+        }
+    except ValueError as e:
+        response = {"error": str(e)}
+    except Exception as e:
+        # The payload got past the checks of `normalize_device`.
+        get_timestamp_parser().pop_invalid()
+        response = {"error": "Could not featurize the request: {}: {}".format(
+            type(e).__name__, e
+        )}
+    return json.dumps(response)
+
+
+def serve_http(host, port):
+    """
+    Serves `POST /featurize` on `host`:`port` until interrupted. The HTTP
+    server is only imported here so scoring in-process stays cheap to import.
+    """
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+    class FeaturizeHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            if self.path.rstrip("/") != "/featurize":
+                self.send_error(404)
+                return
+            length = int(self.headers.get("Content-Length") or 0)
+            response = handle_request(self.rfile.read(length))
+            self.send_response(
+                400 if response.startswith('{"error"') else 200
+            )
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(response)))
+            self.end_headers()
+            self.wfile.write(response)
+
+        def log_message(self, format, *args):
+            # Keep the output quiet, one line per request is too much at
+            # scale.
+            pass
+
+    server = HTTPServer((host, port), FeaturizeHandler)
+    print("Serving POST /featurize on {}:{}".format(host, port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+def serve_stdin(input_file=sys.stdin, output_file=sys.stdout):
+    for line in iter(input_file.readline, ""):
+        if not line.strip():
+            continue
+        output_file.write(handle_request(line) + "\n")
+        output_file.flush()
+
+
+def main(argv=None):
+    # Only the servers parse arguments, not the callers of `featurize_user`.
+    import argparse
+    parser = argparse.ArgumentParser(
+        description="Serve the features of single users."
+    )
+    parser.add_argument(
+        "--port", type=int, default=DEFAULT_PORT,
+        help="The port to serve POST /featurize on. Defaults to {}.".format(
+            DEFAULT_PORT
+        )
+    )
+    parser.add_argument(
+        "--host", default="127.0.0.1",
+        help="The address to listen on. Defaults to 127.0.0.1."
+    )
+    parser.add_argument(
+        "--stdin", action="store_true",
+        help="Read one JSON request per line from stdin and write one JSON "
+        "response per line to stdout instead of serving HTTP."
+    )
+    args = parser.parse_args(argv)
+    if args.stdin:
+        serve_stdin()
+        return
+    serve_http(args.host, args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -22,26 +22,43 @@ user_id |   status   | feature_1_name | feature_2_name | ... | feature_n_name
    350  |   repaid   |            421 |            .97 | ... |             11
 """
 from os import listdir
-from os.path import isfile
-from datetime import datetime
-import dateutil.parser
+from os.path import isfile, splitext
+import argparse
 import csv
 import json
-from features import ALL_FEATURES, build_feature
-progress_installed = False
-try:
-    from progress.bar import Bar
-    progress_installed = True
-except:
-    print (
-        "To see pretty status bars while this script is loading please install "
-        "`progress` with `pip install progress`"
-    )
+import sys
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import partial
+from itertools import chain, imap
+from cache import DeviceCache, DeviceColumnsCache, HashingFile
+from dedup import DeviceMerger, add_duplicates, new_duplicates
+from engine import FeatureEngine
+from features import (
+    ALL_FEATURES, FEATURE_METADATA, feature_columns, output_columns,
+    required_logs, select_features
+)
+from json_stream import JsonStreamError, iter_json_array
+from prefetch import (
+    DEFAULT_PREFETCH_BYTES, DEFAULT_PREFETCH_DEPTH, Prefetcher
+)
+from telemetry import (
+    RUSAGE_CHILDREN, SampledTimer, Telemetry, cpu_time, peak_rss_kb
+)
+from timestamps import (
+    NUM_INVALID_EXAMPLES, TimestampParser, merge_invalid_timestamps
+)
+from utils import phrase_fold
+from writers import (
+    ID_COLUMNS, OUTPUT_FORMATS, check_output_format, open_feature_writer
+)
 
 
 CALL_LOG_FILENAME = "collated_call_log.txt"
 CONTACT_LIST_FILENAME = "collated_contact_list.txt"
 DATA_PATH = "./user_logs/"
+OUTPUT_FILE = "feature_data.csv"
 SMS_LOG_FILENAME = "collated_sms_log.txt"
 USER_STATUS_FILE = "user_status.csv"
 DEVICE_DATA_FILES = set([
@@ -49,6 +66,49 @@ DEVICE_DATA_FILES = set([
     CONTACT_LIST_FILENAME,
     SMS_LOG_FILENAME
 ])
+# Maps each log of a device to the file it is read from.
+DEVICE_LOG_FILES = {
+    "call_log": CALL_LOG_FILENAME,
+    "contacts": CONTACT_LIST_FILENAME,
+    "sms_log": SMS_LOG_FILENAME
+}
+TIMESTAMP_PARSER = TimestampParser()
+TIMESTAMP_TIMER = SampledTimer()
+# The number of users `--batch` builds at once.
+DEFAULT_BATCH_USERS = 1000
+# The most users `--workers` sends to a worker at once.
+POOL_CHUNKSIZE = 16
+# The :class:`Prefetcher` reading the files of the next users ahead, if any.
+PREFETCHER = None
+# The :class:`dict` the hash of each file `iter_json_file` reads is added to,
+# keyed by path, while a device is being built for the cache, see
+# `hashing_reads`.
+READ_HASHES = None
+# The `progress.bar.Bar` class, imported with the first bar, or False if
+# progress is not installed.
+_progress_bar_class = None
+
+
+def progress_bar(message, max):
+    """
+    Returns a `progress.bar.Bar` of `max` steps, or None if progress is not
+    installed. progress is only imported once a bar is shown, so importing
+    this module, e.g. in a worker, stays cheap.
+    """
+    global _progress_bar_class
+    if _progress_bar_class is None:
+        try:
+            from progress.bar import Bar
+            _progress_bar_class = Bar
+        except ImportError:
+            _progress_bar_class = False
+            print (
+                "To see pretty status bars while this script is loading "
+                "please install `progress` with `pip install progress`"
+            )
+    if not _progress_bar_class:
+        return None
+    return _progress_bar_class(message, max=max)
 
 
 def build_user_folder_path(user_id):
@@ -60,10 +120,8 @@ def read_json_file(file_path, default=None):
         # print("{} does not exist.".format(file_path))
         return default
     try:
-        file = open(file_path, "r")
-        txt_data = file.read()
-        json_data = json.loads(txt_data)
-        return json_data
+        with open(file_path, "r") as json_file:
+            return json.load(json_file)
     except IOError:
         print("Could not json parse {}. returning: {}".format(
             file_path,
@@ -72,55 +130,134 @@ def read_json_file(file_path, default=None):
         return default
 
 
-def parse_timestamp(timestamp_txt, default=None):
+def iter_json_file(file_path):
+    """
+    Yields the records of a file holding a JSON array one at a time, or
+    nothing if the file does not exist.
+
+    If the file is malformed, the records before the malformed data are still
+    yielded and the byte offset of the malformed data is reported. Files read
+    ahead by `PREFETCHER` are parsed from memory. The file is hashed as it is
+    parsed while `READ_HASHES` is set.
+    """
+    json_file = None
+    if PREFETCHER is not None:
+        json_file = PREFETCHER.open(file_path)
+    if json_file is None and not isfile(file_path):
+        return
     try:
-        try:
-            timestamp = int(timestamp_txt) / 1000
-            if timestamp == 0:
-                return default
-        except ValueError:
-            # Try parsing iso format
-            return dateutil.parser.parse(timestamp_txt)
-        else:
-            return datetime.fromtimestamp(timestamp)
-    except:
-        # Invalid datetime, return default.
-        print("Received an invalid timestamp: {}".format(timestamp_txt))
-        return default
+        if json_file is None:
+            json_file = open(file_path, "rb")
+        if READ_HASHES is not None:
+            json_file = HashingFile(json_file, file_path, READ_HASHES)
+        with json_file:
+            for record in iter_json_array(json_file):
+                yield record
+    except JsonStreamError as e:
+        print("Could not json parse {}: {}".format(file_path, e))
+    except IOError:
+        print("Could not read {}.".format(file_path))
 
 
-def build_contact_list(device_folder_path):
+@contextmanager
+def hashing_reads(read_hashes):
+    """
+    Adds the hash of each file read in the block to `read_hashes`, keyed by
+    path, so the cache gets the hashes of a device's files from the bytes
+    parsed rather than reading them again.
+    """
+    global READ_HASHES
+    READ_HASHES = read_hashes
+    try:
+        yield read_hashes
+    finally:
+        READ_HASHES = None
+
+
+def parse_timestamp(timestamp_txt, default=None):
+    # Invalid timestamps are counted by TIMESTAMP_PARSER and reported in the
+    # run summary. A sample of the calls is timed for the telemetry.
+    return TIMESTAMP_TIMER.call(TIMESTAMP_PARSER.parse, timestamp_txt, default)
+
+
+def iter_contact_list(device_folder_path):
     contact_list_path = "/".join([device_folder_path, CONTACT_LIST_FILENAME])
-    contact_list = read_json_file(contact_list_path, default=[])
-    for contact in contact_list:
+    for contact in iter_json_file(contact_list_path):
         for date_fild in ["date_added", "last_time_contacted"]:
             if date_fild in contact:
                 contact[date_fild] = parse_timestamp(contact[date_fild])
-    return contact_list
+        yield contact
 
 
-def build_call_log(device_folder_path):
+def iter_call_log(device_folder_path):
     call_log_path = "/".join([device_folder_path, CALL_LOG_FILENAME])
-    call_log = read_json_file(call_log_path, default=[])
-    for call in call_log:
+    for call in iter_json_file(call_log_path):
         if "datetime" in call:
             call["datetime"] = parse_timestamp(call["datetime"])
-    return call_log
+        yield call
 
 
-def build_sms_log(device_folder_path):
+def iter_sms_log(device_folder_path):
     sms_log_path = "/".join([device_folder_path, SMS_LOG_FILENAME])
-    sms_log = read_json_file(sms_log_path, default=[])
-    for sms in sms_log:
+    for sms in iter_json_file(sms_log_path):
         if "datetime" in sms:
             sms["datetime"] = parse_timestamp(sms["datetime"])
-    return sms_log
+        yield sms
+
+
+def build_contact_list(device_folder_path):
+    return list(iter_contact_list(device_folder_path))
+
+
+def build_call_log(device_folder_path):
+    return list(iter_call_log(device_folder_path))
 
 
-def build_user_device_data(user_id):
-    device_data = []
+def build_sms_log(device_folder_path):
+    return list(iter_sms_log(device_folder_path))
+
+
+DEVICE_LOG_READERS = {
+    "call_log": iter_call_log,
+    "contacts": iter_contact_list,
+    "sms_log": iter_sms_log
+}
+
+
+def build_device_data(device_folder_path, logs=None):
+    """
+    Reads the logs of a device. If `logs` is given, e.g. ["call_log"], only
+    those logs are read and the others are left out, so their files are
+    never opened.
+    """
+    return dict(
+        (log, list(records))
+        for log, records in sorted(
+            build_device_stream(device_folder_path, logs).items()
+        )
+    )
+
+
+def build_device_stream(device_folder_path, logs=None):
+    """
+    Like `build_device_data` but each log is a generator that reads and
+    normalizes one record at a time, so a device can be fed to the
+    `FeatureEngine` in constant memory. A log's file is only opened once its
+    generator is iterated, and each generator can only be iterated once.
+    """
+    if logs is None:
+        logs = DEVICE_LOG_READERS.keys()
+    return dict(
+        (log, DEVICE_LOG_READERS[log](device_folder_path)) for log in logs
+    )
+
+
+def list_device_folder_paths(user_id):
     user_folder_path = build_user_folder_path(user_id)
-    for device_folder in listdir(user_folder_path):
+    device_folder_paths = []
+    # Sorted so the devices are always merged in the same order, which picks
+    # the copy of each record synced across them that `DeviceMerger` keeps.
+    for device_folder in sorted(listdir(user_folder_path)):
         device_folder_path = "/".join([user_folder_path, device_folder])
         # The lines below are commented out because every device_folder_path
         # was a folder with at least one data file. But this may be useful for
@@ -133,22 +270,267 @@ def build_user_device_data(user_id):
         #     print("{} contained no user data files.".format(device_folder_path))
         #     continue
         # else:
-        device_data.append({
-            "call_log": build_call_log(device_folder_path),
-            "contacts": build_contact_list(device_folder_path),
-            "sms_log": build_sms_log(device_folder_path)
-        })
-    return device_data
+        device_folder_paths.append(device_folder_path)
+    return device_folder_paths
+
+
+def list_user_data_files(user_id, logs=None):
+    """
+    Returns :class:`list` of the paths of the data files of every device of
+    a user, or only of their `logs` if given.
+    """
+    if logs is None:
+        logs = DEVICE_LOG_FILES.keys()
+    return [
+        "/".join([device_folder_path, DEVICE_LOG_FILES[log]])
+        for device_folder_path in list_device_folder_paths(user_id)
+        for log in sorted(logs)
+    ]
+
+
+def start_prefetching(
+    rows, logs=None, depth=DEFAULT_PREFETCH_DEPTH,
+    max_bytes=DEFAULT_PREFETCH_BYTES
+):
+    """
+    Starts reading the data files of the users in `rows`, rows of the user
+    status file, ahead of `iter_json_file`.
+
+    Returns:
+        The :class:`Prefetcher`, to iterate over instead of `rows` so it
+        knows which user is being read. Stop it with `stop_prefetching`.
+    """
+    global PREFETCHER
+    PREFETCHER = Prefetcher(
+        rows,
+        lambda row: list_user_data_files(row.get("user_id"), logs),
+        depth,
+        max_bytes
+    )
+    return PREFETCHER
+
+
+def stop_prefetching():
+    global PREFETCHER
+    if PREFETCHER is not None:
+        PREFETCHER.close()
+        PREFETCHER = None
+
+
+def build_user_device_data(user_id, logs=None):
+    return [
+        build_device_data(device_folder_path, logs)
+        for device_folder_path in list_device_folder_paths(user_id)
+    ]
+
+
+def build_device_columns(
+    device_folder_path, address_table, logs=None, telemetry=None,
+    user_phrase_fold=None
+):
+    """
+    Reads and parses the logs of a device into :class:`DeviceColumns`, with
+    the phrase hits of the learned lists of `user_phrase_fold`.
+    """
+    from columnar import DeviceColumns
+    if telemetry is None:
+        device_data = build_device_data(device_folder_path, logs)
+        return DeviceColumns.from_device(
+            device_data, address_table, user_phrase_fold
+        )
+    wall = time.time()
+    cpu = cpu_time()
+    device_data = build_device_data(device_folder_path, logs)
+    telemetry.add(
+        "phases", "read", time.time() - wall, cpu_time() - cpu,
+        sum(len(records) for records in device_data.values())
+    )
+    with telemetry.phase("columnar_convert"):
+        return DeviceColumns.from_device(
+            device_data, address_table, user_phrase_fold
+        )
+
+
+def read_user_columns(
+    user_id, address_table, logs=None, telemetry=None, columns_cache=None,
+    user_phrase_fold=None
+):
+    """
+    Reads the :class:`DeviceColumns` of each of a user's devices, whose
+    `utils.phrase_fold` is `user_phrase_fold`. Each device is converted as
+    soon as it is parsed so only one device's parsed records are held in
+    memory at a time.
+
+    If `columns_cache` is given, the columns of each device are memory mapped
+    from the :class:`DeviceColumnsCache` instead, and only the devices whose
+    data files changed since they were cached are read and parsed.
+
+    Returns:
+        :class:`tuple` of (devices, invalid_timestamps).
+    """
+    devices = []
+    invalid_timestamps = (0, [])
+    for device_folder_path in list_device_folder_paths(user_id):
+        cached = None
+        if columns_cache is not None:
+            if telemetry is None:
+                cached = columns_cache.get(
+                    device_folder_path, address_table, user_phrase_fold
+                )
+            else:
+                with telemetry.phase("cache_get"):
+                    cached = columns_cache.get(
+                        device_folder_path, address_table, user_phrase_fold
+                    )
+        if cached is None:
+            if columns_cache is None:
+                device = build_device_columns(
+                    device_folder_path, address_table, logs, telemetry,
+                    user_phrase_fold
+                )
+            else:
+                description = columns_cache.describe(device_folder_path)
+                with hashing_reads(description[1]):
+                    device = build_device_columns(
+                        device_folder_path, address_table, logs, telemetry,
+                        user_phrase_fold
+                    )
+            device_invalid_timestamps = TIMESTAMP_PARSER.pop_invalid()
+            if columns_cache is not None:
+                columns_cache.put(
+                    device_folder_path,
+                    device,
+                    address_table,
+                    device_invalid_timestamps,
+                    description,
+                    user_phrase_fold
+                )
+        else:
+            device, device_invalid_timestamps = cached
+        devices.append(device)
+        invalid_timestamps = merge_invalid_timestamps(
+            invalid_timestamps, device_invalid_timestamps
+        )
+    return devices, invalid_timestamps
+
+
+def build_user_features_columnar(
+    user_id, features=None, telemetry=None, columns_cache=None,
+    normalize_numbers=False, user_phrase_fold=None
+):
+    """
+    Builds the features of a user with the vectorized extractors of
+    `columnar.COLUMNAR_EXTRACTORS`, over the columns read by
+    `read_user_columns`, from `columns_cache` if it is given.
+
+    If `normalize_numbers` is True, addresses with the same canonical phone
+    number count as the same contact. The learned phrases counted are those
+    of `user_phrase_fold`.
+
+    Returns:
+        :class:`tuple` of (features, invalid_timestamps).
+    """
+    # numpy is only imported by the runs that need it.
+    from columnar import AddressTable, build_features_columnar
+    logs = None
+    if features is not None and columns_cache is None:
+        # A cached device holds every log, whatever features it is built for.
+        logs = required_logs(features)
+    address_table = AddressTable(normalize_numbers)
+    devices, invalid_timestamps = read_user_columns(
+        user_id, address_table, logs, telemetry, columns_cache,
+        user_phrase_fold
+    )
+    user_features = build_features_columnar(
+        devices, address_table, features, telemetry
+    )
+    return user_features, invalid_timestamps
+
+
+def build_user_features_cached(
+    user_id, engine, device_cache, user_phrase_fold=None
+):
+    """
+    Builds the features of a user from the cached partials of each of their
+    devices, only reading and aggregating the devices whose data files
+    changed since they were cached. The learned phrases counted are those of
+    `user_phrase_fold`.
+
+    Returns:
+        :class:`tuple` of (features, invalid_timestamps).
+    """
+    devices_partials = []
+    invalid_timestamps = (0, [])
+    logs = required_logs(engine.features)
+    telemetry = engine.telemetry
+    partial_names = engine.partial_names(user_phrase_fold)
+    for device_folder_path in list_device_folder_paths(user_id):
+        if telemetry is None:
+            cached = device_cache.get(device_folder_path, partial_names)
+        else:
+            with telemetry.phase("cache_get"):
+                cached = device_cache.get(device_folder_path, partial_names)
+        if cached is None:
+            description = device_cache.describe(device_folder_path)
+            with hashing_reads(description[1]):
+                partials = engine.build_device_partials(
+                    build_device_stream(device_folder_path, logs),
+                    user_phrase_fold
+                )
+            device_invalid_timestamps = TIMESTAMP_PARSER.pop_invalid()
+            device_cache.put(
+                device_folder_path,
+                partial_names,
+                partials,
+                device_invalid_timestamps,
+                description
+            )
+        else:
+            partials, device_invalid_timestamps = cached
+        devices_partials.append(partials)
+        invalid_timestamps = merge_invalid_timestamps(
+            invalid_timestamps, device_invalid_timestamps
+        )
+    features = engine.finalize(engine.merge_partials(devices_partials))
+    return features, invalid_timestamps
+
+
+def read_user_status():
+    """
+    Returns :class:`list` of the rows of the user status file, each a
+    :class:`dict` with a `user_id` and a `status`.
+    """
+    with open(DATA_PATH + USER_STATUS_FILE, "r") as csvfile:
+        return list(csv.DictReader(csvfile))
+
+
+def build_user(row, logs=None):
+    """
+    Builds the data structure of a single user from their row in the user
+    status file. If `logs` is given only those logs of each device are read.
+    """
+    return {
+        "user_id": row.get("user_id"),
+        "status": row.get("status"),
+        "devices": build_user_device_data(row.get("user_id"), logs)
+    }
 
 
-def build_users():
+def build_users(
+    logs=None, prefetch_depth=0, prefetch_bytes=DEFAULT_PREFETCH_BYTES
+):
     """
-    Builds the core user data structure from the provided user data.
+    Builds the core user data structure from the provided user data. If
+    `prefetch_depth` is greater than 0, the files of that many users are read
+    ahead of the user being parsed, holding at most `prefetch_bytes` of them.
+
     Returns:
-        :class:`dict` A structure mapping a user ID to the associated data.
+        :class:`OrderedDict` A structure mapping a user ID to the associated
+        data, sorted by user id.
 
     {
         1: {
+            "user_id": 1,
             "status": defaulted,
             "devices": [{
                 "contacts": [...],  # A list of all the users contacts
@@ -159,55 +541,724 @@ def build_users():
         ...
     }
     """
-    users = {}
-    with open(DATA_PATH + USER_STATUS_FILE, "r") as csvfile:
-        user_status_data = list(csv.DictReader(csvfile))
-        num_users = len(user_status_data)
-        if progress_installed:
-            bar = Bar("Reading user file", max=num_users)
-        for row in user_status_data:
-            user_id = row.get("user_id")
-            user = {
-                "status": row.get("status"),
-                "devices": build_user_device_data(user_id)
-            }
-            users[user_id] = user
-            if progress_installed:
+    users = OrderedDict()
+    user_status_data = sorted(read_user_status(), key=user_id_sort_key)
+    num_users = len(user_status_data)
+    bar = progress_bar("Reading user file", num_users)
+    rows = user_status_data
+    if prefetch_depth > 0:
+        rows = start_prefetching(
+            user_status_data, logs, prefetch_depth, prefetch_bytes
+        )
+    try:
+        for row in rows:
+            users[row.get("user_id")] = build_user(row, logs)
+            if bar is not None:
                 bar.next()
-        if progress_installed:
-            bar.finish()
+    finally:
+        stop_prefetching()
+    if bar is not None:
+        bar.finish()
     return users
 
 
-users_features = {}
-users = build_users()
-num_users = len(users)
-if progress_installed:
-    bar = Bar("Generating features", max=num_users)
-possible_features = set(["user_id", "status"])
-for user_id, user_data in users.items():
+def user_id_sort_key(row):
+    """
+    Sorts rows of the user status file numerically by user id where possible.
+    """
+    user_id = row.get("user_id") or ""
+    if user_id.isdigit():
+        return (0, int(user_id), user_id)
+    return (1, 0, user_id)
+
+
+def featurize_user_row(
+    row, cache_dir=None, columnar=False, features=None, telemetry=False,
+    dedup=False, normalize_numbers=False, sketch=False
+):
+    """
+    Reads and builds the features of the user in a row of the user status
+    file. Only the small list of features is returned so it is cheap to send
+    back from a worker process.
+
+    If `cache_dir` is given, the per-device partials are read from and
+    written to a `DeviceCache` in that folder. If `columnar` is True the
+    features are built with the vectorized extractors over columns instead,
+    and `cache_dir` holds a `DeviceColumnsCache` of the columns of each
+    device. If `features` is given only those extractors are run and only the
+    logs they read are opened. If `dedup` is True the user's devices are
+    merged into one device without the records synced across them. If
+    `normalize_numbers` is True addresses with the same canonical phone
+    number count as the same contact. If `sketch` is True the contact
+    features are estimated from fixed size sketches, see
+    `engine.SKETCH_ACCUMULATORS`, and can't be combined with `columnar`.
+
+    Returns:
+        :class:`tuple` of (user_id, status, features, invalid_timestamps,
+        user_telemetry, duplicates) where features is the list of (feature,
+        value) tuples built by the `FeatureEngine`, invalid_timestamps is the
+        (count, examples) of the invalid timestamps in the user's logs,
+        user_telemetry is the :class:`Telemetry` of the user if `telemetry` is
+        True or None and duplicates is the number of duplicate records dropped
+        from each log if `dedup` is True or None.
+    """
+    user_telemetry = None
+    if telemetry:
+        user_telemetry = Telemetry()
+        wall = time.time()
+        cpu = cpu_time()
+    engine = FeatureEngine(
+        features, user_telemetry, normalize_numbers, sketch
+    )
+    logs = required_logs(engine.features)
+    user_phrase_fold = phrase_fold(row.get("user_id"), row.get("status"))
+    duplicates = None
+    if columnar:
+        columns_cache = None
+        if cache_dir is not None:
+            columns_cache = DeviceColumnsCache(cache_dir, DEVICE_DATA_FILES)
+        user_features, invalid_timestamps = build_user_features_columnar(
+            row.get("user_id"), engine.features, user_telemetry, columns_cache,
+            normalize_numbers, user_phrase_fold
+        )
+    elif cache_dir is None:
+        # Each device is streamed through the engine so a user's records are
+        # never all held in memory.
+        devices = [
+            build_device_stream(device_folder_path, logs)
+            for device_folder_path in list_device_folder_paths(
+                row.get("user_id")
+            )
+        ]
+        if dedup:
+            merger = DeviceMerger()
+            devices = [merger.merge(devices)]
+            duplicates = merger.duplicates
+        user_features = engine.build_features({
+            "user_id": row.get("user_id"),
+            "status": row.get("status"),
+            "devices": devices
+        })
+        invalid_timestamps = TIMESTAMP_PARSER.pop_invalid()
+    else:
+        user_features, invalid_timestamps = build_user_features_cached(
+            row.get("user_id"),
+            engine,
+            DeviceCache(cache_dir, [DEVICE_LOG_FILES[log] for log in logs]),
+            user_phrase_fold
+        )
+    if user_telemetry is None:
+        TIMESTAMP_TIMER.reset()
+    else:
+        user_telemetry.add_sampled(
+            "subphases", "parse_timestamps", TIMESTAMP_TIMER
+        )
+        user_telemetry.add_user(
+            row.get("user_id"),
+            time.time() - wall,
+            cpu_time() - cpu,
+            user_telemetry.records()
+        )
+    return (
+        row.get("user_id"),
+        row.get("status"),
+        user_features,
+        invalid_timestamps,
+        user_telemetry,
+        duplicates
+    )
+
+
+def featurize_user_batch(
+    rows, cache_dir=None, features=None, telemetry=False,
+    normalize_numbers=False
+):
+    """
+    Reads and builds the features of the users in a batch of rows of the
+    user status file at once, with the group-by extractors of
+    `batch.BATCH_EXTRACTORS` over tables of all of their records. `cache_dir`,
+    `features` and `normalize_numbers` are used as by `featurize_user_row`
+    with `columnar` True.
+
+    Returns:
+        :class:`list` of the `featurize_user_row` tuple of each user. The
+        :class:`Telemetry` of the batch, if `telemetry` is True, is in the
+        first one.
+    """
+    # numpy is only imported by the runs that need it.
+    from batch import BatchTables, build_features_batch
+    from columnar import AddressTable
+    batch_telemetry = None
+    if telemetry:
+        batch_telemetry = Telemetry()
+    if features is None:
+        features = ALL_FEATURES
+    logs = columns_cache = None
+    if cache_dir is None:
+        logs = required_logs(features)
+    else:
+        columns_cache = DeviceColumnsCache(cache_dir, DEVICE_DATA_FILES)
+    users = []
+    users_invalid_timestamps = []
+    for row in rows:
+        address_table = AddressTable(normalize_numbers)
+        devices, invalid_timestamps = read_user_columns(
+            row.get("user_id"), address_table, logs, batch_telemetry,
+            columns_cache, phrase_fold(row.get("user_id"), row.get("status"))
+        )
+        users.append((devices, address_table))
+        users_invalid_timestamps.append(invalid_timestamps)
+    if batch_telemetry is None:
+        tables = BatchTables(users, normalize_numbers)
+        TIMESTAMP_TIMER.reset()
+    else:
+        with batch_telemetry.phase("batch_tables", len(users)):
+            tables = BatchTables(users, normalize_numbers)
+        batch_telemetry.add_sampled(
+            "subphases", "parse_timestamps", TIMESTAMP_TIMER
+        )
+    # Only the tables are needed from here on.
+    del users
+    users_features = build_features_batch(tables, features, batch_telemetry)
+    if batch_telemetry is not None:
+        batch_telemetry.sample_rss()
+    return [
+        (
+            row.get("user_id"),
+            row.get("status"),
+            user_features,
+            invalid_timestamps,
+            batch_telemetry if index == 0 else None,
+            None
+        )
+        for index, (row, user_features, invalid_timestamps) in enumerate(
+            zip(rows, users_features, users_invalid_timestamps)
+        )
+    ]
+
+
+def merge_user_features(user_id, status, features):
+    """
+    Returns :class:`dict` of every feature of a single user, keyed by the
+    column names of the output file.
+
+    Parameters:
+        features (:class:`list`): The (feature, value) tuples of the user.
+    """
     user_features = {
         "user_id": user_id,
-        "status": user_data.get("status")
+        "status": status
     }
-    for feature in ALL_FEATURES:
-        feature_data = build_feature(feature, user_data)
+    for feature, feature_data in features:
         # Some features return dicts with multiple data points.
         if isinstance(feature_data, dict):
             user_features.update(feature_data)
-            possible_features |= set(feature_data.keys())
         else:
-            user_features[feature] = build_feature(feature, user_data)
-            possible_features.add(feature)
-
-    users_features[user_id] = user_features
-    if progress_installed:
-        bar.next()
-if progress_installed:
-    bar.finish()
-
-with open("feature_data.csv", "w") as csvfile:
-    fieldnames = possible_features
-    writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-    writer.writeheader()
-    writer.writerows(users_features.values())
+            user_features[feature] = feature_data
+    return user_features
+
+
+def build_user_features(user_id, user_data, engine):
+    """
+    Returns :class:`dict` of every feature of a single user, keyed by the
+    column names of the output file.
+    """
+    return merge_user_features(
+        user_id,
+        user_data.get("status"),
+        engine.build_features(user_data)
+    )
+
+
+def new_run_summary():
+    return {
+        "users": 0,
+        "invalid_timestamps": 0,
+        "invalid_timestamp_examples": [],
+        "duplicates": new_duplicates()
+    }
+
+
+def add_invalid_timestamps(run_summary, invalid_timestamps):
+    count, examples = invalid_timestamps
+    run_summary["invalid_timestamps"] += count
+    run_examples = run_summary["invalid_timestamp_examples"]
+    for example in examples:
+        if len(run_examples) < NUM_INVALID_EXAMPLES and (
+            example not in run_examples
+        ):
+            run_examples.append(example)
+
+
+def print_run_summary(run_summary):
+    print("Generated features for {} users.".format(run_summary["users"]))
+    if run_summary["invalid_timestamps"]:
+        print("Received {} invalid timestamps, e.g. {}".format(
+            run_summary["invalid_timestamps"],
+            ", ".join(
+                repr(example)
+                for example in run_summary["invalid_timestamp_examples"]
+            )
+        ))
+    duplicates = run_summary["duplicates"]
+    if any(duplicates.values()):
+        print(
+            "Removed {} calls, {} smss and {} contacts synced across "
+            "devices.".format(
+                duplicates["call_log"],
+                duplicates["sms_log"],
+                duplicates["contacts"]
+            )
+        )
+
+
+def output_fieldnames(features=None, columns=None):
+    """
+    Returns the header of the output file, fixed before any user is built:
+    every column of `features` or, if a subset of `columns` was selected,
+    just those columns.
+    """
+    if columns is None:
+        columns = output_columns(features)
+    return list(ID_COLUMNS) + list(columns)
+
+
+def generate_features_two_phase(
+    output_path, features=None, columns=None, telemetry=None, dedup=False,
+    normalize_numbers=False, output_format=None, prefetch_depth=0,
+    prefetch_bytes=DEFAULT_PREFETCH_BYTES, sketch=False
+):
+    """
+    Reads every user into memory, then builds their features, writing each
+    user's row, sorted by user id, as soon as it is built.
+
+    If `features` is given only those extractors are run, and only the
+    output `columns` are written, as selected by `select_features`. If
+    `telemetry` is given the time spent in each phase and extractor is added
+    to it. If `dedup` is True each user's devices are merged into one device
+    without the records synced across them. If `normalize_numbers` is True
+    addresses with the same canonical phone number count as the same
+    contact. `output_format` is one of `writers.OUTPUT_FORMATS`, by default
+    the format of the extension of `output_path`. If `prefetch_depth` is
+    greater than 0, the files of that many users are read ahead of the user
+    being parsed, holding at most `prefetch_bytes` of them. If `sketch` is
+    True the contact features are estimated from fixed size sketches.
+
+    Returns :class:`dict` summary of the run.
+    """
+    run_summary = new_run_summary()
+    engine = FeatureEngine(features, telemetry, normalize_numbers, sketch)
+    read_users = partial(
+        build_users,
+        required_logs(engine.features),
+        prefetch_depth,
+        prefetch_bytes
+    )
+    if telemetry is None:
+        users = read_users()
+        TIMESTAMP_TIMER.reset()
+    else:
+        with telemetry.phase("read_users"):
+            users = read_users()
+        telemetry.add_sampled("subphases", "parse_timestamps", TIMESTAMP_TIMER)
+    add_invalid_timestamps(run_summary, TIMESTAMP_PARSER.pop_invalid())
+    run_summary["users"] = len(users)
+    num_users = len(users)
+    bar = progress_bar("Generating features", num_users)
+    with open_feature_writer(
+        output_path, output_fieldnames(features, columns), output_format
+    ) as writer:
+        for user_id, user_data in users.items():
+            if telemetry is not None:
+                wall = time.time()
+                cpu = cpu_time()
+                records = telemetry.records()
+            if dedup:
+                merger = DeviceMerger()
+                user_data = {
+                    "user_id": user_id,
+                    "status": user_data.get("status"),
+                    "devices": [merger.merge(user_data.get("devices", []))]
+                }
+            user_features = build_user_features(user_id, user_data, engine)
+            if dedup:
+                add_duplicates(run_summary["duplicates"], merger.duplicates)
+            if telemetry is not None:
+                telemetry.add_user(
+                    user_id,
+                    time.time() - wall,
+                    cpu_time() - cpu,
+                    telemetry.records() - records
+                )
+                wall = time.time()
+                cpu = cpu_time()
+            writer.write_row(user_features)
+            if telemetry is not None:
+                telemetry.add(
+                    "phases", "write", time.time() - wall, cpu_time() - cpu, 1,
+                    rss=False
+                )
+            if bar is not None:
+                bar.next()
+    if bar is not None:
+        bar.finish()
+    return run_summary
+
+
+def generate_features_streaming(
+    output_path, workers=1, cache_dir=None, columnar=False, features=None,
+    columns=None, telemetry=None, dedup=False, normalize_numbers=False,
+    output_format=None, prefetch_depth=0,
+    prefetch_bytes=DEFAULT_PREFETCH_BYTES, sketch=False, batch_users=0
+):
+    """
+    Reads, builds the features of and writes one user at a time, dropping
+    each user's data before moving on to the next so peak memory is bounded
+    by the largest single user rather than the whole data set.
+
+    If `workers` is greater than 1 the users are spread across a pool of that
+    many processes. Each worker reads and featurizes whole users and only
+    sends back their features.
+
+    If `cache_dir` is given, only the devices whose data files changed since
+    the last run with the same `cache_dir` are read and aggregated. If
+    `columnar` is True the features are built with NumPy reductions over a
+    columnar copy of each device's records, which are cached as binary files
+    in `cache_dir` if it is given. If `features` is given only those
+    extractors are run, and only the output `columns` are written, as
+    selected by `select_features`. If `telemetry` is given the time spent in
+    each phase and extractor, in any of the processes, is added to it. If
+    `dedup` is True each user's devices are merged into one device without
+    the records synced across them, which can't be combined with `cache_dir`
+    or `columnar` since those build each device on its own. If
+    `normalize_numbers` is True addresses with the same canonical phone
+    number count as the same contact. `output_format` is one of
+    `writers.OUTPUT_FORMATS`, by default the format of the extension of
+    `output_path`. If `sketch` is True the contact features are estimated
+    from fixed size sketches, which can't be combined with `columnar`.
+
+    If `batch_users` is greater than 0 the features of that many users at a
+    time are built with the group-by extractors of `batch.py` over the
+    columns of all of their devices, which can be cached in `cache_dir` as
+    with `columnar`, and can't be combined with `dedup` or `sketch`. Peak
+    memory is then bounded by the columns of a batch.
+
+    If `prefetch_depth` is greater than 0 and there is a single worker and
+    no `cache_dir` or `batch_users`, the files of that many users past the
+    current one are read on background threads while the current user is
+    featurized, holding at most `prefetch_bytes` of them, so reading overlaps
+    with building the features.
+
+    The columns of the file are fixed by the extractors' metadata, so the
+    header is written before the first user is built and each row as soon
+    as its user is. Rows are always written sorted by user id, no matter how
+    many workers are used.
+
+    Returns :class:`dict` summary of the run.
+    """
+    user_status_data = sorted(read_user_status(), key=user_id_sort_key)
+    bar = progress_bar("Generating features", len(user_status_data))
+    if batch_users > 0:
+        featurize = partial(
+            featurize_user_batch,
+            cache_dir=cache_dir,
+            features=features,
+            telemetry=telemetry is not None,
+            normalize_numbers=normalize_numbers
+        )
+        batches = [
+            user_status_data[start:start + batch_users]
+            for start in range(0, len(user_status_data), batch_users)
+        ]
+    else:
+        featurize = partial(
+            featurize_user_row,
+            cache_dir=cache_dir,
+            columnar=columnar,
+            features=features,
+            telemetry=telemetry is not None,
+            dedup=dedup,
+            normalize_numbers=normalize_numbers,
+            sketch=sketch
+        )
+    pool = None
+    if batch_users > 0:
+        if workers > 1:
+            from multiprocessing import Pool
+            pool = Pool(workers)
+            results = pool.imap(featurize, batches)
+        else:
+            results = imap(featurize, batches)
+        results = chain.from_iterable(results)
+    elif workers > 1:
+        from multiprocessing import Pool
+        pool = Pool(workers)
+        # Send the users in chunks to save a round trip per user, small
+        # enough that each worker still gets a few chunks to balance them.
+        chunksize = max(
+            1, min(POOL_CHUNKSIZE, len(user_status_data) // (workers * 4))
+        )
+        results = pool.imap(featurize, user_status_data, chunksize)
+    else:
+        rows = user_status_data
+        if prefetch_depth > 0 and cache_dir is None:
+            rows = start_prefetching(
+                user_status_data,
+                required_logs(ALL_FEATURES if features is None else features),
+                prefetch_depth,
+                prefetch_bytes
+            )
+        results = imap(featurize, rows)
+    run_summary = new_run_summary()
+    try:
+        with open_feature_writer(
+            output_path, output_fieldnames(features, columns), output_format
+        ) as writer:
+            for (
+                user_id, status, user_values, invalid_timestamps,
+                user_telemetry, duplicates
+            ) in results:
+                run_summary["users"] += 1
+                add_invalid_timestamps(run_summary, invalid_timestamps)
+                if duplicates is not None:
+                    add_duplicates(run_summary["duplicates"], duplicates)
+                if user_telemetry is not None:
+                    telemetry.merge(user_telemetry)
+                if telemetry is not None:
+                    wall = time.time()
+                    cpu = cpu_time()
+                user_features = merge_user_features(
+                    user_id, status, user_values
+                )
+                writer.write_row(user_features)
+                if telemetry is not None:
+                    telemetry.add(
+                        "phases", "write", time.time() - wall,
+                        cpu_time() - cpu, 1, rss=False
+                    )
+                if bar is not None:
+                    bar.next()
+    except:
+        if pool is not None:
+            pool.terminate()
+        raise
+    finally:
+        stop_prefetching()
+    if pool is not None:
+        pool.close()
+        pool.join()
+    if bar is not None:
+        bar.finish()
+    return run_summary
+
+
+def columnar_installed():
+    """
+    Returns whether numpy, which `--columnar` and `--batch` need, is
+    installed.
+    """
+    from columnar import numpy_installed
+    return numpy_installed
+
+
+def telemetry_report_path(output_path):
+    """
+    Returns the path of the telemetry report of a run, next to its output
+    file, e.g. feature_data.telemetry.json.
+    """
+    return splitext(output_path)[0] + ".telemetry.json"
+
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    parser = argparse.ArgumentParser(
+        description="Generate feature data from users phone information."
+    )
+    parser.add_argument(
+        "--output", default=OUTPUT_FILE,
+        help="The file to write the features to. Defaults to {}.".format(
+            OUTPUT_FILE
+        )
+    )
+    parser.add_argument(
+        "--output-format", choices=sorted(OUTPUT_FORMATS),
+        help="The format of the output file. Parquet and arrow, an Arrow IPC "
+        "stream, require pyarrow. Defaults to the format of the extension of "
+        "--output, or csv."
+    )
+    parser.add_argument(
+        "--two-phase", action="store_true",
+        help="Read every user into memory before building any features, "
+        "instead of streaming one user at a time."
+    )
+    parser.add_argument(
+        "--workers", type=int, default=1,
+        help="The number of processes to spread the users across. Defaults "
+        "to 1."
+    )
+    parser.add_argument(
+        "--cache-dir",
+        help="A folder to cache the partial aggregates of each device in, or "
+        "with --columnar the parsed columns of each device. Reruns with the "
+        "same folder only read the devices that changed."
+    )
+    parser.add_argument(
+        "--columnar", action="store_true",
+        help="Build the features with NumPy over a compact columnar copy of "
+        "each device's records. Requires numpy."
+    )
+    parser.add_argument(
+        "--batch", action="store_true",
+        help="Build the features of --batch-users users at a time with NumPy "
+        "group-by reductions over tables of all of their records, instead of "
+        "one user at a time. With --cache-dir the columns of each device are "
+        "cached as with --columnar. Requires numpy."
+    )
+    parser.add_argument(
+        "--batch-users", type=int, default=DEFAULT_BATCH_USERS,
+        help="The number of users built at once with --batch. Defaults to "
+        "{}.".format(DEFAULT_BATCH_USERS)
+    )
+    parser.add_argument(
+        "--features",
+        help="A comma separated list of the output columns or feature "
+        "extractors to build, e.g. calls,ave_daily_sms. Only the extractors "
+        "and logs they need are run and read. Defaults to every feature."
+    )
+    parser.add_argument(
+        "--list-features", action="store_true",
+        help="List the feature extractors and their output columns and exit."
+    )
+    parser.add_argument(
+        "--dedup-devices", action="store_true",
+        help="Merge each user's devices into one, dropping the calls, smss "
+        "and contacts synced across them. Can not be used with --cache-dir "
+        "or --columnar."
+    )
+    parser.add_argument(
+        "--normalize-numbers", action="store_true",
+        help="Count the addresses with the same phone number, e.g. "
+        "0712345678 and +254 712 345 678, as the same contact."
+    )
+    parser.add_argument(
+        "--sketch", action="store_true",
+        help="Estimate the contacts interacted with, overall and per day, and "
+        "the most contacted numbers from fixed size sketches instead of exact "
+        "sets, so memory does not grow with a user's contacts. Can not be "
+        "used with --columnar."
+    )
+    parser.add_argument(
+        "--prefetch-depth", type=int, default=DEFAULT_PREFETCH_DEPTH,
+        help="The number of users past the current one whose files are read "
+        "ahead on background threads, so slow storage is read while features "
+        "are built. 0 disables it. Not used with --workers or --cache-dir. "
+        "Defaults to {}.".format(DEFAULT_PREFETCH_DEPTH)
+    )
+    parser.add_argument(
+        "--prefetch-mb", type=int, default=DEFAULT_PREFETCH_BYTES >> 20,
+        help="The most MB of files read ahead and held in memory at once. "
+        "Defaults to {}.".format(DEFAULT_PREFETCH_BYTES >> 20)
+    )
+    parser.add_argument(
+        "--no-telemetry", action="store_true",
+        help="Do not write the timing report of the run next to the output "
+        "file."
+    )
+    args = parser.parse_args(argv)
+    if args.list_features:
+        for feature in sorted(FEATURE_METADATA):
+            print("{}: {}".format(
+                feature, ", ".join(feature_columns(feature))
+            ))
+        return
+    features = columns = None
+    if args.features:
+        try:
+            features, columns = select_features([
+                name.strip() for name in args.features.split(",")
+                if name.strip()
+            ])
+        except ValueError as e:
+            parser.error(str(e))
+    if args.columnar and not columnar_installed():
+        parser.error("--columnar requires numpy, `pip install numpy`")
+    if args.batch and not columnar_installed():
+        parser.error("--batch requires numpy, `pip install numpy`")
+    if args.batch and args.batch_users < 1:
+        parser.error("--batch-users must be at least 1")
+    if args.batch and (args.dedup_devices or args.sketch):
+        parser.error(
+            "--dedup-devices and --sketch can not be used with --batch"
+        )
+    if args.dedup_devices and (args.cache_dir or args.columnar):
+        parser.error(
+            "--cache-dir and --columnar can not be used with --dedup-devices"
+        )
+    if args.sketch and args.columnar:
+        parser.error("--columnar can not be used with --sketch")
+    try:
+        check_output_format(args.output, args.output_format)
+    except ValueError as e:
+        parser.error(str(e))
+    telemetry = None
+    if not args.no_telemetry:
+        telemetry = Telemetry()
+    wall = time.time()
+    cpu = cpu_time()
+    if args.two_phase:
+        if args.workers > 1 or args.cache_dir or args.columnar or args.batch:
+            parser.error(
+                "--workers, --cache-dir, --columnar and --batch can not be "
+                "used with --two-phase"
+            )
+        run_summary = generate_features_two_phase(
+            args.output,
+            features=features,
+            columns=columns,
+            telemetry=telemetry,
+            dedup=args.dedup_devices,
+            normalize_numbers=args.normalize_numbers,
+            output_format=args.output_format,
+            prefetch_depth=args.prefetch_depth,
+            prefetch_bytes=args.prefetch_mb << 20,
+            sketch=args.sketch
+        )
+    else:
+        run_summary = generate_features_streaming(
+            args.output,
+            workers=args.workers,
+            cache_dir=args.cache_dir,
+            columnar=args.columnar,
+            features=features,
+            columns=columns,
+            telemetry=telemetry,
+            dedup=args.dedup_devices,
+            normalize_numbers=args.normalize_numbers,
+            output_format=args.output_format,
+            prefetch_depth=args.prefetch_depth,
+            prefetch_bytes=args.prefetch_mb << 20,
+            sketch=args.sketch,
+            batch_users=args.batch_users if args.batch else 0
+        )
+    print_run_summary(run_summary)
+    if telemetry is not None:
+        report_path = telemetry_report_path(args.output)
+        telemetry.write_report(
+            report_path,
+            argv=argv,
+            users=run_summary["users"],
+            duplicates=run_summary["duplicates"],
+            wall_s=time.time() - wall,
+            # Only the main process' CPU time, the workers' is in the phases.
+            cpu_s=cpu_time() - cpu,
+            peak_rss_kb=peak_rss_kb(),
+            workers_peak_rss_kb=(
+                peak_rss_kb(RUSAGE_CHILDREN) if args.workers > 1 else None
+            )
+        )
+        print("Wrote the run telemetry to {}.".format(report_path))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+"""
+An incremental reader for files holding one top-level JSON array.
+
+`iter_json_array` yields the elements of the array one at a time while only
+holding a block of the file's text in memory, so even the largest sms logs
+are read in constant memory. Malformed data is reported with the byte offset
+it was found at instead of failing silently.
+
+An element that fails to decode is only read further if its strings and
+brackets run past the end of the buffer, and then at least as much again of
+the file is read before decoding it again, so a large element is decoded a
+logarithmic number of times. An element that ends within the buffer and still
+fails to decode is malformed and fails at once.
+"""
+import json
+import re
+
+
+BLOCK_SIZE = 1 << 16
+# Elements larger than this are treated as malformed rather than reading the
+# rest of the file into memory looking for their end.
+MAX_ELEMENT_SIZE = 1 << 26
+WHITESPACE = " \t\n\r"
+NUMBER_CHARS = "0123456789+-.eE"
+NUMBER_TYPES = (int, long, float)
+# The characters that start or end an element, and the rest of a string
+# after its opening quote.
+STRUCTURE_RE = re.compile(r'["\[\]{},]')
+STRING_END_RE = re.compile(r'[^"\\]*(?:\\.[^"\\]*)*"', re.DOTALL)
+
+
+class JsonStreamError(ValueError):
+    """
+    Raised when the file is not a well formed JSON array.
+
+    Attributes:
+        offset (:class:`int`): The byte offset of the malformed data.
+    """
+    def __init__(self, message, offset):
+        super(JsonStreamError, self).__init__(
+            "{} at byte {}".format(message, offset)
+        )
+        self.offset = offset
+
+
+class _Buffer(object):
+    """
+    A sliding window over a file, tracking the byte offset of its start.
+    """
+    def __init__(self, json_file, block_size):
+        self.json_file = json_file
+        self.block_size = block_size
+        self.text = ""
+        self.pos = 0
+        self.base_offset = 0
+        self.eof = False
+
+    @property
+    def offset(self):
+        return self.base_offset + self.pos
+
+    def read_more(self, min_size=0):
+        """
+        Reads the next blocks of the file, at least `min_size` bytes of them
+        unless the file ends first, and joins them to the unconsumed text at
+        once. Returns False at the end of the file.
+        """
+        if self.eof:
+            return False
+        blocks = []
+        size = 0
+        while not blocks or size < min_size:
+            block = self.json_file.read(self.block_size)
+            if not block:
+                self.eof = True
+                break
+            blocks.append(block)
+            size += len(block)
+        if not blocks:
+            return False
+        # Drop the text that has already been consumed.
+        self.base_offset += self.pos
+        blocks.insert(0, self.text[self.pos:])
+        self.text = "".join(blocks)
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """
+        Skips whitespace and returns the next character or "" at the end of
+        the file.
+        """
+        while True:
+            text = self.text
+            pos = self.pos
+            while pos < len(text) and text[pos] in WHITESPACE:
+                pos += 1
+            self.pos = pos
+            if pos < len(text):
+                return text[pos]
+            if not self.read_more():
+                return ""
+
+
+def element_is_complete(text, pos):
+    """
+    Returns whether the element starting at `pos` ends before the end of
+    `text`, going by its strings and brackets alone, i.e. whether an error
+    decoding it comes from malformed data rather than from the text ending.
+    """
+    depth = 0
+    while True:
+        match = STRUCTURE_RE.search(text, pos)
+        if match is None:
+            return False
+        char = match.group()
+        pos = match.end()
+        if char == '"':
+            match = STRING_END_RE.match(text, pos)
+            if match is None:
+                return False
+            pos = match.end()
+        elif char in "[{":
+            depth += 1
+        elif char in "]}":
+            depth -= 1
+            if depth <= 0:
+                return True
+        elif depth == 0:
+            return True
+
+
+def iter_json_array(json_file, block_size=BLOCK_SIZE):
+    """
+    Yields the elements of the top-level JSON array in `json_file`.
+
+    Parameters:
+        json_file (:class:`file`): A file opened in binary mode.
+        block_size (:class:`int`): The number of bytes to read at a time.
+
+    Raises:
+        JsonStreamError if the file is not a well formed JSON array. Every
+            element before the malformed data has already been yielded.
+    """
+    decoder = json.JSONDecoder()
+    buf = _Buffer(json_file, block_size)
+    if buf.peek() != "[":
+        raise JsonStreamError("Expected a JSON array", buf.offset)
+    buf.pos += 1
+    if buf.peek() == "]":
+        buf.pos += 1
+    else:
+        while True:
+            if buf.peek() == "":
+                raise JsonStreamError("Unexpected end of file", buf.offset)
+            while True:
+                try:
+                    element, end = decoder.raw_decode(buf.text, buf.pos)
+                except ValueError:
+                    # The element may continue in the next blocks, read as
+                    # many of them as it is long so far.
+                    size = len(buf.text) - buf.pos
+                    if (
+                        size <= MAX_ELEMENT_SIZE and
+                        not element_is_complete(buf.text, buf.pos) and
+                        buf.read_more(size)
+                    ):
+                        continue
+                    raise JsonStreamError("Malformed element", buf.offset)
+                if (
+                    isinstance(element, NUMBER_TYPES) and
+                    not isinstance(element, bool) and
+                    not buf.text[end:].strip(NUMBER_CHARS) and
+                    buf.read_more()
+                ):
+                    # A number may continue in the next block, e.g. "1|.5".
+                    continue
+                break
+            buf.pos = end
+            yield element
+            separator = buf.peek()
+            if separator == ",":
+                buf.pos += 1
+            elif separator == "]":
+                buf.pos += 1
+                break
+            elif separator == "":
+                raise JsonStreamError("Unexpected end of file", buf.offset)
+            else:
+                raise JsonStreamError(
+                    "Expected ',' or ']' after element", buf.offset
+                )
+    if buf.peek() != "":
+        raise JsonStreamError("Trailing data after JSON array", buf.offset)
@@ -0,0 +1,205 @@
+"""
+Normalization, classification and interning of the phone numbers and sms
+addresses found in the logs.
+
+The same number is written in many ways across the logs of a user's devices,
+e.g. "+254 712-345 678" in the contacts, "0712345678" in the call log and
+"254712345678" in the sms log. `canonical_phone_number` rewrites them all to
+"+254712345678", assuming numbers without a country code are from
+`HOME_COUNTRY_CODE`.
+
+Each address is also classified as exactly one of:
+ - `USSD`: codes like "*144#",
+ - `SHORT_CODE`: service numbers of up to `SHORT_CODE_MAX_LENGTH` digits and
+    named senders like "MPESA",
+ - `INTERNATIONAL`: numbers with a country code other than the home one,
+ - `LOCAL`: every other number.
+
+A :class:`PhoneNumberTable` interns a user's addresses into integer ids so
+each distinct address is lowercased, normalized and classified once per user
+rather than once per record, and the extractors work on ints and precomputed
+flags.
+"""
+import re
+
+
+# Formatting characters that never change which number is dialed.
+PHONE_NUMBER_FORMATTING_RE = re.compile(r"[\s\-.()/]+", re.UNICODE)
+# The users are in Kenya, numbers without a country code are Kenyan.
+HOME_COUNTRY_CODE = "254"
+# The number of digits of a national number, without the trunk prefix "0".
+NATIONAL_NUMBER_LENGTH = 9
+SHORT_CODE_MAX_LENGTH = 6
+
+# The flags of an address, combined into a bit mask.
+HAS_POUND = 1
+HAS_STAR = 2
+USSD = 4
+SHORT_CODE = 8
+INTERNATIONAL = 16
+LOCAL = 32
+SYMBOL_FLAGS = {"#": HAS_POUND, "*": HAS_STAR}
+
+
+def normalize_phone_number(address):
+    """
+    Returns `address` lowercased, since sms addresses can be sender names
+    like "MPESA", with its spaces, dashes, dots, slashes and parentheses
+    removed, or "" if there is no address.
+    """
+    if not address:
+        return ""
+    if address.isdigit():
+        return address
+    return PHONE_NUMBER_FORMATTING_RE.sub("", address).lower()
+
+
+def canonical_phone_number(address, country_code=HOME_COUNTRY_CODE):
+    """
+    Returns the normalized `address` with numbers written with a trunk
+    prefix ("0712345678"), a bare country code ("254712345678"), an
+    international prefix ("00254712345678") or no prefix at all
+    ("712345678") rewritten with a "+" and their country code, e.g.
+    "+254712345678". Other addresses are returned normalized. The result is
+    only "" if there is no address.
+    """
+    number = normalize_phone_number(address)
+    if not number:
+        # Only formatting characters, keep them so the address still counts.
+        return (address or "").lower()
+    if number.startswith("00"):
+        number = "+" + number[2:]
+    if number.startswith("+"):
+        trunk_prefix = "+" + country_code + "0"
+        if (
+            number.startswith(trunk_prefix) and
+            len(number) == len(trunk_prefix) + NATIONAL_NUMBER_LENGTH
+        ):
+            # "+2540712345678" is a common mix of both prefixes.
+            return "+" + country_code + number[len(trunk_prefix):]
+        return number
+    if not number.isdigit():
+        return number
+    if len(number) == NATIONAL_NUMBER_LENGTH + 1 and number.startswith("0"):
+        return "+" + country_code + number[1:]
+    if (
+        len(number) == len(country_code) + NATIONAL_NUMBER_LENGTH and
+        number.startswith(country_code)
+    ):
+        return "+" + number
+    if len(number) == NATIONAL_NUMBER_LENGTH:
+        return "+" + country_code + number
+    return number
+
+
+def phone_number_flags(address, number=None, country_code=HOME_COUNTRY_CODE):
+    """
+    Returns the bit mask of the flags of an address: `HAS_POUND` and
+    `HAS_STAR` if it contains "#" or "*", and its kind, one of `USSD`,
+    `SHORT_CODE`, `INTERNATIONAL` or `LOCAL`. An empty address has no flags.
+    `number` is the `canonical_phone_number` of the address, if it is already
+    known.
+    """
+    if not address:
+        return 0
+    flags = 0
+    for symbol, flag in SYMBOL_FLAGS.items():
+        if symbol in address:
+            flags |= flag
+    if flags:
+        return flags | USSD
+    if number is None:
+        number = canonical_phone_number(address, country_code)
+    if number.startswith("+") and number[1:].isdigit():
+        if number.startswith("+" + country_code):
+            return LOCAL
+        return INTERNATIONAL
+    if not number.isdigit() or len(number) <= SHORT_CODE_MAX_LENGTH:
+        return SHORT_CODE
+    return LOCAL
+
+
+class PhoneNumberTable(object):
+    """
+    Interns the addresses of a user's calls and smss into integer ids. The
+    raw addresses map to the id of their lowercased form, so "MPESA" and
+    "mpesa" share an id, and id 0 is the empty address.
+
+    Parameters:
+        normalize (:class:`bool`): Whether the features that compare
+            addresses should compare their canonical numbers, so "0712..."
+            and "+254712..." are the same contact, instead of their
+            lowercased form.
+
+    Attributes:
+        addresses (:class:`list`): The lowercased address of each id.
+        flags (:class:`list`): The `phone_number_flags` of each id.
+        number_ids (:class:`list`): The id of the first address with the same
+            canonical number as each id.
+        numbers (:class:`list`): The canonical number of each id.
+    """
+    def __init__(self, normalize=False):
+        self.normalize = normalize
+        self.ids = {None: 0, "": 0}
+        self.address_ids = {"": 0}
+        self.addresses = [""]
+        self.flags = [0]
+        self.number_ids = [0]
+        self.numbers = [""]
+        self._numbers = {"": 0}
+
+    def intern(self, address):
+        """
+        Returns the id of a raw address.
+        """
+        address_id = self.ids.get(address)
+        if address_id is None:
+            address_id = self.ids[address] = self.intern_lowercased(
+                address.lower()
+            )
+        return address_id
+
+    def intern_lowercased(self, address):
+        """
+        Returns the id of an address that is already lowercased, e.g. an
+        address of another table.
+        """
+        address_id = self.address_ids.get(address)
+        if address_id is None:
+            address_id = self.address_ids[address] = len(self.addresses)
+            number = canonical_phone_number(address)
+            self.addresses.append(address)
+            self.flags.append(phone_number_flags(address, number))
+            self.number_ids.append(
+                self._numbers.setdefault(number, address_id)
+            )
+            self.numbers.append(number)
+        return address_id
+
+    def translation(self, other):
+        """
+        Returns :class:`list` mapping each id of the `other` table to the id
+        of the same address in this table.
+        """
+        if other is self:
+            return range(len(self.addresses))
+        return [self.intern_lowercased(address) for address in other.addresses]
+
+    def contact_ids(self):
+        """
+        Returns the list mapping each id to the id it is compared as: its
+        canonical number's if `normalize` is True, or itself.
+        """
+        if self.normalize:
+            return self.number_ids
+        return range(len(self.addresses))
+
+    def contact_keys(self):
+        """
+        Returns the list mapping each id to the string it is compared as
+        across tables, e.g. by the sketches of another device: its canonical
+        number if `normalize` is True, or its lowercased address.
+        """
+        if self.normalize:
+            return self.numbers
+        return self.addresses
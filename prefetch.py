@@ -0,0 +1,248 @@
+"""
+Reads the data files of the next users ahead of time, on a pool of threads,
+while the features of the current user are built.
+
+On network mounted storage every file a user's devices hold costs a round
+trip before a byte of it is parsed, and reading the files one after another
+leaves the CPU idle for all of them. A :class:`Prefetcher` walks the users in
+the order they are featurized and reads the files of up to `depth` users past
+the current one into memory in the background. When the reader of a file
+asks for it with `Prefetcher.open`, it gets the bytes already read, or waits
+for the read in flight, so a run takes about as long as the larger of its
+I/O and its CPU time rather than their sum.
+
+The files held in memory, read or in flight, never add up to more than
+`max_bytes`. Files larger than that are left to be streamed from disk, and
+the files of users that were moved past without being read are dropped, once
+their read is over. An error on the thread scheduling the reads, e.g. listing
+a user's files, is raised again when the iteration over the users gets to the
+user it was raised for.
+"""
+import sys
+import threading
+from io import BytesIO
+from os.path import getsize
+from Queue import Queue
+
+
+# The number of users past the current one whose files are read ahead.
+DEFAULT_PREFETCH_DEPTH = 2
+# The most bytes of files held in memory at once, read or in flight.
+DEFAULT_PREFETCH_BYTES = 256 << 20
+PREFETCH_THREADS = 4
+
+
+def read_file_bytes(file_path):
+    with open(file_path, "rb") as data_file:
+        return data_file.read()
+
+
+class _Entry(object):
+    """
+    A file scheduled to be read, for the item at `index`. It is `dropped` if
+    its item was moved past while it was being read, so its reader releases
+    it.
+    """
+    __slots__ = ("index", "size", "data", "done", "dropped")
+
+    def __init__(self, index, size):
+        self.index = index
+        self.size = size
+        self.data = None
+        self.done = threading.Event()
+        self.dropped = False
+
+
+class Prefetcher(object):
+    """
+    Iterates over a list of items, e.g. the rows of the user status file,
+    reading the files of the next items in the background.
+
+    Parameters:
+        items (:class:`list`): The items, in the order they are consumed.
+        item_files (callable): Returns the paths of the files of an item.
+            It is called on a background thread.
+        depth (:class:`int`): The number of items past the current one whose
+            files are read ahead.
+        max_bytes (:class:`int`): The most bytes of files held at once.
+        threads (:class:`int`): The number of files read at once.
+        read (callable): Returns the bytes of a file.
+
+    Attributes:
+        hits (:class:`int`): The number of files opened from memory.
+        misses (:class:`int`): The number of files that were not read ahead.
+        error (:class:`tuple`): The index of the item and the `sys.exc_info`
+            of the exception that stopped the scheduling thread, raised
+            again by `__iter__` at that item, or None.
+    """
+    def __init__(
+        self, items, item_files, depth=DEFAULT_PREFETCH_DEPTH,
+        max_bytes=DEFAULT_PREFETCH_BYTES, threads=PREFETCH_THREADS,
+        read=read_file_bytes
+    ):
+        self.items = list(items)
+        self.item_files = item_files
+        self.depth = depth
+        self.max_bytes = max_bytes
+        self.read = read
+        self.hits = 0
+        self.misses = 0
+        # The index of the item being consumed, the files read ahead, keyed
+        # by path, and the files of the item opened before they were.
+        self.position = 0
+        self.entries = {}
+        self.missed = set()
+        self.held_bytes = 0
+        self.closed = False
+        self.error = None
+        self._scheduling = 0
+        self.condition = threading.Condition()
+        self.tasks = Queue()
+        self.threads = [threading.Thread(target=self._schedule)] + [
+            threading.Thread(target=self._read_files) for _ in range(threads)
+        ]
+        for thread in self.threads:
+            # Never keep the process alive, e.g. after an exception.
+            thread.daemon = True
+            thread.start()
+
+    def _wait_for_room(self, index, size):
+        """
+        Waits until the file of the item at `index` fits in the budget.
+        Returns False if it never will.
+        """
+        with self.condition:
+            while not self.closed and index >= self.position and (
+                self.held_bytes + size > self.max_bytes
+            ):
+                self.condition.wait()
+            return not self.closed and index >= self.position
+
+    def _schedule(self):
+        try:
+            self._schedule_items()
+        except Exception:
+            # Without the thread every later file would be read without
+            # prefetching, so the error is raised again by `__iter__`.
+            with self.condition:
+                self.error = (self._scheduling, sys.exc_info())
+
+    def _schedule_items(self):
+        for index, item in enumerate(self.items):
+            self._scheduling = index
+            with self.condition:
+                while not self.closed and index > self.position + self.depth:
+                    self.condition.wait()
+                if self.closed:
+                    break
+            for file_path in self.item_files(item):
+                try:
+                    size = getsize(file_path)
+                except OSError:
+                    # Missing files are reported by their reader.
+                    continue
+                if size > self.max_bytes:
+                    continue
+                if not self._wait_for_room(index, size):
+                    break
+                entry = _Entry(index, size)
+                with self.condition:
+                    if file_path in self.missed:
+                        continue
+                    self.entries[file_path] = entry
+                    self.held_bytes += size
+                self.tasks.put((file_path, entry))
+
+    def _read_files(self):
+        while True:
+            task = self.tasks.get()
+            if task is None:
+                return
+            file_path, entry = task
+            try:
+                data = self.read(file_path)
+            except (IOError, OSError):
+                # Left to the reader, which reports the error.
+                data = None
+            with self.condition:
+                entry.done.set()
+                if entry.dropped:
+                    # `advance` left the bytes to be released once read,
+                    # unless `close` already dropped every file.
+                    if not self.closed:
+                        self._release(entry)
+                else:
+                    entry.data = data
+
+    def _release(self, entry):
+        self.held_bytes -= entry.size
+        self.condition.notify_all()
+
+    def open(self, file_path):
+        """
+        Returns a file object over the bytes of `file_path` if it was read
+        ahead, waiting for the read if it is in flight, or None.
+        """
+        with self.condition:
+            entry = self.entries.pop(file_path, None)
+            if entry is None:
+                self.misses += 1
+                self.missed.add(file_path)
+                return None
+        entry.done.wait()
+        with self.condition:
+            self._release(entry)
+            if entry.data is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return BytesIO(entry.data)
+
+    def advance(self, position):
+        """
+        Moves the current item to `position`, dropping the files of the
+        items before it that were never opened. The bytes of a file still
+        being read are only released by its reader, once they are read.
+        """
+        with self.condition:
+            self.position = position
+            self.missed = set()
+            for file_path, entry in self.entries.items():
+                if entry.index < position:
+                    del self.entries[file_path]
+                    if entry.done.is_set():
+                        self._release(entry)
+                    else:
+                        entry.dropped = True
+            self.condition.notify_all()
+
+    def _raise_error(self, index):
+        """
+        Raises the error of the scheduling thread if it was raised for an
+        item up to `index`.
+        """
+        with self.condition:
+            error = self.error
+        if error is not None and error[0] <= index:
+            exc_type, exc_value, exc_traceback = error[1]
+            raise exc_type, exc_value, exc_traceback
+
+    def __iter__(self):
+        for index, item in enumerate(self.items):
+            self.advance(index)
+            self._raise_error(index)
+            yield item
+        self.advance(len(self.items))
+        self._raise_error(len(self.items))
+
+    def close(self):
+        """
+        Stops reading ahead and drops the files read so far.
+        """
+        with self.condition:
+            self.closed = True
+            self.entries = {}
+            self.held_bytes = 0
+            self.condition.notify_all()
+        for _ in self.threads[1:]:
+            self.tasks.put(None)
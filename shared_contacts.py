@@ -0,0 +1,434 @@
+"""
+Builds the contacts each user shares with users who defaulted or repaid,
+across the whole corpus.
+
+Comparing every pair of users' contact lists is quadratic. Instead each
+user's phone numbers, from their contacts and the addresses of their calls
+and smss, are normalized with `phone.canonical_phone_number` and hashed to
+int64s by `number_hash`, the same in every process, run and platform, and
+an inverted index from each number to the users who have it is
+built with NumPy. The index only needs, for each number, how many users of
+each fold and label have it, so every user's features are then a lookup per
+number: the whole stage is near linear in the number of (user, number)
+pairs.
+
+To fit millions of users and tens of millions of numbers in memory, the
+pairs are spilled to disk in `num_shards` shards by the hash of the number
+while the users are read, and each shard is indexed on its own, so only one
+shard's pairs are in memory at a time. Short codes and USSD codes, which
+everyone shares, are left out.
+
+Labels would leak if a user's features counted their own label, or the
+labels of users trained on together with them. Each user is assigned a fold
+by the hash of their user id, and a labeled user only counts the labeled
+users of the other folds, so train models with the same folds, e.g. with the
+`fold` column of the output. Unlabeled users, e.g. new applicants, count
+every labeled user.
+
+To run, after `generate_features.py` with the same `DATA_PATH`:
+```
+python shared_contacts.py --output shared_contact_features.csv
+```
+The output has a row per user with their `user_id`, `status`, `fold` and
+`SHARED_CONTACT_COLUMNS`, to be joined with `feature_data.csv`.
+
+NumPy is needed to run this module. To install it:
+```
+pip install numpy
+```
+"""
+import argparse
+import hashlib
+import shutil
+import struct
+import tempfile
+from itertools import imap
+from multiprocessing import Pool
+from os.path import join
+import generate_features
+from phone import (
+    INTERNATIONAL, LOCAL, canonical_phone_number, phone_number_flags
+)
+from prefetch import DEFAULT_PREFETCH_DEPTH
+from utils import LABELS, NUM_FOLDS, ave_or_none, user_fold
+from writers import (
+    ID_COLUMNS, OUTPUT_FORMATS, check_output_format, open_feature_writer
+)
+numpy_installed = False
+try:
+    import numpy as np
+    numpy_installed = True
+except ImportError:
+    pass
+
+
+OUTPUT_FILE = "shared_contact_features.csv"
+NUM_SHARDS = 64
+# The number of (user, number) pairs buffered before they are spilled.
+SPILL_PAIRS = 1 << 20
+# The kinds of address that are a person's number rather than a service's.
+PERSONAL_NUMBER_FLAGS = LOCAL | INTERNATIONAL
+# The data files of a device and the field of their records holding an
+# address or, for contacts, a list of them.
+ADDRESS_FIELDS = (
+    (generate_features.CONTACT_LIST_FILENAME, "phone_numbers"),
+    (generate_features.CALL_LOG_FILENAME, "phone_number"),
+    (generate_features.SMS_LOG_FILENAME, "sms_address"),
+)
+SHARED_CONTACT_COLUMNS = (
+    "num_contact_numbers",
+    "contacts_shared_with_defaulted",
+    "contacts_shared_with_repaid",
+    "links_to_defaulted",
+    "links_to_repaid",
+    "ratio_of_links_to_defaulted",
+)
+# The types of the columns of the output file besides the ids.
+SHARED_CONTACT_TYPES = {
+    "fold": int,
+    "num_contact_numbers": int,
+    "contacts_shared_with_defaulted": int,
+    "contacts_shared_with_repaid": int,
+    "links_to_defaulted": int,
+    "links_to_repaid": int,
+    "ratio_of_links_to_defaulted": float,
+}
+
+
+def iter_user_addresses(user_id):
+    """
+    Yields every phone number and address in the contacts, calls and smss of
+    a user's devices, without parsing any timestamps.
+    """
+    for device_folder_path in generate_features.list_device_folder_paths(
+        user_id
+    ):
+        for file_name, field in ADDRESS_FIELDS:
+            for record in generate_features.iter_json_file(
+                "/".join([device_folder_path, file_name])
+            ):
+                address = record.get(field)
+                if isinstance(address, list):
+                    for phone_number in address:
+                        yield phone_number
+                else:
+                    yield address
+
+
+def number_hash(number):
+    """
+    Returns the int64 hash of a canonical number: the first 8 bytes of its
+    md5 digest, unlike Python's `hash`, which is 32 bits on 32 bit builds
+    and changes with hash randomization. Two of 100 million numbers collide
+    with a probability of about 3 in 10 ** 4.
+    """
+    if isinstance(number, unicode):
+        number = number.encode("utf-8")
+    return struct.unpack("<q", hashlib.md5(number).digest()[:8])[0]
+
+
+def number_hashes(addresses):
+    """
+    Returns the sorted int64 array of the hashes of the distinct canonical
+    numbers of `addresses` that are personal numbers.
+    """
+    numbers = set()
+    for address in set(addresses):
+        if not isinstance(address, basestring):
+            continue
+        number = canonical_phone_number(address)
+        if phone_number_flags(address, number) & PERSONAL_NUMBER_FLAGS:
+            numbers.add(number)
+    hashes = np.array(
+        [number_hash(number) for number in numbers], dtype=np.int64
+    )
+    hashes.sort()
+    return hashes
+
+
+def read_user_numbers(row):
+    """
+    Returns the `number_hashes` of the user in a row of the user status
+    file.
+    """
+    return number_hashes(iter_user_addresses(row.get("user_id")))
+
+
+class ShardSpiller(object):
+    """
+    Spills (user, number) pairs to the shard files in `work_dir` by the hash
+    of the number.
+
+    Attributes:
+        num_pairs (:class:`int`): The number of pairs spilled so far.
+    """
+    def __init__(self, work_dir, num_shards=NUM_SHARDS):
+        self.work_dir = work_dir
+        self.num_shards = num_shards
+        self.num_pairs = 0
+        self._users = []
+        self._numbers = []
+        self._buffered = 0
+
+    def shard_paths(self, shard):
+        base = join(self.work_dir, "shard-{}".format(shard))
+        return base + ".users", base + ".numbers"
+
+    def add(self, user_index, hashes):
+        self._users.append(np.full(len(hashes), user_index, dtype=np.uint32))
+        self._numbers.append(hashes)
+        self._buffered += len(hashes)
+        if self._buffered >= SPILL_PAIRS:
+            self.flush()
+
+    def flush(self):
+        if not self._buffered:
+            return
+        users = np.concatenate(self._users)
+        numbers = np.concatenate(self._numbers)
+        shards = numbers.view(np.uint64) % np.uint64(self.num_shards)
+        order = np.argsort(shards, kind="mergesort")
+        bounds = np.searchsorted(
+            shards[order], np.arange(self.num_shards + 1)
+        )
+        for shard in range(self.num_shards):
+            indices = order[bounds[shard]:bounds[shard + 1]]
+            if not len(indices):
+                continue
+            users_path, numbers_path = self.shard_paths(shard)
+            with open(users_path, "ab") as users_file:
+                users[indices].tofile(users_file)
+            with open(numbers_path, "ab") as numbers_file:
+                numbers[indices].tofile(numbers_file)
+        self.num_pairs += self._buffered
+        self._users = []
+        self._numbers = []
+        self._buffered = 0
+
+    def read_shard(self, shard):
+        """
+        Returns the (users, numbers) arrays of the pairs of a shard.
+        """
+        users_path, numbers_path = self.shard_paths(shard)
+        try:
+            return (
+                np.fromfile(users_path, dtype=np.uint32),
+                np.fromfile(numbers_path, dtype=np.int64)
+            )
+        except IOError:
+            # No pair fell in this shard.
+            return np.zeros(0, np.uint32), np.zeros(0, np.int64)
+
+
+class SharedContactCounts(object):
+    """
+    The per-user totals of the shared contact features, summed over shards.
+
+    Parameters:
+        folds (:class:`numpy.ndarray`): The fold of each user.
+        labels (:class:`numpy.ndarray`): The index in `LABELS` of each
+            user's status, or -1 if it is neither.
+        num_folds (:class:`int`): The number of folds.
+    """
+    def __init__(self, folds, labels, num_folds=NUM_FOLDS):
+        self.folds = folds
+        self.labels = labels
+        self.num_folds = num_folds
+        num_users = len(folds)
+        self.num_numbers = np.zeros(num_users, dtype=np.int64)
+        self.shared = np.zeros((num_users, len(LABELS)), dtype=np.int64)
+        self.links = np.zeros((num_users, len(LABELS)), dtype=np.int64)
+
+    def add_shard(self, users, numbers):
+        """
+        Adds the pairs of a shard. Every pair of a number is in the same
+        shard, so a shard's counts are complete on their own.
+        """
+        if not len(users):
+            return
+        num_users = len(self.folds)
+        num_labels = len(LABELS)
+        unique_numbers, number_ids = np.unique(numbers, return_inverse=True)
+        folds = self.folds[users]
+        labels = self.labels[users]
+        labeled = labels >= 0
+        # How many users of each fold and label have each number.
+        counts = np.bincount(
+            (number_ids[labeled] * self.num_folds + folds[labeled]) *
+            num_labels + labels[labeled],
+            minlength=len(unique_numbers) * self.num_folds * num_labels
+        ).reshape(len(unique_numbers), self.num_folds, num_labels)
+        # The labeled users of each pair's number, less those in the fold of
+        # a labeled pair's user, which include the user themselves.
+        other_users = counts.sum(axis=1)[number_ids]
+        other_users[labeled] -= counts[
+            number_ids[labeled], folds[labeled]
+        ]
+        self.num_numbers += np.bincount(users, minlength=num_users)
+        for label in range(num_labels):
+            self.shared[:, label] += np.bincount(
+                users[other_users[:, label] > 0], minlength=num_users
+            )
+            self.links[:, label] += np.bincount(
+                users, weights=other_users[:, label], minlength=num_users
+            ).astype(np.int64)
+
+    def features(self, user_index):
+        """
+        Returns :class:`dict` of the features of a user, keyed by
+        `SHARED_CONTACT_COLUMNS`.
+        """
+        shared = self.shared[user_index]
+        links = self.links[user_index]
+        defaulted = LABELS.index("defaulted")
+        repaid = LABELS.index("repaid")
+        return {
+            "num_contact_numbers": int(self.num_numbers[user_index]),
+            "contacts_shared_with_defaulted": int(shared[defaulted]),
+            "contacts_shared_with_repaid": int(shared[repaid]),
+            "links_to_defaulted": int(links[defaulted]),
+            "links_to_repaid": int(links[repaid]),
+            "ratio_of_links_to_defaulted": ave_or_none(
+                int(links[defaulted]), int(links.sum())
+            ),
+        }
+
+
+def build_shared_contacts(
+    rows, work_dir, num_folds=NUM_FOLDS, num_shards=NUM_SHARDS, workers=1,
+    prefetch_depth=0
+):
+    """
+    Builds the shared contact features of every user.
+
+    Parameters:
+        rows (:class:`list`): The rows of the user status file.
+        work_dir (:class:`str`): An empty folder to spill the shards to.
+
+    Returns:
+        :class:`SharedContactCounts` where the users are indexed in the
+        order of `rows`.
+    """
+    spiller = ShardSpiller(work_dir, num_shards)
+    pool = None
+    if workers > 1:
+        pool = Pool(workers)
+        user_numbers = pool.imap(read_user_numbers, rows, chunksize=16)
+    else:
+        user_rows = rows
+        if prefetch_depth > 0:
+            user_rows = generate_features.start_prefetching(
+                rows, ["call_log", "contacts", "sms_log"], prefetch_depth
+            )
+        user_numbers = imap(read_user_numbers, user_rows)
+    try:
+        for user_index, hashes in enumerate(user_numbers):
+            spiller.add(user_index, hashes)
+        spiller.flush()
+    except:
+        if pool is not None:
+            pool.terminate()
+        raise
+    finally:
+        generate_features.stop_prefetching()
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+    counts = SharedContactCounts(
+        np.array(
+            [user_fold(row.get("user_id"), num_folds) for row in rows],
+            dtype=np.int64
+        ),
+        np.array(
+            [
+                LABELS.index(row.get("status"))
+                if row.get("status") in LABELS else -1
+                for row in rows
+            ],
+            dtype=np.int64
+        ),
+        num_folds
+    )
+    for shard in range(num_shards):
+        counts.add_shard(*spiller.read_shard(shard))
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Build the contacts each user shares with users who "
+        "defaulted or repaid."
+    )
+    parser.add_argument(
+        "--output", default=OUTPUT_FILE,
+        help="The file to write the features to. Defaults to {}.".format(
+            OUTPUT_FILE
+        )
+    )
+    parser.add_argument(
+        "--output-format", choices=sorted(OUTPUT_FORMATS),
+        help="The format of the output file. Defaults to the format of the "
+        "extension of --output, or csv."
+    )
+    parser.add_argument(
+        "--folds", type=int, default=NUM_FOLDS,
+        help="The number of folds. A labeled user only counts the labels of "
+        "the users of other folds. Defaults to {}.".format(NUM_FOLDS)
+    )
+    parser.add_argument(
+        "--shards", type=int, default=NUM_SHARDS,
+        help="The number of shards the index is built in, one at a time. "
+        "More shards use less memory. Defaults to {}.".format(NUM_SHARDS)
+    )
+    parser.add_argument(
+        "--workers", type=int, default=1,
+        help="The number of processes reading the users. Defaults to 1."
+    )
+    parser.add_argument(
+        "--work-dir",
+        help="The folder to spill the shards to, e.g. on a disk with more "
+        "room. Defaults to the system's temporary folder."
+    )
+    args = parser.parse_args(argv)
+    if not numpy_installed:
+        parser.error("shared_contacts.py requires numpy, `pip install numpy`")
+    if args.folds < 2:
+        parser.error("--folds must be at least 2")
+    if args.shards < 1:
+        parser.error("--shards must be at least 1")
+    try:
+        check_output_format(args.output, args.output_format)
+    except ValueError as e:
+        parser.error(str(e))
+
+    rows = sorted(
+        generate_features.read_user_status(),
+        key=generate_features.user_id_sort_key
+    )
+    work_dir = tempfile.mkdtemp(prefix="shared_contacts_", dir=args.work_dir)
+    try:
+        counts = build_shared_contacts(
+            rows, work_dir, args.folds, args.shards, args.workers,
+            DEFAULT_PREFETCH_DEPTH
+        )
+    finally:
+        shutil.rmtree(work_dir)
+    fieldnames = list(ID_COLUMNS) + ["fold"] + list(SHARED_CONTACT_COLUMNS)
+    with open_feature_writer(
+        args.output, fieldnames, args.output_format,
+        types=SHARED_CONTACT_TYPES
+    ) as writer:
+        for user_index, row in enumerate(rows):
+            user_features = counts.features(user_index)
+            user_features["user_id"] = row.get("user_id")
+            user_features["status"] = row.get("status")
+            user_features["fold"] = int(counts.folds[user_index])
+            writer.write_row(user_features)
+    print("Wrote the shared contacts of {} users to {}.".format(
+        len(rows), args.output
+    ))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,511 @@
+"""
+Learns the phrases of sms bodies most associated with defaulting or with
+repaying, across the whole corpus, for the `defaulted_phrases` and
+`repaid_phrases` lists of `utils.SMS_PHRASE_LISTS`.
+
+Every n-gram of 1 to `max_n` words that a phrase of :class:`PhraseMatcher`
+could match, i.e. words separated by whitespace alone within a message, is
+counted once per user. The corpus has far too many distinct n-grams to keep
+them all, so they are counted with the hashing trick: each n-gram's hash,
+combined from the hashes of its words with NumPy, picks one of `num_buckets`
+buckets, and only how many users of each label have each bucket is kept, in
+memory that does not grow with the corpus. The users are read as a stream,
+in chunks spread over `--workers` processes, and the counts of each chunk are
+merged as they come back.
+
+Each bucket is scored with the log odds ratio of a user of one label rather
+than the other having it, smoothed by `PRIOR`, and its z score. The buckets
+with the highest z scores for each label are then counted again, this time by
+the exact text of their n-grams, in a second pass over the users, so hash
+collisions never decide which phrases are kept. The `--top` phrases of each
+label, used by at least `--min-users` users, are kept. N-grams that the other
+lists of `SMS_PHRASE_LISTS` already match are left out.
+
+Labels would leak if a user's features counted phrases learned from their own
+label. The users are assigned `--folds` folds by `utils.user_fold`, as in
+`shared_contacts.py`, and the buckets and n-grams are counted per fold and
+label, so a list is learned for each fold from the users of the other folds
+alone, along with one learned from every labeled user. A labeled user's
+phrases are counted with the lists of their fold, see `utils.phrase_fold`,
+and unlabeled users, e.g. new applicants, with those of every labeled user,
+so train models with the same folds.
+
+To run, with the same `DATA_PATH` as `generate_features.py`:
+```
+python sms_phrases.py
+```
+It writes `utils.SMS_PHRASES_FILE`, whose phrases the `sms_phrase_stats`
+feature then counts in the same single pass over each sms body as the other
+lists, so run `generate_features.py` after it.
+
+NumPy is needed to run this module. To install it:
+```
+pip install numpy
+```
+"""
+import argparse
+import json
+import re
+from itertools import imap
+from multiprocessing import Pool
+import generate_features
+from matcher import PhraseMatcher
+from prefetch import DEFAULT_PREFETCH_DEPTH
+from sketches import GOLDEN_GAMMA
+from utils import (
+    LABELS, LEARNED_PHRASE_LISTS, NUM_FOLDS, SMS_PHRASES_FILE,
+    get_sms_phrase_lists, user_fold
+)
+numpy_installed = False
+try:
+    import numpy as np
+    numpy_installed = True
+except ImportError:
+    pass
+
+
+MAX_N = 3
+NUM_BUCKETS = 1 << 20
+TOP_PHRASES = 200
+MIN_USERS = 20
+# The number of buckets per label re-counted by their text, per phrase kept.
+CANDIDATES_PER_PHRASE = 4
+# Added to each count of the log odds ratio, so unseen counts are not 0.
+PRIOR = 0.5
+# The number of users a worker reads per task.
+CHUNK_USERS = 64
+# Separates the runs of words a phrase can match: any punctuation, and the
+# "\0" that separates the bodies of a user's smss.
+RUN_BREAK_RE = re.compile(r"[^\w\s]+", re.UNICODE)
+
+
+def iter_user_bodies(user_id):
+    """
+    Yields the body of every sms of a user's devices, without parsing any
+    timestamps.
+    """
+    for device_folder_path in generate_features.list_device_folder_paths(
+        user_id
+    ):
+        for sms in generate_features.iter_json_file(
+            "/".join([device_folder_path, generate_features.SMS_LOG_FILENAME])
+        ):
+            yield sms.get("message_body", "") or ""
+
+
+def tokenize(bodies):
+    """
+    Returns the (words, runs) of sms bodies: the list of their lowercased
+    words and the int64 array of the index of the run of words each is in.
+    """
+    words = []
+    runs = []
+    text = u"\0".join(bodies).lower()
+    for run, run_text in enumerate(RUN_BREAK_RE.split(text)):
+        run_words = run_text.split()
+        words.extend(run_words)
+        runs.extend([run] * len(run_words))
+    return words, np.array(runs, dtype=np.int64)
+
+
+def mix64_array(values):
+    """
+    Returns `sketches.mix64` of each value of a uint64 array.
+    """
+    values = values ^ (values >> np.uint64(30))
+    values = values * np.uint64(0xbf58476d1ce4e5b9)
+    values = values ^ (values >> np.uint64(27))
+    values = values * np.uint64(0x94d049bb133111eb)
+    return values ^ (values >> np.uint64(31))
+
+
+def iter_ngram_hashes(words, runs, max_n=MAX_N):
+    """
+    Yields (n, starts, hashes) for each n from 1 to `max_n`: the int64 array
+    of the index of the first word of each n-gram of `words` within a run,
+    and the uint64 array of their hashes.
+    """
+    word_hashes = np.fromiter(
+        imap(hash, words), dtype=np.int64, count=len(words)
+    ).view(np.uint64)
+    multiplier = np.uint64(GOLDEN_GAMMA)
+    combined = np.zeros(len(words), dtype=np.uint64)
+    for n in range(1, max_n + 1):
+        num_ngrams = len(words) - n + 1
+        if num_ngrams <= 0:
+            return
+        # The polynomial hash of words [i, i + n), folded in a word at a time.
+        combined = combined[:num_ngrams] * multiplier + word_hashes[n - 1:]
+        starts = np.flatnonzero(runs[:num_ngrams] == runs[n - 1:])
+        yield n, starts, mix64_array(combined[starts])
+
+
+def user_buckets(user_id, num_buckets, max_n):
+    """
+    Returns the sorted int64 array of the distinct buckets of the n-grams of
+    a user's smss.
+    """
+    words, runs = tokenize(iter_user_bodies(user_id))
+    buckets = [np.zeros(0, dtype=np.int64)]
+    for _, _, hashes in iter_ngram_hashes(words, runs, max_n):
+        buckets.append((hashes % np.uint64(num_buckets)).astype(np.int64))
+    return np.unique(np.concatenate(buckets))
+
+
+def user_ngrams(user_id, candidates, num_buckets, max_n):
+    """
+    Returns the :class:`set` of the n-grams of a user's smss whose bucket is
+    in `candidates`, a sorted int64 array.
+    """
+    words, runs = tokenize(iter_user_bodies(user_id))
+    ngrams = set()
+    for n, starts, hashes in iter_ngram_hashes(words, runs, max_n):
+        buckets = (hashes % np.uint64(num_buckets)).astype(np.int64)
+        for start in starts[np.in1d(buckets, candidates)]:
+            ngrams.add(u" ".join(words[start:start + n]))
+    return ngrams
+
+
+def fold_label(row, num_folds):
+    """
+    Returns the index of a labeled user's (fold, label) in the counts of a
+    bucket or n-gram, `fold * len(LABELS) + label`.
+    """
+    return (
+        user_fold(row.get("user_id"), num_folds) * len(LABELS) +
+        LABELS.index(row.get("status"))
+    )
+
+
+def count_buckets(task):
+    """
+    Returns the (keys, counts) of a chunk of users: the int64 array of each
+    `bucket * num_folds * len(LABELS) + fold_label` that any of them have and
+    how many of them have it.
+    """
+    rows, num_buckets, max_n, num_folds = task
+    keys = [np.zeros(0, dtype=np.int64)]
+    for row in rows:
+        buckets = user_buckets(row.get("user_id"), num_buckets, max_n)
+        keys.append(
+            buckets * (num_folds * len(LABELS)) + fold_label(row, num_folds)
+        )
+    return np.unique(np.concatenate(keys), return_counts=True)
+
+
+def count_ngrams(task):
+    """
+    Returns :class:`dict` mapping each n-gram of a chunk of users whose
+    bucket is a candidate to the list of the number of them of each
+    `fold_label` that have it.
+    """
+    rows, candidates, num_buckets, max_n, num_folds = task
+    counts = {}
+    for row in rows:
+        index = fold_label(row, num_folds)
+        for ngram in user_ngrams(
+            row.get("user_id"), candidates, num_buckets, max_n
+        ):
+            if ngram not in counts:
+                counts[ngram] = [0] * (num_folds * len(LABELS))
+            counts[ngram][index] += 1
+    return counts
+
+
+def out_of_fold(counts, fold):
+    """
+    Returns the counts of each label of the users outside of `fold`, or of
+    every user if it is None, from `counts` of each fold and label, an array
+    whose last two axes are the folds and the labels.
+    """
+    total = counts.sum(axis=-2)
+    if fold is None:
+        return total
+    return total - counts[..., fold, :]
+
+
+def iter_tasks(rows, chunk_users, args):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == chunk_users:
+            yield (chunk,) + args
+            chunk = []
+    if chunk:
+        yield (chunk,) + args
+
+
+def map_users(function, rows, args, workers=1, prefetch_depth=0):
+    """
+    Yields the results of `function` over the tasks of chunks of `rows` and
+    `args`, in any order, from `workers` processes. With a single worker,
+    each user is its own chunk and the sms logs of the next
+    `prefetch_depth` users are read ahead.
+    """
+    pool = None
+    if workers > 1:
+        pool = Pool(workers)
+        results = pool.imap_unordered(
+            function, iter_tasks(rows, CHUNK_USERS, args)
+        )
+    else:
+        if prefetch_depth > 0:
+            rows = generate_features.start_prefetching(
+                rows, ["sms_log"], prefetch_depth
+            )
+        results = imap(function, iter_tasks(rows, 1, args))
+    try:
+        for result in results:
+            yield result
+    except:
+        if pool is not None:
+            pool.terminate()
+        raise
+    finally:
+        generate_features.stop_prefetching()
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+
+def log_odds(label_count, label_users, other_count, other_users,
+             prior=PRIOR):
+    """
+    Returns the (log odds ratio, z score) of a user of a label rather than the
+    other using a phrase, from the `label_count` of `label_users` users of
+    the label and the `other_count` of `other_users` of the other that use
+    it. Works on floats and NumPy arrays alike.
+    """
+    used = label_count + prior
+    unused = label_users - label_count + prior
+    other_used = other_count + prior
+    other_unused = other_users - other_count + prior
+    ratio = (
+        np.log(used / unused) - np.log(other_used / other_unused)
+    )
+    deviation = np.sqrt(
+        1 / used + 1 / unused + 1 / other_used + 1 / other_unused
+    )
+    return ratio, ratio / deviation
+
+
+def candidate_buckets(bucket_counts, num_users, num_candidates, min_users):
+    """
+    Returns the sorted int64 array of the `num_candidates` buckets with the
+    highest z scores for each label, out of those at least `min_users` users
+    have.
+    """
+    defaulted = LABELS.index("defaulted")
+    repaid = LABELS.index("repaid")
+    _, z_scores = log_odds(
+        bucket_counts[:, defaulted].astype(np.float64),
+        float(num_users[defaulted]),
+        bucket_counts[:, repaid].astype(np.float64),
+        float(num_users[repaid])
+    )
+    supported = np.flatnonzero(bucket_counts.sum(axis=1) >= min_users)
+    candidates = [np.zeros(0, dtype=np.int64)]
+    for scores in (z_scores[supported], -z_scores[supported]):
+        num = min(num_candidates, len(supported))
+        if not num:
+            continue
+        best = np.argpartition(-scores, num - 1)[:num]
+        candidates.append(supported[best[scores[best] > 0]])
+    return np.unique(np.concatenate(candidates))
+
+
+def rank_phrases(ngram_counts, num_users, top, min_users):
+    """
+    Returns :class:`dict` mapping each label to the list of at most `top`
+    phrases most associated with it, with their stats, best first.
+    """
+    defaulted = LABELS.index("defaulted")
+    repaid = LABELS.index("repaid")
+    # The n-grams the other lists already count would only take hits away
+    # from them.
+    known_matcher = PhraseMatcher(dict(
+        (name, phrases) for name, phrases in get_sms_phrase_lists().items()
+        if name not in LEARNED_PHRASE_LISTS
+    ))
+    scored = []
+    for ngram, counts in ngram_counts.items():
+        if sum(counts) < min_users or any(
+            known_matcher.count(ngram).values()
+        ):
+            continue
+        ratio, z_score = log_odds(
+            float(counts[defaulted]), float(num_users[defaulted]),
+            float(counts[repaid]), float(num_users[repaid])
+        )
+        scored.append({
+            "phrase": ngram,
+            "log_odds": round(float(ratio), 4),
+            "z_score": round(float(z_score), 4),
+            "defaulted_users": counts[defaulted],
+            "repaid_users": counts[repaid],
+        })
+    return {
+        "defaulted": sorted(
+            [entry for entry in scored if entry["z_score"] > 0],
+            key=lambda entry: (-entry["z_score"], entry["phrase"])
+        )[:top],
+        "repaid": sorted(
+            [entry for entry in scored if entry["z_score"] < 0],
+            key=lambda entry: (entry["z_score"], entry["phrase"])
+        )[:top],
+    }
+
+
+def learn_phrases(
+    rows, top=TOP_PHRASES, max_n=MAX_N, min_users=MIN_USERS,
+    num_buckets=NUM_BUCKETS, num_folds=NUM_FOLDS, workers=1, prefetch_depth=0
+):
+    """
+    Learns the phrases most associated with each label, from every user and
+    from the users outside of each fold.
+
+    Parameters:
+        rows (:class:`list`): The rows of the user status file of the users
+            to learn from, each with a status in `LABELS`.
+
+    Returns:
+        :class:`dict` mapping each label to the list of its phrases learned
+        from every user, with their stats, best first, as `rank_phrases`,
+        and "out_of_fold" to the list of the same :class:`dict` of each fold,
+        learned without its users.
+    """
+    num_fold_labels = num_folds * len(LABELS)
+    num_users = np.zeros(num_fold_labels, dtype=np.int64)
+    for row in rows:
+        num_users[fold_label(row, num_folds)] += 1
+    num_users = num_users.reshape(num_folds, len(LABELS))
+    folds = [None] + list(range(num_folds))
+
+    # Users are counted per fold and label, so 32 bits are plenty and keep
+    # the counts of every fold to `num_folds` times the memory of one.
+    bucket_counts = np.zeros(num_buckets * num_fold_labels, dtype=np.int32)
+    for keys, counts in map_users(
+        count_buckets, rows, (num_buckets, max_n, num_folds), workers,
+        prefetch_depth
+    ):
+        bucket_counts[keys] += counts
+    bucket_counts = bucket_counts.reshape(num_buckets, num_folds, len(LABELS))
+    candidates = np.unique(np.concatenate([
+        candidate_buckets(
+            out_of_fold(bucket_counts, fold), out_of_fold(num_users, fold),
+            top * CANDIDATES_PER_PHRASE, min_users
+        )
+        for fold in folds
+    ]))
+    del bucket_counts
+
+    ngram_counts = {}
+    for chunk_counts in map_users(
+        count_ngrams, rows, (candidates, num_buckets, max_n, num_folds),
+        workers, prefetch_depth
+    ):
+        for ngram, counts in chunk_counts.items():
+            if ngram not in ngram_counts:
+                ngram_counts[ngram] = [0] * num_fold_labels
+            for index, count in enumerate(counts):
+                ngram_counts[ngram][index] += count
+    ngrams = list(ngram_counts)
+    ngram_counts = np.array(
+        [ngram_counts[ngram] for ngram in ngrams], dtype=np.int64
+    ).reshape(len(ngrams), num_folds, len(LABELS))
+
+    fold_phrases = []
+    for fold in folds:
+        fold_phrases.append(rank_phrases(
+            dict(zip(ngrams, out_of_fold(ngram_counts, fold).tolist())),
+            out_of_fold(num_users, fold).tolist(), top, min_users
+        ))
+    phrases = fold_phrases[0]
+    phrases["out_of_fold"] = fold_phrases[1:]
+    return phrases
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Learn the sms phrases most associated with defaulting "
+        "or repaying."
+    )
+    parser.add_argument(
+        "--output", default=SMS_PHRASES_FILE,
+        help="The JSON file to write the phrases to. Defaults to {}, which "
+        "the sms_phrase_stats feature reads.".format(SMS_PHRASES_FILE)
+    )
+    parser.add_argument(
+        "--top", type=int, default=TOP_PHRASES,
+        help="The number of phrases kept per label. Defaults to {}.".format(
+            TOP_PHRASES
+        )
+    )
+    parser.add_argument(
+        "--max-n", type=int, default=MAX_N,
+        help="The most words in a phrase. Defaults to {}.".format(MAX_N)
+    )
+    parser.add_argument(
+        "--min-users", type=int, default=MIN_USERS,
+        help="The fewest labeled users a phrase is kept for. Defaults to "
+        "{}.".format(MIN_USERS)
+    )
+    parser.add_argument(
+        "--buckets", type=int, default=NUM_BUCKETS,
+        help="The number of buckets n-grams are hashed to. More buckets "
+        "use more memory and collide less. Defaults to {}.".format(
+            NUM_BUCKETS
+        )
+    )
+    parser.add_argument(
+        "--folds", type=int, default=NUM_FOLDS,
+        help="The number of folds users are assigned to, as in "
+        "shared_contacts.py. A list of phrases is learned for each fold "
+        "from the users of the other folds. Defaults to {}.".format(NUM_FOLDS)
+    )
+    parser.add_argument(
+        "--workers", type=int, default=1,
+        help="The number of processes reading the users. Defaults to 1."
+    )
+    args = parser.parse_args(argv)
+    if not numpy_installed:
+        parser.error("sms_phrases.py requires numpy, `pip install numpy`")
+    if args.top < 1:
+        parser.error("--top must be at least 1")
+    if args.max_n < 1:
+        parser.error("--max-n must be at least 1")
+    if args.buckets < 1:
+        parser.error("--buckets must be at least 1")
+    if args.folds < 2:
+        parser.error("--folds must be at least 2")
+
+    rows = [
+        row for row in sorted(
+            generate_features.read_user_status(),
+            key=generate_features.user_id_sort_key
+        )
+        if row.get("status") in LABELS
+    ]
+    phrases = learn_phrases(
+        rows, args.top, args.max_n, args.min_users, args.buckets, args.folds,
+        args.workers, DEFAULT_PREFETCH_DEPTH
+    )
+    phrases.update({
+        "max_n": args.max_n,
+        "folds": args.folds,
+        "num_users": dict(
+            (label, sum(1 for row in rows if row.get("status") == label))
+            for label in LABELS
+        ),
+    })
+    with open(args.output, "w") as phrases_file:
+        json.dump(phrases, phrases_file, indent=2, sort_keys=True)
+    print("Wrote {} defaulted and {} repaid phrases learned from {} users, "
+          "and those learned without each of {} folds, to {}.".format(
+              len(phrases["defaulted"]), len(phrases["repaid"]), len(rows),
+              args.folds, args.output
+          ))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,257 @@
+"""
+Low overhead instrumentation of a feature generation run.
+
+A :class:`Telemetry` collects, per phase of the run (reading the logs,
+decoding records, writing the output, ...) and per feature extractor, the
+wall and CPU time spent, the number of records processed and the peak RSS of
+the process. It also keeps the slowest users. The phases don't overlap, so
+their times add up to at most the time of the run, while the subphases, like
+parsing the timestamps, are part of one of the phases, like reading the logs.
+
+Timings are taken around whole chunks of records rather than single records,
+so leaving the telemetry on costs a few clock reads per `engine.CHUNK_SIZE`
+records. Per record work that is too fine grained to time, like parsing a
+timestamp, is timed on a sample of the calls instead. The peak RSS is only
+read once per user, see `Telemetry.sample_rss`.
+"""
+import json
+import time
+from contextlib import contextmanager
+from heapq import nlargest
+try:
+    import resource
+    RUSAGE_CHILDREN = resource.RUSAGE_CHILDREN
+except ImportError:
+    # Not available on Windows, where the peak RSS is reported as None.
+    resource = None
+    RUSAGE_CHILDREN = None
+
+
+# The number of slowest users to keep in the report.
+NUM_SLOWEST_USERS = 10
+# Time one in this many calls of per record work, e.g. timestamp parsing.
+SAMPLE_EVERY = 64
+cpu_time = time.clock
+
+
+def peak_rss_kb(who=None):
+    """
+    Returns the peak resident set size of this process, or of its largest
+    finished child process if `who` is `resource.RUSAGE_CHILDREN`, in KB.
+    """
+    if resource is None:
+        return None
+    if who is None:
+        who = resource.RUSAGE_SELF
+    return resource.getrusage(who).ru_maxrss
+
+
+def new_stats():
+    return {"wall_s": 0.0, "cpu_s": 0.0, "calls": 0, "records": 0}
+
+
+def add_stats(stats, other):
+    for key in ("wall_s", "cpu_s", "calls", "records"):
+        stats[key] += other[key]
+    if "peak_rss_kb" in other:
+        stats["peak_rss_kb"] = max(
+            stats.get("peak_rss_kb"), other["peak_rss_kb"]
+        )
+
+
+class Telemetry(object):
+    """
+    Attributes:
+        phases (:class:`dict`): Maps each phase to its stats.
+        subphases (:class:`dict`): Maps each subphase, work included in the
+            time of one of the phases, to its stats.
+        extractors (:class:`dict`): Maps each feature extractor to its stats.
+        users (:class:`list`): (wall_s, user_id, cpu_s, records) of the
+            slowest users.
+    """
+    def __init__(self):
+        self.phases = {}
+        self.subphases = {}
+        self.extractors = {}
+        self.users = []
+        # The (section, name) of the stats timed since the peak RSS was last
+        # read.
+        self.pending_rss = set()
+
+    def add(self, section, name, wall, cpu, records=0, rss=True):
+        """
+        Adds a timing to the stats of `name` in `section`, `phases`,
+        `subphases` or `extractors`. If `rss` is True the peak RSS of the
+        stats is updated at the next `sample_rss`.
+        """
+        stats = getattr(self, section).get(name)
+        if stats is None:
+            stats = getattr(self, section)[name] = new_stats()
+        stats["wall_s"] += wall
+        stats["cpu_s"] += cpu
+        stats["calls"] += 1
+        stats["records"] += records
+        if rss:
+            self.pending_rss.add((section, name))
+
+    def sample_rss(self):
+        """
+        Reads the peak RSS of the process once and updates the peak of every
+        stats timed since the last sample with it. Called once per user, or
+        per batch of users, rather than per chunk, which would cost a system
+        call per chunk and extractor.
+        """
+        if not self.pending_rss:
+            return
+        rss = peak_rss_kb()
+        for section, name in self.pending_rss:
+            stats = getattr(self, section)[name]
+            stats["peak_rss_kb"] = max(stats.get("peak_rss_kb"), rss)
+        self.pending_rss = set()
+
+    def add_sampled(self, section, name, timer):
+        """
+        Adds the estimated time of the calls of a :class:`SampledTimer` to the
+        stats of `name` and resets the timer. Sampled work is pure CPU work so
+        its CPU time is taken to be its wall time.
+        """
+        calls, wall = timer.estimate()
+        if calls:
+            self.add(section, name, wall, wall, calls, rss=False)
+
+    def records(self, prefix="read"):
+        """
+        Returns the number of records processed by the phases starting with
+        `prefix`.
+        """
+        return sum(
+            stats["records"] for name, stats in self.phases.items()
+            if name.startswith(prefix)
+        )
+
+    @contextmanager
+    def phase(self, name, records=0):
+        wall = time.time()
+        cpu = cpu_time()
+        yield
+        self.add(
+            "phases", name, time.time() - wall, cpu_time() - cpu, records
+        )
+
+    def timed(self, section, name, func):
+        """
+        Returns `func` wrapped to add the time of each call to the stats of
+        `name` in `section`. The number of records of a call is the length of
+        its first argument, e.g. a chunk of calls.
+        """
+        add = self.add
+
+        def timed_func(*args):
+            wall = time.time()
+            cpu = cpu_time()
+            result = func(*args)
+            add(
+                section, name, time.time() - wall, cpu_time() - cpu,
+                len(args[0]) if args else 0
+            )
+            return result
+        return timed_func
+
+    def timed_iter(self, section, name, chunks):
+        """
+        Yields the chunks of records of `chunks`, adding the time it takes to
+        produce each one, e.g. to read and parse it, to the stats of `name`.
+        """
+        chunks = iter(chunks)
+        while True:
+            wall = time.time()
+            cpu = cpu_time()
+            try:
+                chunk = next(chunks)
+            except StopIteration:
+                return
+            self.add(
+                section, name, time.time() - wall, cpu_time() - cpu,
+                len(chunk)
+            )
+            yield chunk
+
+    def add_user(self, user_id, wall, cpu, records):
+        self.sample_rss()
+        self.users = nlargest(
+            NUM_SLOWEST_USERS,
+            self.users + [(wall, user_id, cpu, records)]
+        )
+
+    def merge(self, other):
+        """
+        Adds the stats of `other`, e.g. the telemetry of a worker process.
+        """
+        for section in ("phases", "subphases", "extractors"):
+            stats = getattr(self, section)
+            for name, other_stats in getattr(other, section).items():
+                add_stats(stats.setdefault(name, new_stats()), other_stats)
+        self.users = nlargest(NUM_SLOWEST_USERS, self.users + other.users)
+
+    def report(self, **extra):
+        """
+        Returns :class:`dict` of the report, with the `extra` items added.
+        """
+        self.sample_rss()
+        report = dict(extra)
+        report["phases"] = self.phases
+        report["subphases"] = self.subphases
+        report["extractors"] = self.extractors
+        report["slowest_users"] = [
+            {"user_id": user_id, "wall_s": wall, "cpu_s": cpu,
+             "records": records}
+            for wall, user_id, cpu, records in self.users
+        ]
+        return report
+
+    def write_report(self, report_path, **extra):
+        with open(report_path, "w") as report_file:
+            json.dump(
+                self.report(**extra), report_file, indent=2, sort_keys=True
+            )
+
+
+class SampledTimer(object):
+    """
+    Estimates the total time of a call made once per record by only timing
+    one in every `sample_every` calls.
+    """
+    def __init__(self, sample_every=SAMPLE_EVERY):
+        self.sample_every = sample_every
+        self.reset()
+
+    def reset(self):
+        self.calls = 0
+        self.sampled_calls = 0
+        self.sampled_wall = 0.0
+
+    def estimate(self):
+        """
+        Returns (calls, estimated wall seconds) and resets the timer.
+        """
+        if self.sampled_calls:
+            wall = self.sampled_wall * self.calls / self.sampled_calls
+        else:
+            wall = 0.0
+        result = (self.calls, wall)
+        self.reset()
+        return result
+
+    def call(self, func, *args):
+        """
+        Returns `func(*args)`, timing the call if it is one of the sampled
+        calls.
+        """
+        self.calls += 1
+        if self.calls % self.sample_every:
+            return func(*args)
+        wall = time.time()
+        result = func(*args)
+        self.sampled_wall += time.time() - wall
+        self.sampled_calls += 1
+        return result
@@ -0,0 +1,181 @@
+"""
+Batched statistics of the text of sms bodies: lengths, word counts, the
+share of digits, uppercase and non-ASCII characters and a lexicon based
+sentiment.
+
+A :class:`TextStats` takes the message bodies of a user a chunk at a time and
+scans each chunk as a single string joined with newlines: characters are
+counted with string methods and a regex substitution and words are found
+with one `findall`, so all the work per message body happens in C rather than
+in a Python loop. Only the chunk being scanned is held in memory, however
+large the sms log.
+
+Sentiment is scored with the word list in `SENTIMENT_LEXICON_FILE`, which
+gives words a valence from -3 (very negative) to 3 (very positive). It is
+read from disk on first use and no network API is involved.
+"""
+import io
+import re
+from itertools import islice
+from os.path import abspath, dirname, join
+from utils import ave_or_none
+
+
+SENTIMENT_LEXICON_FILE = join(
+    dirname(abspath(__file__)), "resources", "sentiment_lexicon.txt"
+)
+# The number of message bodies joined and scanned at once.
+TEXT_CHUNK_SIZE = 1024
+
+# Words are runs of letters, in any alphabet.
+WORD_RE = re.compile(r"[^\W\d_]+", re.UNICODE)
+DIGITS = "0123456789"
+UPPERCASE_RE = re.compile(r"[A-Z]+")
+
+# The counts a :class:`TextStats` keeps, all of them summable across devices.
+TEXT_COUNTS = (
+    "messages",
+    "characters",
+    "digits",
+    "uppercase",
+    "non_ascii",
+    "words",
+    "word_characters",
+    "positive_words",
+    "negative_words",
+    "valence",
+)
+TEXT_STATS_COLUMNS = (
+    "ave_words_per_sms",
+    "ave_word_length",
+    "ratio_of_digits",
+    "ratio_of_uppercase",
+    "ratio_of_non_ascii",
+    "sentiment_score",
+    "ratio_of_positive_words",
+    "ratio_of_negative_words",
+)
+
+_sentiment_lexicon = None
+
+
+def load_sentiment_lexicon(file_path=SENTIMENT_LEXICON_FILE):
+    """
+    Returns :class:`dict` mapping each lowercased word of a lexicon file to
+    its valence. Each line of the file is a word and an integer valence
+    separated by whitespace; blank lines and lines starting with "#" are
+    skipped.
+    """
+    lexicon = {}
+    with io.open(file_path, encoding="utf-8") as lexicon_file:
+        for line in lexicon_file:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            word, valence = line.rsplit(None, 1)
+            lexicon[word.lower()] = int(valence)
+    return lexicon
+
+
+def get_sentiment_lexicon():
+    """
+    Returns the lexicon of `SENTIMENT_LEXICON_FILE`, read on first use.
+    """
+    global _sentiment_lexicon
+    if _sentiment_lexicon is None:
+        _sentiment_lexicon = load_sentiment_lexicon()
+    return _sentiment_lexicon
+
+
+def count_matches(regex, text):
+    """
+    Returns the number of characters of `text` matched by `regex`.
+    """
+    return len(text) - len(regex.sub("", text))
+
+
+def count_non_ascii(text):
+    """
+    Returns the number of non-ASCII characters of a unicode `text`, or bytes
+    of a str.
+    """
+    if isinstance(text, unicode):
+        ascii_text = text.encode("ascii", "ignore")
+    else:
+        ascii_text = text.decode("ascii", "ignore")
+    return len(text) - len(ascii_text)
+
+
+class TextStats(object):
+    """
+    The summed text counts of a user's message bodies.
+
+    Attributes:
+        counts (:class:`dict`): Maps each of `TEXT_COUNTS` to its total so
+            far.
+    """
+    def __init__(self):
+        self.counts = dict.fromkeys(TEXT_COUNTS, 0)
+
+    def add_bodies(self, message_bodies):
+        """
+        Adds an iterable of message bodies, `TEXT_CHUNK_SIZE` at a time.
+        Empty bodies are counted as messages without text.
+        """
+        message_bodies = iter(message_bodies)
+        while True:
+            chunk = list(islice(message_bodies, TEXT_CHUNK_SIZE))
+            if not chunk:
+                return
+            self._add_chunk(chunk)
+
+    def _add_chunk(self, message_bodies):
+        counts = self.counts
+        # The newlines keep the words of consecutive bodies apart and are
+        # never counted.
+        text = "\n".join(message_bodies)
+        counts["messages"] += len(message_bodies)
+        counts["characters"] += len(text) - len(message_bodies) + 1
+        counts["digits"] += sum(map(text.count, DIGITS))
+        counts["uppercase"] += count_matches(UPPERCASE_RE, text)
+        counts["non_ascii"] += count_non_ascii(text)
+        words = WORD_RE.findall(text.lower())
+        counts["words"] += len(words)
+        counts["word_characters"] += sum(map(len, words))
+        # Only the few words in the lexicon are left for the Python loop.
+        valences = filter(None, map(get_sentiment_lexicon().get, words))
+        positive_words = sum(1 for valence in valences if valence > 0)
+        counts["positive_words"] += positive_words
+        counts["negative_words"] += len(valences) - positive_words
+        counts["valence"] += sum(valences)
+
+    def merge(self, other):
+        for name, count in other.counts.items():
+            self.counts[name] += count
+
+    def features(self):
+        """
+        Returns :class:`dict` of the features of the counts, keyed by
+        `TEXT_STATS_COLUMNS`.
+        """
+        return text_features(self.counts)
+
+
+def text_features(counts, ave=ave_or_none):
+    """
+    Returns :class:`dict` of the features of a dict of `TEXT_COUNTS`, keyed by
+    `TEXT_STATS_COLUMNS`. `ave` divides each total by its count, e.g. of
+    every user of a batch in `batch.py`.
+    """
+    characters = counts["characters"]
+    words = counts["words"]
+    return {
+        "ave_words_per_sms": ave(words, counts["messages"]),
+        "ave_word_length": ave(counts["word_characters"], words),
+        "ratio_of_digits": ave(counts["digits"], characters),
+        "ratio_of_uppercase": ave(counts["uppercase"], characters),
+        "ratio_of_non_ascii": ave(counts["non_ascii"], characters),
+        "sentiment_score": ave(counts["valence"], words),
+        "ratio_of_positive_words": ave(counts["positive_words"], words),
+        "ratio_of_negative_words": ave(counts["negative_words"], words),
+    }
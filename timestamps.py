@@ -0,0 +1,192 @@
+"""
+A fast timestamp decoder for the `datetime` fields of the user logs.
+
+Most timestamps are epoch milliseconds and the rest are mostly ISO 8601
+strings, so both are decoded directly and `dateutil` is only imported and
+used for layouts the fast path does not recognize. Decoded strings are cached
+since the same timestamps show up over and over again, e.g. in synced logs.
+
+Invalid timestamps are counted, along with a few examples, instead of being
+printed one at a time.
+"""
+import re
+from datetime import datetime, timedelta, tzinfo
+
+
+# YYYY-MM-DD[(T| )HH:MM[:SS[.ffffff]]][Z|(+|-)HH[:]MM]
+ISO_TIMESTAMP_RE = re.compile(
+    r"^(\d{4})-(\d{2})-(\d{2})"
+    r"(?:[T ](\d{2}):(\d{2})(?::(\d{2})(?:[.,](\d+))?)?)?"
+    r"\s*(Z|[+-]\d{2}(?::?\d{2})?)?$"
+)
+# The number of decoded strings to keep in the cache before clearing it.
+CACHE_SIZE = 100000
+# The number of invalid timestamps to keep as examples for the run summary.
+NUM_INVALID_EXAMPLES = 5
+# Cached in place of a datetime for timestamps that could not be parsed.
+INVALID = object()
+
+
+class FixedOffset(tzinfo):
+    """
+    A timezone with a fixed offset from UTC, in minutes.
+    """
+    def __init__(self, offset_minutes):
+        self.offset = timedelta(minutes=offset_minutes)
+
+    def utcoffset(self, dt):
+        return self.offset
+
+    def dst(self, dt):
+        return timedelta(0)
+
+    def tzname(self, dt):
+        return None
+
+    def __repr__(self):
+        return "FixedOffset({})".format(
+            int(self.offset.total_seconds() // 60)
+        )
+
+
+UTC = FixedOffset(0)
+
+
+def parse_iso_timestamp(timestamp_txt):
+    """
+    Parses the common ISO 8601 layouts without `dateutil`.
+
+    Returns:
+        :class:`datetime` or None if `timestamp_txt` is not in one of the
+        layouts this function knows about.
+
+    Raises:
+        ValueError if the layout matched but the date is not valid, e.g. a
+            month of 13.
+    """
+    match = ISO_TIMESTAMP_RE.match(timestamp_txt.strip())
+    if match is None:
+        return None
+    (
+        year, month, day, hour, minute, second, fraction, offset
+    ) = match.groups()
+    if offset is None:
+        tz = None
+    elif offset == "Z":
+        tz = UTC
+    else:
+        sign = -1 if offset[0] == "-" else 1
+        offset = offset[1:].replace(":", "")
+        tz = FixedOffset(
+            sign * (int(offset[:2]) * 60 + int(offset[2:4] or 0))
+        )
+    return datetime(
+        int(year),
+        int(month),
+        int(day),
+        int(hour or 0),
+        int(minute or 0),
+        int(second or 0),
+        int((fraction or "0")[:6].ljust(6, "0")),
+        tz
+    )
+
+
+def parse_timestamp_dateutil(timestamp_txt):
+    import dateutil.parser
+    return dateutil.parser.parse(timestamp_txt)
+
+
+class TimestampParser(object):
+    """
+    Decodes timestamps of epoch milliseconds or ISO strings into datetimes.
+
+    Attributes:
+        invalid_count (:class:`int`): The number of invalid timestamps seen.
+        invalid_examples (:class:`list`): Up to `NUM_INVALID_EXAMPLES`
+            distinct invalid timestamps seen.
+    """
+    def __init__(self, cache_size=CACHE_SIZE):
+        self.cache_size = cache_size
+        self.cache = {}
+        self.invalid_count = 0
+        self.invalid_examples = []
+
+    def parse(self, timestamp_txt, default=None):
+        """
+        Returns the :class:`datetime` of `timestamp_txt`, or `default` if it
+        is 0 or invalid.
+        """
+        if isinstance(timestamp_txt, basestring):
+            try:
+                timestamp = self.cache[timestamp_txt]
+            except KeyError:
+                timestamp = self._parse(timestamp_txt)
+                if len(self.cache) >= self.cache_size:
+                    self.cache.clear()
+                self.cache[timestamp_txt] = timestamp
+        else:
+            timestamp = self._parse(timestamp_txt)
+        if timestamp is INVALID:
+            self.add_invalid(timestamp_txt)
+            return default
+        if timestamp is None:
+            return default
+        return timestamp
+
+    def _parse(self, timestamp_txt):
+        """
+        Returns the :class:`datetime` of `timestamp_txt`, None if it is 0 or
+        `INVALID`.
+        """
+        try:
+            try:
+                timestamp = int(timestamp_txt) / 1000
+                if timestamp == 0:
+                    return None
+            except ValueError:
+                return self._parse_iso(timestamp_txt)
+            else:
+                return datetime.fromtimestamp(timestamp)
+        except:
+            return INVALID
+
+    def _parse_iso(self, timestamp_txt):
+        try:
+            timestamp = parse_iso_timestamp(timestamp_txt)
+        except ValueError:
+            # The layout matched but the date is not valid. Let dateutil have
+            # the final say.
+            timestamp = None
+        if timestamp is None:
+            timestamp = parse_timestamp_dateutil(timestamp_txt)
+        return timestamp
+
+    def add_invalid(self, timestamp_txt):
+        self.invalid_count += 1
+        if (
+            len(self.invalid_examples) < NUM_INVALID_EXAMPLES and
+            timestamp_txt not in self.invalid_examples
+        ):
+            self.invalid_examples.append(timestamp_txt)
+
+    def pop_invalid(self):
+        """
+        Returns (invalid_count, invalid_examples) and resets them.
+        """
+        invalid = (self.invalid_count, self.invalid_examples)
+        self.invalid_count = 0
+        self.invalid_examples = []
+        return invalid
+
+
+def merge_invalid_timestamps(first, second):
+    """
+    Returns the combined (invalid_count, invalid_examples) of two results of
+    `TimestampParser.pop_invalid`.
+    """
+    examples = list(first[1])
+    for example in second[1]:
+        if len(examples) < NUM_INVALID_EXAMPLES and example not in examples:
+            examples.append(example)
+    return first[0] + second[0], examples
@@ -1,7 +1,148 @@
 from datetime import datetime
+from os.path import abspath, dirname, join
 
-BAD_WORDS_FILE = "./resources/bad_words.txt"
-BAD_WORDS_SET = set(open(BAD_WORDS_FILE).read().splitlines())
+RESOURCES_PATH = join(dirname(abspath(__file__)), "resources")
+BAD_WORDS_FILE = join(RESOURCES_PATH, "bad_words.txt")
+# The phrases of smss most associated with each label, built from the corpus
+# by `sms_phrases.py`.
+SMS_PHRASES_FILE = join(RESOURCES_PATH, "sms_phrases.json")
+
+# The labels the learned phrases are associated with.
+LABELS = ("defaulted", "repaid")
+# The number of folds users are assigned to by `user_fold`.
+NUM_FOLDS = 5
+
+_bad_words = None
+_learned_phrases = None
+
+
+def get_bad_words():
+    """
+    Returns the :class:`set` of the words of `BAD_WORDS_FILE`, read on first
+    use.
+    """
+    global _bad_words
+    if _bad_words is None:
+        with open(BAD_WORDS_FILE) as bad_words_file:
+            _bad_words = set(bad_words_file.read().splitlines())
+    return _bad_words
+
+
+def user_fold(user_id, num_folds=NUM_FOLDS):
+    """
+    Returns the fold of a user, stable across runs and machines.
+    """
+    import hashlib
+    digest = hashlib.md5(str(user_id)).hexdigest()
+    return int(digest[:8], 16) % num_folds
+
+
+def _label_phrases(lists):
+    return dict(
+        (label, [entry["phrase"] for entry in lists.get(label, [])])
+        for label in LABELS
+    )
+
+
+def read_learned_phrases():
+    """
+    Returns :class:`dict` mapping None and each fold of `SMS_PHRASES_FILE` to
+    its :class:`dict` of the phrases most associated with "defaulted" and
+    "repaid", read on first use. None has the phrases learned from every
+    labeled user and each fold those learned from the users of the other
+    folds. It only has None, with empty lists, until `sms_phrases.py` is run.
+    """
+    global _learned_phrases
+    if _learned_phrases is None:
+        import json
+        try:
+            with open(SMS_PHRASES_FILE) as phrases_file:
+                phrases = json.load(phrases_file)
+        except IOError:
+            phrases = {}
+        _learned_phrases = {None: _label_phrases(phrases)}
+        for fold, lists in enumerate(phrases.get("out_of_fold", [])):
+            _learned_phrases[fold] = _label_phrases(lists)
+    return _learned_phrases
+
+
+def get_learned_phrases(fold=None):
+    """
+    Returns :class:`dict` mapping "defaulted" and "repaid" to the list of the
+    phrases of `SMS_PHRASES_FILE` counted for the users of `fold`, see
+    `phrase_fold`. The lists are empty until `sms_phrases.py` is run.
+    """
+    return read_learned_phrases()[fold]
+
+
+def phrase_fold(user_id, status):
+    """
+    Returns the fold whose learned phrases are counted for a user: their
+    `user_fold` if they are labeled, so their features never count phrases
+    learned from their own label, or None, the phrases learned from every
+    labeled user, if they are not or `SMS_PHRASES_FILE` has no folds.
+    """
+    num_folds = len(read_learned_phrases()) - 1
+    if status not in LABELS or not num_folds:
+        return None
+    return user_fold(user_id, num_folds)
+
+
+def get_defaulted_phrases(fold=None):
+    return get_learned_phrases(fold)["defaulted"]
+
+
+def get_repaid_phrases(fold=None):
+    return get_learned_phrases(fold)["repaid"]
+
+
+# Phrases seen in loan reminder smss, e.g. "Sylviah, don't let a small debt
+# affect your credit history. You are 16 days late on your Branch loan! Honour
+# your debt of Ksh 852 to Paybill: 998608."
+LOAN_REMINDER_PHRASES = [
+    "days late",
+    "paybill",
+    "honour your debt",
+    "honor your debt",
+    "small debt",
+    "credit history",
+    "overdue",
+    "loan is due",
+    "repay",
+]
+# The `call_type` of outgoing calls in the call log, as in Android's
+# `CallLog.Calls.OUTGOING_TYPE`.
+OUTGOING_CALL_TYPES = ("2", 2)
+# The list `features.build_sms_message_stats` counts the bad words of. Its name
+# sorts first, so no other list takes its hits.
+BAD_WORDS_LIST = "bad_words"
+# The lists of words and phrases counted in sms bodies, keyed by the name used
+# in their `num_<name>_hits` feature. Add a list, or a function that loads it
+# on first use, here to count it. See `get_sms_phrase_lists`.
+SMS_PHRASE_LISTS = {
+    BAD_WORDS_LIST: get_bad_words,
+    "defaulted_phrases": get_defaulted_phrases,
+    "loan_reminder": LOAN_REMINDER_PHRASES,
+    "repaid_phrases": get_repaid_phrases,
+}
+# The lists of `SMS_PHRASE_LISTS` learned by `sms_phrases.py`, whose functions
+# take the `phrase_fold` of the user they are counted for.
+LEARNED_PHRASE_LISTS = ("defaulted_phrases", "repaid_phrases")
+
+
+def get_sms_phrase_lists(fold=None):
+    """
+    Returns :class:`dict` of `SMS_PHRASE_LISTS` with the lists that are
+    loaded on first use loaded, and the learned lists of the users of `fold`.
+    """
+    phrase_lists = {}
+    for name, phrases in SMS_PHRASE_LISTS.items():
+        if name in LEARNED_PHRASE_LISTS:
+            phrases = phrases(fold)
+        elif callable(phrases):
+            phrases = phrases()
+        phrase_lists[name] = phrases
+    return phrase_lists
 
 
 def next_valid_datetime(arr, i=0, key=None, reverse=False):
@@ -43,3 +184,14 @@ def next_valid_datetime(arr, i=0, key=None, reverse=False):
 
 def ave_or_none(total, count):
     return total / float(count) if count else None
+
+
+def parse_duration(duration):
+    """
+    Returns the duration of a call in seconds, or 0 if it is missing or
+    invalid.
+    """
+    try:
+        return int(duration or 0)
+    except (TypeError, ValueError):
+        return 0
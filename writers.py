@@ -0,0 +1,273 @@
+"""
+Writers of the output file of `generate_features.py`, one user's row at a
+time.
+
+The columns of the file are fixed before the first user is built, from the
+metadata of the extractors that run (see `features.output_columns`), so every
+run writes the same header in the same order and each row is written as soon
+as its user is done rather than once every user is. Rows are buffered and
+written `WRITE_BUFFER_ROWS` at a time, flushing the file after each batch, so
+only a batch of rows is ever held in memory and downstream jobs can read the
+rows written so far before the run ends.
+
+Besides csv, the rows can be written as Parquet or as an Arrow IPC stream,
+which let model training read only the columns it needs. Every batch is a
+Parquet row group or an Arrow record batch. The ids are strings, the counts
+int64 and the averages and ratios float64, see `features.column_types`. An
+Arrow stream can be read while it is written, a Parquet file only once it is
+closed. Both need pyarrow, which is only imported by the runs that write
+them:
+```
+pip install pyarrow
+```
+"""
+import csv
+from os.path import splitext
+from features import column_types
+# The pyarrow modules, imported by `import_pyarrow`.
+pa = None
+pq = None
+
+
+# The number of rows buffered before they are written and flushed.
+WRITE_BUFFER_ROWS = 256
+# The columns of every output file that are not features.
+ID_COLUMNS = ("user_id", "status")
+# Maps the extensions of an output path to the format written by default.
+FORMAT_EXTENSIONS = {
+    ".arrow": "arrow",
+    ".arrows": "arrow",
+    ".parquet": "parquet",
+}
+
+
+def import_pyarrow():
+    """
+    Imports pyarrow, on first use.
+
+    Raises:
+        ImportError if pyarrow is not installed.
+    """
+    global pa, pq
+    if pa is None:
+        import pyarrow
+        import pyarrow.parquet
+        pa, pq = pyarrow, pyarrow.parquet
+
+
+def pyarrow_installed():
+    """
+    Returns whether pyarrow is installed, importing it if it is.
+    """
+    try:
+        import_pyarrow()
+    except ImportError:
+        return False
+    return True
+
+
+class FeatureWriter(object):
+    """
+    Base class of the writers of the output file.
+
+    Parameters:
+        output_path (:class:`str`): The file to write.
+        fieldnames (:class:`list`): The columns of the file, in order. The
+            keys of the rows that are not columns are ignored and missing
+            keys are written empty.
+        buffer_rows (:class:`int`): The number of rows written at once.
+        types (:class:`dict`): Maps columns to :class:`int` or
+            :class:`float`, by default `features.column_types()`. Columns
+            missing from it are floats. Only the Arrow and Parquet writers
+            store the types.
+    """
+    def __init__(
+        self, output_path, fieldnames, buffer_rows=WRITE_BUFFER_ROWS,
+        types=None
+    ):
+        self.output_path = output_path
+        self.fieldnames = list(fieldnames)
+        self.buffer_rows = buffer_rows
+        if types is None:
+            types = column_types()
+        self.types = types
+        self.rows = []
+
+    def write_row(self, row):
+        """
+        Buffers a row, a :class:`dict` keyed by the columns, and writes the
+        buffered rows once there are `buffer_rows` of them.
+        """
+        self.rows.append(row)
+        if len(self.rows) >= self.buffer_rows:
+            self.flush()
+
+    def flush(self):
+        """
+        Writes the buffered rows and flushes the file.
+        """
+        if self.rows:
+            self.write_rows(self.rows)
+            self.rows = []
+
+    def write_rows(self, rows):
+        raise NotImplementedError
+
+    def close(self):
+        """
+        Writes the rows left in the buffer and closes the file.
+        """
+        raise NotImplementedError
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class CsvFeatureWriter(FeatureWriter):
+    """
+    Writes the rows as csv, starting with the header.
+    """
+    def __init__(
+        self, output_path, fieldnames, buffer_rows=WRITE_BUFFER_ROWS,
+        types=None
+    ):
+        super(CsvFeatureWriter, self).__init__(
+            output_path, fieldnames, buffer_rows, types
+        )
+        self.csvfile = open(output_path, "w")
+        self.writer = csv.DictWriter(
+            self.csvfile, fieldnames=self.fieldnames, extrasaction="ignore"
+        )
+        self.writer.writeheader()
+        self.csvfile.flush()
+
+    def write_rows(self, rows):
+        self.writer.writerows(rows)
+        self.csvfile.flush()
+
+    def close(self):
+        self.flush()
+        self.csvfile.close()
+
+
+class ArrowFeatureWriter(FeatureWriter):
+    """
+    Writes the rows as an Arrow IPC stream of record batches. The ids are
+    strings and every feature is a nullable int64 if it is a count or else a
+    nullable float64.
+    """
+    def __init__(
+        self, output_path, fieldnames, buffer_rows=WRITE_BUFFER_ROWS,
+        types=None
+    ):
+        super(ArrowFeatureWriter, self).__init__(
+            output_path, fieldnames, buffer_rows, types
+        )
+        import_pyarrow()
+        self.schema = pa.schema([
+            pa.field(name, self.arrow_type(name)) for name in self.fieldnames
+        ])
+        self.open()
+
+    def arrow_type(self, name):
+        if name in ID_COLUMNS:
+            return pa.string()
+        if self.types.get(name) is int:
+            return pa.int64()
+        return pa.float64()
+
+    def open(self):
+        self.sink = pa.OSFile(self.output_path, "wb")
+        self.writer = pa.RecordBatchStreamWriter(self.sink, self.schema)
+
+    def record_batch(self, rows):
+        arrays = []
+        for field in self.schema:
+            values = [row.get(field.name) for row in rows]
+            if field.name in ID_COLUMNS:
+                values = [
+                    None if value is None else str(value) for value in values
+                ]
+            arrays.append(pa.array(values, type=field.type))
+        return pa.RecordBatch.from_arrays(arrays, self.fieldnames)
+
+    def write_rows(self, rows):
+        self.writer.write_batch(self.record_batch(rows))
+        self.sink.flush()
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+        self.sink.close()
+
+
+class ParquetFeatureWriter(ArrowFeatureWriter):
+    """
+    Writes the rows as a Parquet file with a row group per batch.
+    """
+    def open(self):
+        self.writer = pq.ParquetWriter(self.output_path, self.schema)
+
+    def write_rows(self, rows):
+        self.writer.write_table(
+            pa.Table.from_batches([self.record_batch(rows)])
+        )
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+
+
+OUTPUT_FORMATS = {
+    "arrow": ArrowFeatureWriter,
+    "csv": CsvFeatureWriter,
+    "parquet": ParquetFeatureWriter,
+}
+
+
+def output_format(output_path):
+    """
+    Returns the format written to `output_path` by default, from its
+    extension, e.g. "parquet" for `feature_data.parquet`, or "csv".
+    """
+    return FORMAT_EXTENSIONS.get(splitext(output_path)[1].lower(), "csv")
+
+
+def check_output_format(output_path, format=None):
+    """
+    Returns `format`, or the format of the extension of `output_path` if it
+    is None.
+
+    Raises:
+        ValueError if the format is unknown or needs pyarrow and it is not
+        installed.
+    """
+    if format is None:
+        format = output_format(output_path)
+    if format not in OUTPUT_FORMATS:
+        raise ValueError("Unknown output format: {}".format(format))
+    if format != "csv" and not pyarrow_installed():
+        raise ValueError(
+            "Writing {} requires pyarrow, `pip install pyarrow`".format(format)
+        )
+    return format
+
+
+def open_feature_writer(
+    output_path, fieldnames, format=None, buffer_rows=WRITE_BUFFER_ROWS,
+    types=None
+):
+    """
+    Returns the :class:`FeatureWriter` of `format`, one of `OUTPUT_FORMATS`,
+    or of the extension of `output_path` if `format` is None. `types` maps
+    columns to their types, see :class:`FeatureWriter`.
+
+    Raises:
+        ValueError if the format is unknown or needs pyarrow and it is not
+        installed.
+    """
+    format = check_output_format(output_path, format)
+    return OUTPUT_FORMATS[format](output_path, fieldnames, buffer_rows, types)